@@ -16,13 +16,15 @@ from .exceptions import InvalidUsageException
 from .exceptions import raise_for_invalid_channel
 from .managers.progress import Status
 
+from .utils.csvfiles import open_csv
 from .utils.downloader import get_archive_filename
-from .utils.jsontrees import build_tree_from_json
+from .utils.jsontrees import build_tree_from_json_file
 from .utils.jsontrees import get_channel_node_from_json
-from .utils.jsontrees import read_tree_from_json
+from .utils.jsontrees import read_tree_root_from_json
+from .utils.jsontrees import write_channel_tree_to_json
 from .utils.linecook import build_ricecooker_json_tree
 from .utils.linecook import FolderExistsAction
-from .utils.metadata_provider import CsvMetadataProvider
+from .utils.metadata_provider import CsvMetadataProvider, ExcelMetadataProvider
 from .utils.metadata_provider import DEFAULT_CHANNEL_INFO_FILENAME
 from .utils.metadata_provider import DEFAULT_CONTENT_INFO_FILENAME
 from .utils.metadata_provider import DEFAULT_EXERCISE_QUESTIONS_INFO_FILENAME
@@ -44,6 +46,7 @@ class SushiChef(object):
     """
     CHEF_RUN_DATA = config.CHEF_DATA_DEFAULT  # loaded from chefdata/chef_data.json
     TREES_DATA_DIR = config.TREES_DATA_DIR    # tree archives and JsonTreeChef inputs
+    METADATA_CACHE_PATH = os.path.join('chefdata', 'data', 'content_metadata_cache.json')  # parsed content_metadata.csv
 
     def __init__(self, *args, **kwargs):
         """
@@ -280,9 +283,19 @@ class SushiChef(object):
 
         
     def save_channel_tree_as_json(self, channel):
-        filename = os.path.join(self.TREES_DATA_DIR, '{}.json'.format(self.CHEF_RUN_DATA['current_run']))
+        """
+        Archive the json tree of `channel` in TREES_DATA_DIR. The tree is written
+        one node at a time; set the chef setting 'compact-tree-archives' to skip
+        the indentation, and 'compress-tree-archives' to save it as .json.gz.
+        """
+        extension = '.json.gz' if self.get_setting('compress-tree-archives', False) else '.json'
+        filename = os.path.join(self.TREES_DATA_DIR, '{}{}'.format(self.CHEF_RUN_DATA['current_run'], extension))
         os.makedirs(self.TREES_DATA_DIR, exist_ok=True)
-        json.dump(channel.get_json_tree(), open(filename, 'w'), indent=2)
+        channel.compute_ids()
+        if self.get_setting('compact-tree-archives', False):
+            write_channel_tree_to_json(filename, channel, indent=None, separators=(',', ':'))
+        else:
+            write_channel_tree_to_json(filename, channel, indent=2)
         self.CHEF_RUN_DATA['tree_archives']['previous'] = self.CHEF_RUN_DATA['tree_archives']['current']
         self.CHEF_RUN_DATA['tree_archives']['current'] = filename.replace(os.getcwd() + '/', '')
         self.save_chef_data()
@@ -291,51 +304,96 @@ class SushiChef(object):
         # create data folder in chefdata
         DATA_DIR = os.path.join('chefdata', 'data')
         os.makedirs(DATA_DIR, exist_ok = True)
-        metadata_csv = csv.writer(open(os.path.join(DATA_DIR, 'content_metadata.csv'), 'w', newline='', encoding='utf-8'))
-        metadata_csv.writerow(config.CSV_HEADERS)
+        # set the chef setting 'compress-metadata-csv' to save content_metadata.csv.gz instead
+        filename = 'content_metadata.csv.gz' if self.get_setting('compress-metadata-csv', False) else 'content_metadata.csv'
+        csv_path = os.path.join(DATA_DIR, filename)
+        title_index, description_index, tags_index = [config.CSV_HEADERS.index(header) for header in ('New Title', 'New Description', 'New Tags')]
+        metadata_dict = dict()
+
+        def _collect_modifications(rows):
+            # the modifications that load_channel_metadata_from_csv will parse from the rows
+            for row in rows:
+                modifications = self._get_metadata_modifications(row[title_index], row[description_index], row[tags_index])
+                if modifications:
+                    metadata_dict[row[0]] = modifications
+                yield row
 
-        channel.save_channel_children_to_csv(metadata_csv)
+        with open_csv(csv_path, 'w') as csv_file:
+            metadata_csv = csv.writer(csv_file)
+            metadata_csv.writerow(config.CSV_HEADERS)
+            metadata_csv.writerows(_collect_modifications(channel.iter_metadata_csv_rows()))
+        self._save_metadata_cache(csv_path, metadata_dict)
 
     def load_channel_metadata_from_csv(self):
         metadata_dict = dict()
         metadata_csv = None
         CSV_FILE_PATH = os.path.join('chefdata', 'data', 'content_metadata.csv')
+        if not os.path.exists(CSV_FILE_PATH) and os.path.exists(CSV_FILE_PATH + '.gz'):
+            CSV_FILE_PATH += '.gz'
         if os.path.exists(CSV_FILE_PATH):
-            metadata_csv = csv.DictReader(open(CSV_FILE_PATH, 'r', encoding='utf-8'))
-            for line in metadata_csv:
-                # Add to metadata_dict any updated data. Skip if none
-                line_source_id = line['Source ID']
-                line_new_title = line['New Title']
-                line_new_description = line['New Description']
-                line_new_tags = line['New Tags']
-                if line_new_title != '' or line_new_description != '' or line_new_tags != '':
-                    metadata_dict[line_source_id] = {}
-                    if line_new_title != '':
-                        metadata_dict[line_source_id]['New Title'] = line_new_title
-                    if line_new_description != '':
-                        metadata_dict[line_source_id]['New Description'] = line_new_description
-                    if line_new_tags != '':
-                        tags_arr = re.split(',| ,', line_new_tags)
-                        metadata_dict[line_source_id]['New Tags'] = tags_arr
+            # skip parsing the csv if it hasn't been edited since it was saved or last parsed
+            cached_metadata_dict = self._load_metadata_cache(CSV_FILE_PATH)
+            if cached_metadata_dict is not None:
+                return cached_metadata_dict
+            with open_csv(CSV_FILE_PATH) as csv_file:
+                metadata_csv = csv.DictReader(csv_file)
+                for line in metadata_csv:
+                    # Add to metadata_dict any updated data. Skip if none
+                    modifications = self._get_metadata_modifications(line['New Title'], line['New Description'], line['New Tags'])
+                    if modifications:
+                        metadata_dict[line['Source ID']] = modifications
+            self._save_metadata_cache(CSV_FILE_PATH, metadata_dict)
         return metadata_dict
 
-    def save_chef_data(self):
-        json.dump(self.CHEF_RUN_DATA, open(config.DATA_PATH, 'w'), indent=2)
+    def _get_metadata_modifications(self, new_title, new_description, new_tags):
+        modifications = {}
+        if new_title != '':
+            modifications['New Title'] = new_title
+        if new_description != '':
+            modifications['New Description'] = new_description
+        if new_tags != '':
+            modifications['New Tags'] = re.split(',| ,', new_tags)
+        return modifications
+
+    def _get_metadata_cache_key(self, csv_path):
+        stat = os.stat(csv_path)
+        return [csv_path, stat.st_mtime_ns, stat.st_size]
+
+    def _load_metadata_cache(self, csv_path):
+        """
+        Return the metadata parsed from the content metadata csv at `csv_path`
+        if it is cached in METADATA_CACHE_PATH and the file hasn't changed since.
+        """
+        if not os.path.exists(self.METADATA_CACHE_PATH):
+            return None
+        try:
+            with open(self.METADATA_CACHE_PATH, encoding='utf-8') as cache_file:
+                cache = json.load(cache_file)
+        except ValueError:
+            return None
+        if cache.get('key') != self._get_metadata_cache_key(csv_path):
+            return None
+        return cache['metadata']
+
+    def _save_metadata_cache(self, csv_path, metadata_dict):
+        cache = {'key': self._get_metadata_cache_key(csv_path), 'metadata': metadata_dict}
+        with open(self.METADATA_CACHE_PATH, 'w', encoding='utf-8') as cache_file:
+            json.dump(cache, cache_file)
 
     def apply_modifications(self, contentNode, metadata_dict = {}):
         # Skip if no metadata file passed in or no updates in metadata_dict
         if metadata_dict == {}:
             return
-            
-        is_channel = isinstance(contentNode, ChannelNode)
 
-        if not is_channel:
-            # Add modifications to contentNode
-            if contentNode.source_id in metadata_dict:
-                contentNode.node_modifications = metadata_dict[contentNode.source_id]
-        for child in contentNode.children:
-            self.apply_modifications(child, metadata_dict)
+        # look up the nodes to modify in the source_id index of the tree
+        for source_id, modifications in metadata_dict.items():
+            for node in contentNode.get_nodes_by_source_id(source_id):
+                if not isinstance(node, nodes.ChannelNode):
+                    # Add modifications to node
+                    node.node_modifications = modifications
 
+    def save_chef_data(self):
+        json.dump(self.CHEF_RUN_DATA, open(config.DATA_PATH, 'w'), indent=2)
 
     def pre_run(self, args, options):
         """
@@ -442,7 +500,7 @@ class JsonTreeChef(SushiChef):
     def get_channel(self, **kwargs):
         # Load channel info from json_tree
         json_tree_path = self.get_json_tree_path(**kwargs)
-        json_tree = read_tree_from_json(json_tree_path)
+        json_tree = read_tree_root_from_json(json_tree_path)
         channel = get_channel_node_from_json(json_tree)
         return channel
 
@@ -452,8 +510,7 @@ class JsonTreeChef(SushiChef):
         """
         channel = self.get_channel(**kwargs)
         json_tree_path = self.get_json_tree_path(**kwargs)
-        json_tree = read_tree_from_json(json_tree_path)
-        build_tree_from_json(channel, json_tree['children'])
+        build_tree_from_json_file(json_tree_path, channel)
         raise_for_invalid_channel(channel)
         return channel
 
@@ -470,6 +527,9 @@ class LineCook(JsonTreeChef):
     Folders and CSV files can be creaed by hand or by a `souschef` script.
     """
     metadata_provider = None
+    CSV_METADATA_SNAPSHOT_PATH = os.path.join('chefdata', 'data', 'csv_metadata_snapshot.pickle')  # parsed CSV metadata
+    PROBE_CACHE_PATH = os.path.join('chefdata', 'data', 'file_probe_cache.json')  # metadata embedded in channeldir files
+    FOLDER_CACHE_PATH = os.path.join('chefdata', 'data', 'linecook_folder_cache.json')  # nodes built for each folder
 
     def __init__(self, *args, **kwargs):
         super(LineCook, self).__init__(*args, **kwargs)
@@ -502,18 +562,41 @@ class LineCook(JsonTreeChef):
             default=DEFAULT_EXERCISE_QUESTIONS_INFO_FILENAME,
             help='Filename for execise questions metadata (assumed to be sibling of channeldir)')
         self.arg_parser.add_argument('--generate', action='store_true',
-            help='Generate metadata files from directory stucture.')
+            help='Generate metadata files from directory stucture (.csv files only).')
+        self.arg_parser.add_argument('--probe', action='store_true',
+            help='With --generate, fill in titles, authors, descriptions and languages from the metadata embedded in files.')
+        self.arg_parser.add_argument('--incremental', action='store_true',
+            help='Reuse the nodes built in the previous run for the folders whose files and metadata did not change.')
         self.arg_parser.add_argument('--importstudioid',
             help='Generate CSV metadata from a specified studio_id (e.g. studio_id of main_tree for some channel)')
 
+    def _check_generated_metadata_filenames(self, args, option):
+        # the metadata files are generated as CSV, which ExcelMetadataProvider couldn't read back
+        for name in ['channelinfo', 'contentinfo', 'exercisesinfo', 'questionsinfo']:
+            if args[name].endswith('.xlsx'):
+                raise ValueError('{} can only generate .csv metadata files, but --{} is {}'.format(
+                    option, name, args[name]))
+
 
     def _init_metadata_provider(self, args, options):
+        snapshot_path = None
+        if self.get_setting('csv-metadata-snapshot', False):
+            os.makedirs(os.path.dirname(self.CSV_METADATA_SNAPSHOT_PATH), exist_ok=True)
+            snapshot_path = self.CSV_METADATA_SNAPSHOT_PATH
         if args['contentinfo'].endswith('.csv'):
             metadata_provider = CsvMetadataProvider(args['channeldir'],
                                                     channelinfo=args['channelinfo'],
                                                     contentinfo=args['contentinfo'],
                                                     exercisesinfo=args['exercisesinfo'],
-                                                    questionsinfo=args['questionsinfo'])
+                                                    questionsinfo=args['questionsinfo'],
+                                                    snapshot_path=snapshot_path)
+        elif args['contentinfo'].endswith('.xlsx'):
+            metadata_provider = ExcelMetadataProvider(args['channeldir'],
+                                                      channelinfo=args['channelinfo'],
+                                                      contentinfo=args['contentinfo'],
+                                                      exercisesinfo=args['exercisesinfo'],
+                                                      questionsinfo=args['questionsinfo'],
+                                                      snapshot_path=snapshot_path)
         else:
             raise ValueError('Uknown contentinfo file format ' + args['contentinfo'])
         self.metadata_provider = metadata_provider
@@ -523,6 +606,7 @@ class LineCook(JsonTreeChef):
         This function is called before `run` in order to build the json tree.
         """
         if 'generate' in args and args['generate']:
+            self._check_generated_metadata_filenames(args, '--generate')
             self.metadata_provider = CsvMetadataProvider(args['channeldir'],
                                                     channelinfo=args['channelinfo'],
                                                     contentinfo=args['contentinfo'],
@@ -530,12 +614,17 @@ class LineCook(JsonTreeChef):
                                                     questionsinfo=args['questionsinfo'],
                                                     validate_and_cache=False)
             self.metadata_provider.generate_templates(exercise_questions=True)
-            self.metadata_provider.generate_contentinfo_from_channeldir(args, options)
+            probe_cache_path = None
+            if args.get('probe'):
+                os.makedirs(os.path.dirname(self.PROBE_CACHE_PATH), exist_ok=True)
+                probe_cache_path = self.PROBE_CACHE_PATH
+            self.metadata_provider.generate_contentinfo_from_channeldir(args, options, probe_cache_path=probe_cache_path)
             sys.exit(0)
 
         elif 'importstudioid' in args and args['importstudioid']:
             studio_id = args['importstudioid']
             config.LOGGER.info("Calling with importstudioid... " + studio_id)
+            self._check_generated_metadata_filenames(args, '--importstudioid')
             self.metadata_provider = CsvMetadataProvider(args['channeldir'],
                                                     channelinfo=args['channelinfo'],
                                                     contentinfo=args['contentinfo'],
@@ -552,7 +641,11 @@ class LineCook(JsonTreeChef):
         kwargs.update(args)
         kwargs.update(options)
         json_tree_path = self.get_json_tree_path(**kwargs)
-        build_ricecooker_json_tree(args, options, self.metadata_provider, json_tree_path)
+        cache_path = None
+        if args.get('incremental'):
+            os.makedirs(os.path.dirname(self.FOLDER_CACHE_PATH), exist_ok=True)
+            cache_path = self.FOLDER_CACHE_PATH
+        build_ricecooker_json_tree(args, options, self.metadata_provider, json_tree_path, cache_path=cache_path)
 
 
 class YouTubeSushiChef(SushiChef):
@@ -2,7 +2,9 @@
 from __future__ import unicode_literals
 
 from cachecontrol.caches.file_cache import FileCache
+from concurrent.futures import ThreadPoolExecutor
 import hashlib
+from io import BytesIO
 import os
 from PIL import Image
 import json
@@ -34,6 +36,7 @@ from pressurecooker.youtube import YouTubeResource
 
 from .. import config
 from ..exceptions import UnknownFileTypeError
+from .slots import intern_str
 
 # Cache for filenames
 FILECACHE = FileCache(config.FILECACHE_DIRECTORY, use_dir_lock=True, forever=True)
@@ -343,6 +346,7 @@ def download_from_web(web_url, download_settings, file_format=file_formats.MP4,
 
 
 class ThumbnailPresetMixin(object):
+    __slots__ = ()
 
     def get_preset(self):
         thumbnail_preset = self.node.get_thumbnail_preset()
@@ -352,31 +356,36 @@ class ThumbnailPresetMixin(object):
 
 
 class File(object):
-    original_filename = None
-    node = None
-    error = None
+    # `__dict__` is kept in the slots so subclasses and chefs can add attributes
+    __slots__ = ('preset', 'language', 'source_url', 'original_filename', 'node', 'error', 'filename',
+                 'assessment_item', '__dict__', '__weakref__')
     default_ext = None
-    filename = None
-    language = None
-    assessment_item = None
     is_primary = False
 
     def __init__(self, preset=None, language=None, default_ext=None, source_url=None):
-        self.preset = preset
+        self.preset = intern_str(preset)
+        self.language = None
         self.set_language(language)
-        self.default_ext = default_ext or self.default_ext
+        if default_ext:
+            self.default_ext = default_ext
         self.source_url = source_url
+        # subclasses can set these before calling File.__init__
+        self.original_filename = getattr(self, 'original_filename', None)
+        self.filename = getattr(self, 'filename', None)
+        self.node = None
+        self.error = None
+        self.assessment_item = None
 
     def set_language(self, language):
         """ Set self.language to internal lang. repr. code from str or Language object. """
         if isinstance(language, str):
             language_obj = languages.getlang(language)
             if language_obj:
-                self.language = language_obj.code
+                self.language = intern_str(language_obj.code)
             else:
                 raise TypeError("Language code {} not found".format(language))
         if isinstance(language, languages.Language):
-            self.language = language.code
+            self.language = intern_str(language.code)
 
     def validate(self):
         pass
@@ -424,6 +433,7 @@ class File(object):
 
 
 class DownloadFile(File):
+    __slots__ = ('path',)
     allowed_formats = []
 
     def __init__(self, path, **kwargs):
@@ -458,6 +468,7 @@ class DownloadFile(File):
 
 
 class SlideImageFile(DownloadFile):
+    __slots__ = ('caption', 'descriptive_text')
     default_ext = file_formats.PNG
     allowed_formats = [file_formats.JPG, file_formats.JPEG, file_formats.PNG]
     is_primary = True
@@ -554,6 +565,7 @@ class H5PFile(DownloadFile):
 
 
 class VideoFile(DownloadFile):
+    __slots__ = ('ffmpeg_settings',)
     default_ext = file_formats.MP4
     allowed_formats = [file_formats.MP4]
     is_primary = True
@@ -613,6 +625,7 @@ class VideoFile(DownloadFile):
 
 
 class WebVideoFile(File):
+    __slots__ = ('web_url', 'download_settings')
     is_primary = True
     # In future, look into postprocessors and progress_hooks
     def __init__(self, web_url, download_settings=None, high_resolution=False, maxheight=None, **kwargs):
@@ -691,6 +704,8 @@ class YouTubeSubtitleFile(File):
     Use the helper method `is_youtube_subtitle_file_supported_language` to check
     if `language` is a supported code before creating the `YouTubeSubtitleFile`.
     """
+    __slots__ = ('youtube_url', 'youtube_language')
+
     def __init__(self, youtube_id, language=None, **kwargs):
         self.youtube_url = 'http://www.youtube.com/watch?v={}'.format(youtube_id)
         if isinstance(language, languages.Language):
@@ -726,6 +741,7 @@ class YouTubeSubtitleFile(File):
 
 
 class SubtitleFile(DownloadFile):
+    __slots__ = ('subtitlesformat',)
     default_ext = file_formats.VTT
 
     def __init__(self, path, **kwargs):
@@ -821,6 +837,7 @@ class SubtitleFile(DownloadFile):
 
 
 class Base64ImageFile(ThumbnailPresetMixin, File):
+    __slots__ = ('encoding',)
 
     def __init__(self, encoding, **kwargs):
         self.encoding = encoding
@@ -910,30 +927,74 @@ class _ExerciseGraphieFile(DownloadFile):
 
     def generate_graphie_file(self):
         key = "GRAPHIE: {}".format(self.path)
+        validators_key = "GRAPHIE VALIDATORS: {}".format(self.path)
 
         cache_file = get_cache_filename(key)
         if not config.UPDATE and cache_file:
             return cache_file
 
-        # Create graphie file combining svg and json files
-        with tempfile.TemporaryFile() as tempf:
-            # Initialize hash and files
-            delimiter = bytes(exercises.GRAPHIE_DELIMITER, 'UTF-8')
-            config.LOGGER.info("\tDownloading graphie {}".format(self.original_filename))
+        # ETag/Last-Modified headers of the parts used to create `cache_file`
+        validators = {}
+        cached_validators = FILECACHE.get(validators_key)
+        if cache_file and cached_validators:
+            validators = json.loads(cached_validators.decode('utf-8'))
+
+        # Download svg and json parts concurrently, revalidating cached parts
+        config.LOGGER.info("\tDownloading graphie {}".format(self.original_filename))
+        part_paths = [self.path + ".svg", self.path + "-data.json"]
+        with ThreadPoolExecutor(max_workers=len(part_paths)) as executor:
+            results = list(executor.map(lambda p: fetch_graphie_part(p, validators.get(p)), part_paths))
+        if all(content is None for content, _ in results):
+            config.LOGGER.info("\tUsing cached graphie (not modified): {}".format(self.path))
+            return cache_file
 
+        # Create graphie file combining svg and json files
+        delimiter = bytes(exercises.GRAPHIE_DELIMITER, 'UTF-8')
+        contents = [content for content, _ in results]
+        if None in contents:
+            # Recover the parts that were not modified from the cached graphie file
+            with open(config.get_storage_path(cache_file), 'rb') as cachedf:
+                cached_parts = cachedf.read().split(delimiter)
+            if len(cached_parts) != len(contents):
+                validators = {}
+                results = [fetch_graphie_part(path) for path in part_paths]
+                contents = [content for content, _ in results]
+            else:
+                contents = [content if content is not None else cached_part
+                            for content, cached_part in zip(contents, cached_parts)]
+        assert contents[0], "File failed to write (corrupted)."
+        graphie_data = contents[0] + delimiter + contents[1]
+        filename = "{}.{}".format(hashlib.md5(graphie_data).hexdigest(), file_formats.GRAPHIE)
+        copy_file_to_storage(filename, BytesIO(graphie_data))
 
-            # Write to graphie file
-            hash = write_and_get_hash(self.path + ".svg", tempf)
-            tempf.write(delimiter)
-            hash.update(delimiter)
-            hash = write_and_get_hash(self.path + "-data.json", tempf, hash)
-            tempf.seek(0)
-            filename = "{}.{}".format(hash.hexdigest(), file_formats.GRAPHIE)
+        FILECACHE.set(key, bytes(filename, "utf-8"))
+        new_validators = {path: part_validators for path, (_, part_validators) in zip(part_paths, results) if part_validators}
+        FILECACHE.set(validators_key, bytes(json.dumps(new_validators), "utf-8"))
+        return filename
 
-            copy_file_to_storage(filename, tempf)
 
-            FILECACHE.set(key, bytes(filename, "utf-8"))
-            return filename
+def fetch_graphie_part(path, validators=None):
+    """
+    Get the contents of one part (.svg or -data.json) of a graphie at `path`.
+    When `validators` (the ETag and Last-Modified headers of a previous response)
+    are given, a conditional GET is done instead and `None` is returned as the
+    contents if the part was not modified since then.
+    :return: (contents, validators) where `contents` are bytes or None
+    """
+    if not is_valid_url(path):
+        with open(path, 'rb') as fobj:
+            return fobj.read(), None
+    headers = {}
+    if validators and validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators and validators.get('last-modified'):
+        headers['If-Modified-Since'] = validators['last-modified']
+    r = config.DOWNLOAD_SESSION.get(path, headers=headers)
+    if headers and r.status_code == 304:
+        return None, validators
+    r.raise_for_status()
+    new_validators = {name: r.headers[name] for name in ['etag', 'last-modified'] if name in r.headers}
+    return r.content, new_validators
 
 
 
@@ -1014,6 +1075,7 @@ class ExtractedAudioThumbnailFile(ExtractedThumbnailFile):
 
 
 class TiledThumbnailFile(ThumbnailPresetMixin, File):
+    __slots__ = ('sources',)
     allowed_formats = [file_formats.JPG, file_formats.JPEG, file_formats.PNG]
 
     def __init__(self, source_nodes, **kwargs):
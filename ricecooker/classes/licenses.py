@@ -2,6 +2,7 @@
 
 from ..exceptions import UnknownLicenseError
 from .. import config
+from .slots import intern_str
 from le_utils.constants import licenses
 
 
@@ -29,14 +30,17 @@ def get_license(license_id, copyright_holder=None, description=None):
 
 
 class License(object):
+    __slots__ = (
+        'copyright_holder', # (str): name of person or organization who owns license (optional)
+        'description', # (str): description of the license (optional)
+        '__dict__',
+    )
     license_id = None # (str): content's license based on le_utils.constants.licenses
-    copyright_holder = None # (str): name of person or organization who owns license (optional)
-    description = None # (str): description of the license (optional)
     require_copyright_holder = True
 
     def __init__(self, copyright_holder=None, description=None):
-        self.copyright_holder = copyright_holder or ""
-        self.description = description
+        self.copyright_holder = intern_str(copyright_holder) or ""
+        self.description = intern_str(description)
 
     def get_id(self):
         return self.license_id
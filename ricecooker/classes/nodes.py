@@ -4,29 +4,148 @@ import json
 import uuid
 import os
 import csv
+import re
+from collections import Counter
 
 from le_utils.constants import content_kinds, exercises, file_formats, format_presets, languages, roles
 
 from .licenses import License
+from .questions import prefetch_images
+from .slots import get_attributes, intern_str
 from .. import config, __version__
-from ..exceptions import InvalidNodeException
+from ..exceptions import InvalidNodeException, InvalidQuestionException, InvalidTreeException
+from ..utils.traversal import iter_postorder, iter_preorder, iter_preorder_with_depth
 
 MASTERY_MODELS = [id for id, name in exercises.MASTERY_MODELS]
 ROLES = [id for id, name in roles.choices]
 
+
+class TreeStats(object):
+    """ Aggregate stats of a subtree: number of nodes of each kind and number of files """
+    __slots__ = ('kinds', 'files')
+
+    def __init__(self, kinds=None, files=0):
+        self.kinds = Counter(kinds)
+        self.files = files
+
+    @property
+    def nodes(self):
+        return sum(self.kinds.values())
+
+    def add(self, other):
+        self.kinds.update(other.kinds)
+        self.files += other.files
+
+    def subtract(self, other):
+        for kind, count in other.kinds.items():
+            self.kinds[kind] -= count
+            if not self.kinds[kind]:
+                del self.kinds[kind]
+        self.files -= other.files
+
+    def __str__(self):
+        kinds = ", ".join("{} {}".format(count, kind) for kind, count in sorted(self.kinds.items()) if count)
+        return "{kinds}; {files} files".format(kinds=kinds, files=self.files)
+
+
+def _get_processed_file_size(file):
+    if file.filename:
+        path = config.get_storage_path(file.filename)
+        if os.path.isfile(path):
+            return os.path.getsize(path)
+    return 0
+
+
+class _NodeList(list):
+    """ The list of children or files of a node. Node methods modify it with the `list`
+        methods and update the node's cached stats and indexes themselves; any other change
+        to it (e.g. `node.children.append(child)` in a chef) invalidates them instead. """
+    __slots__ = ('_owner',)
+
+    def __init__(self, items=(), owner=None):
+        self._owner = owner
+        super(_NodeList, self).__init__(items)
+
+    def __reduce__(self):
+        return (_NodeList, (list(self), self._owner))
+
+    def _changed(self):
+        if self._owner is not None:
+            self._owner._on_list_changed(self)
+
+    def append(self, item):
+        super(_NodeList, self).append(item)
+        self._changed()
+
+    def extend(self, items):
+        super(_NodeList, self).extend(items)
+        self._changed()
+
+    def insert(self, index, item):
+        super(_NodeList, self).insert(index, item)
+        self._changed()
+
+    def remove(self, item):
+        super(_NodeList, self).remove(item)
+        self._changed()
+
+    def pop(self, *args):
+        item = super(_NodeList, self).pop(*args)
+        self._changed()
+        return item
+
+    def clear(self):
+        super(_NodeList, self).clear()
+        self._changed()
+
+    def sort(self, *args, **kwargs):
+        super(_NodeList, self).sort(*args, **kwargs)
+        self._changed()
+
+    def reverse(self):
+        super(_NodeList, self).reverse()
+        self._changed()
+
+    def __setitem__(self, index, value):
+        super(_NodeList, self).__setitem__(index, value)
+        self._changed()
+
+    def __delitem__(self, index):
+        super(_NodeList, self).__delitem__(index)
+        self._changed()
+
+    def __iadd__(self, items):
+        super(_NodeList, self).__iadd__(items)
+        self._changed()
+        return self
+
+    def __imul__(self, n):
+        super(_NodeList, self).__imul__(n)
+        self._changed()
+        return self
+
+
 class Node(object):
     """ Node: model to represent all nodes in the tree """
+    # Nodes use __slots__ to keep large trees compact; `__dict__` is kept so
+    # that chefs can still set arbitrary attributes on nodes.
+    __slots__ = ('_files', '_file_ids', '_children', 'descendants', 'parent', 'node_id', 'content_id', 'title', 'language',
+                 'description', 'derive_thumbnail', 'thumbnail', 'node_modifications', '_stats', '_source_id_index',
+                 '__dict__', '__weakref__')
     license = None
-    language = None
 
     def __init__(self, title, language=None, description=None, thumbnail=None, files=None, derive_thumbnail=False, node_modifications = {}):
-        self.files = []
-        self.children = []
-        self.descendants = []
+        self._files = _NodeList(owner=self)
+        self._file_ids = None  # index of the files of nodes with many files, see has_file
+        self._children = _NodeList(owner=self)
+        self._stats = None  # cached TreeStats of nodes with children, see get_stats
+        self._source_id_index = None  # {source_id: [nodes]} of the subtree, see get_nodes_by_source_id
+        self.descendants = None  # computed on demand by get_non_topic_descendants
         self.parent = None
         self.node_id = None
         self.content_id = None
         self.title = title
+        self.language = None
         self.set_language(language)
         self.description = description or ""
         self.derive_thumbnail = derive_thumbnail
@@ -43,11 +162,11 @@ class Node(object):
         if isinstance(language, str):
             language_obj = languages.getlang(language)
             if language_obj:
-                self.language = language_obj.code
+                self.language = intern_str(language_obj.code)
             else:
                 raise TypeError("Language code {} not found".format(language))
         if isinstance(language, languages.Language):
-            self.language = language.code
+            self.language = intern_str(language.code)
 
     def __str__(self):
         count = self.count()
@@ -62,6 +181,7 @@ class Node(object):
         if self.source_id and len(self.source_id) > config.MAX_SOURCE_ID_LENGTH:
             config.print_truncate("source_id", self.source_id, self.source_id, kind=self.kind)
             self.source_id = self.source_id[:config.MAX_SOURCE_ID_LENGTH]
+            self.reset_ids()  # ids are derived from source_id
 
         for f in self.files:
             f.truncate_fields()
@@ -73,14 +193,84 @@ class Node(object):
         """
         pass
 
+    @property
+    def children(self):
+        """ List of child nodes. add_child and remove_child update the cached subtree
+            stats, while other changes to the list make them be computed again. """
+        return self._children
+
+    @children.setter
+    def children(self, children):
+        self._children = _NodeList(children, owner=self)
+        self._on_list_changed(self._children)
+
+    @property
+    def files(self):
+        """ List of the node's files. add_file updates the cached subtree stats, while
+            other changes to the list make them be computed again. """
+        return self._files
+
+    @files.setter
+    def files(self, files):
+        self._files = _NodeList(files, owner=self)
+        self._on_list_changed(self._files)
+
+    def _on_list_changed(self, node_list):
+        """ Called by the children and files lists when they are changed directly """
+        if node_list is self._files:
+            self._file_ids = None
+        else:
+            self._invalidate_source_id_indexes()
+        self._invalidate_stats()
+
     def add_child(self, node):
         """ add_child: Adds child node to node
             Args: node to add as child
             Returns: None
         """
         assert isinstance(node, Node), "Child node must be a subclass of Node"
+        if node.node_id is not None:
+            node.reset_ids()  # node ids depend on the parent's node id
+        if not self._children and self.parent is not None and self.parent._stats is not None:
+            self._stats = self._get_own_stats()  # no longer a leaf, cache stats like its ancestors
         node.parent = self
-        self.children += [node]
+        list.append(self._children, node)
+        self._invalidate_source_id_indexes()
+        self._add_to_stats(node.get_stats())
+
+    def remove_child(self, node):
+        """ remove_child: Removes child node from node
+            Args: node to remove
+            Returns: None
+        """
+        list.remove(self._children, node)
+        self._invalidate_source_id_indexes()
+        node.parent = None
+        node.reset_ids()
+        self._add_to_stats(node.get_stats(), subtract=True)
+        if not self._children:
+            self._stats = None
+
+    def compute_ids(self):
+        """ compute_ids: Compute the node and content ids of all nodes in this tree
+            in a single top-down pass, so each id is only hashed once and then
+            cached (parents' ids are always available when computing a child's)
+            Args: None
+            Returns: None
+        """
+        for node in iter_preorder(self):
+            node.get_node_id()
+            node.get_content_id()
+
+    def reset_ids(self):
+        """ reset_ids: Clear the cached node and content ids of this node and of
+            all its descendants, e.g. after the node is moved in the tree
+            Args: None
+            Returns: None
+        """
+        for node in iter_preorder(self):
+            node.node_id = None
+            node.content_id = None
 
     def add_file(self, file_to_add):
         """ add_file: Add to node's associated files
@@ -90,8 +280,23 @@ class Node(object):
         from .files import File
         assert isinstance(file_to_add, File), "Files being added must be instances of a subclass of File class"
         file_to_add.node = self
-        if file_to_add not in self.files:
-            self.files.append(file_to_add)
+        if not self.has_file(file_to_add):
+            list.append(self._files, file_to_add)
+            if self._file_ids is not None:
+                self._file_ids.add(id(file_to_add))
+            self._add_to_stats(TreeStats(files=1))
+
+    def has_file(self, file):
+        """ has_file: Check if `file` (the same File object) is one of the node's files
+            Args: file (File): file model to look for
+            Returns: boolean
+        """
+        if len(self._files) < 16:
+            return any(f is file for f in self._files)
+        # Use an index of the file ids for nodes with many files (e.g. slideshows)
+        if self._file_ids is None or len(self._file_ids) != len(self._files):
+            self._file_ids = set(id(f) for f in self._files)
+        return id(file) in self._file_ids
 
     def generate_thumbnail(self):
         """Each node subclass implements its own thumbnail generation logic.
@@ -172,30 +377,102 @@ class Node(object):
             Args: None
             Returns: int
         """
-        total = len(self.children)
-        for child in self.children:
-            total += child.count()
-        return total
+        return self.get_stats().nodes - 1
 
     def get_topic_count(self):
         """ get_topic_count: get number of topics in tree
             Args: None
             Returns: int
         """
-        total = 0
-        if self.kind == content_kinds.TOPIC or self.kind == "Channel":
-            total = 1
-            for child in self.children:
-                total += child.get_topic_count()
-        return total
+        if self.kind != content_kinds.TOPIC and self.kind != "Channel":
+            return 0
+        kinds = self.get_stats().kinds
+        return kinds[content_kinds.TOPIC] + kinds["Channel"]
+
+    def get_stats(self):
+        """ get_stats: get the number of nodes of each kind and of files in the tree
+            rooted at this node (including this node). Once computed, stats are cached
+            on the nodes that have children and updated by add_child, remove_child
+            and add_file, so later calls (and count) are O(1).
+            Args: None
+            Returns: TreeStats
+        """
+        if self._stats is not None:
+            return self._stats
+        if not self._children:
+            return self._get_own_stats()
+        # compute the stats of the subtrees that are not cached yet, bottom-up
+        uncached = iter_postorder(self, get_children=lambda node: node._children if node._stats is None else None)
+        for node in uncached:
+            if node._stats is None and node._children:
+                stats = node._get_own_stats()
+                for child in node._children:
+                    stats.add(child._stats if child._stats is not None else child._get_own_stats())
+                node._stats = stats
+        return self._stats
+
+    def _get_own_stats(self):
+        return TreeStats(kinds={self.kind: 1}, files=len(self.files))
+
+    def get_files_size(self):
+        """ get_files_size: get the total size in bytes of the processed files in the tree
+            rooted at this node. Unlike get_stats, this checks the files in the storage
+            directory, so it is meant for reports once the files have been processed.
+            Args: None
+            Returns: int
+        """
+        return sum(_get_processed_file_size(f) for node in iter_preorder(self) for f in node.files)
+
+    def _add_to_stats(self, stats, subtract=False):
+        # The stats of a node are only cached if the stats of all its descendants
+        # with children are cached, so stop at the first ancestor without stats
+        node = self
+        while node is not None and (node is self or node._stats is not None):
+            if node._stats is not None:
+                if subtract:
+                    node._stats.subtract(stats)
+                else:
+                    node._stats.add(stats)
+            node = node.parent
+
+    def _invalidate_stats(self):
+        node = self
+        while node is not None and (node is self or node._stats is not None):
+            node._stats = None
+            node = node.parent
+
+    def _invalidate_source_id_indexes(self):
+        node = self
+        while node is not None:
+            node._source_id_index = None
+            node = node.parent
+
+    def get_nodes_by_source_id(self, source_id):
+        """ get_nodes_by_source_id: Find the nodes in the tree rooted at this node that have
+            the given source_id. Uses an index of the tree that is built on the first call and
+            rebuilt after nodes are added, removed or reordered in the tree, so a series of
+            lookups costs one tree walk plus O(1) per lookup.
+            Args: source_id (str): source id to look for
+            Returns: list of nodes (in tree order)
+        """
+        if self._source_id_index is None:
+            index = {}
+            for node in iter_preorder(self):
+                node_source_id = getattr(node, 'source_id', None)
+                if node_source_id is not None:
+                    index.setdefault(node_source_id, []).append(node)
+            self._source_id_index = index
+        return self._source_id_index.get(source_id, [])
 
     def get_non_topic_descendants(self):
-        if len(self.descendants) == 0:
-            for child_node in self.children:
-                if child_node.kind == content_kinds.TOPIC:
-                    self.descendants += child_node.get_non_topic_descendants()
-                elif child_node not in self.descendants:
-                    self.descendants.append(child_node)
+        if not self.descendants:
+            self.descendants = []
+            seen = set()
+            topics = iter_preorder(self, get_children=lambda node: node.children if node is self or node.kind == content_kinds.TOPIC else None)
+            for node in topics:
+                if node is not self and node.kind != content_kinds.TOPIC and id(node) not in seen:
+                    seen.add(id(node))
+                    self.descendants.append(node)
         return self.descendants
 
     def print_tree(self, indent=2):
@@ -203,69 +480,92 @@ class Node(object):
             Args: indent (int): What level of indentation at which to start printing
             Returns: None
         """
-        config.LOGGER.info("{indent}{data}".format(indent="   " * indent, data=str(self)))
-        for child in self.children:
-            child.print_tree(indent + 1)
+        for depth, node in iter_preorder_with_depth(self):
+            config.LOGGER.info("{indent}{data}".format(indent="   " * (indent + depth), data=str(node)))
 
     def get_json_tree(self):
-        tree = self.to_dict()
-        if len(self.children) > 0:
-            tree['children'] = []
-            for child in self.children:
-                tree['children'].append(child.get_json_tree())
-
-        return tree
+        path = []  # json trees of the ancestors of the current node
+        for depth, node in iter_preorder_with_depth(self):
+            tree = node.to_dict()
+            if len(node.children) > 0:
+                tree['children'] = []
+            del path[depth:]
+            if path:
+                path[-1]['children'].append(tree)
+            path.append(tree)
+        return path[0]
 
 
     def save_channel_children_to_csv(self, metadata_csv, structure_string = ''):
-        # Not including channel title in topic structure
-        is_channel = isinstance(self, ChannelNode)
-        if not is_channel:
-            # Build out tag string
-            tags_string = ','.join(self.tags)
-            new_title = self.node_modifications.get('New Title') or ''
-            new_description = self.node_modifications.get('New Description') or ''
-            new_tags = self.node_modifications.get('New Tags') or ''
-            # New Tags is being saved as a list. Check if list and if so, join to correctly write it to csv
-            if isinstance(new_tags, list):
-                new_tags = ','.join(new_tags)
-
-            record = [
-                self.source_id, 
-                structure_string,
-                self.title,
-                new_title,        # New Title
-                self.description,
-                new_description,  # New Description
-                tags_string,
-                new_tags,         # New Tags
-                ''                # Last Modified
-            ]
-            metadata_csv.writerow(record)
-
-            current_level = self.title
-            # add current level to structure_string_list
-            if structure_string == '':
-                structure_string = self.title
-            else:
-                structure_string += '/' + self.title
-            print(self.title)
-            print(structure_string)
-        for child in self.children:
-            child.save_channel_children_to_csv(metadata_csv, structure_string)
-            
-        
+        metadata_csv.writerows(self.iter_metadata_csv_rows(structure_string))
+
+    def iter_metadata_csv_rows(self, structure_string = ''):
+        """ iter_metadata_csv_rows: Yields the content metadata csv row (see config.CSV_HEADERS)
+            of each descendant of this node, in tree order
+            Args: structure_string (str): topic structure of this node
+            Returns: generator of lists
+        """
+        structures = []  # topic structures of the ancestors of the current node
+        for depth, node in iter_preorder_with_depth(self):
+            del structures[depth:]
+            node_structure_string = structures[-1] if structures else structure_string
+            # Not including channel title in topic structure
+            if not isinstance(node, ChannelNode):
+                # Build out tag string
+                tags_string = ','.join(node.tags)
+                new_title = node.node_modifications.get('New Title') or ''
+                new_description = node.node_modifications.get('New Description') or ''
+                new_tags = node.node_modifications.get('New Tags') or ''
+                # New Tags is being saved as a list. Check if list and if so, join to correctly write it to csv
+                if isinstance(new_tags, list):
+                    new_tags = ','.join(new_tags)
+
+                yield [
+                    node.source_id,
+                    node_structure_string,
+                    node.title,
+                    new_title,        # New Title
+                    node.description,
+                    new_description,  # New Description
+                    tags_string,
+                    new_tags,         # New Tags
+                    ''                # Last Modified
+                ]
+
+                # add current level to structure_string_list
+                if node_structure_string == '':
+                    node_structure_string = node.title
+                else:
+                    node_structure_string += '/' + node.title
+            structures.append(node_structure_string)
+
     def validate_tree(self):
         """
-        Validate all nodes in this tree recusively.
+        Validate all nodes in this tree.
           Args: None
           Returns: boolean indicating if tree is valid
+          Raises: InvalidTreeException listing the errors of all invalid nodes
         """
-        self.validate()
-        for child in self.children:
-            assert child.validate_tree()
+        errors = self.get_validation_errors()
+        if errors:
+            raise InvalidTreeException(errors)
         return True
 
+    def get_validation_errors(self):
+        """ get_validation_errors: Validate all nodes in this tree in a single pass
+            Args: None
+            Returns: list of InvalidNodeException, one for each invalid node (empty if tree is valid)
+        """
+        errors = []
+        for node in iter_preorder(self):
+            try:
+                node.validate()
+            except InvalidNodeException as e:
+                errors.append(e)
+            except (AssertionError, InvalidQuestionException, ValueError) as e:
+                errors.append(InvalidNodeException("Invalid node ({}): {}".format(e, node.title)))
+        return errors
+
     def validate(self):
         """ validate: Makes sure node is valid
             Args: None
@@ -282,8 +582,8 @@ class Node(object):
             assert isinstance(f, File), "Assumption Failed: files must be file class"
             f.validate()
 
-        source_ids = [c.source_id for c in self.children]
-        duplicates = set([x for x in source_ids if source_ids.count(x) > 1])
+        source_id_counts = Counter(c.source_id for c in self.children)
+        duplicates = set(x for x, count in source_id_counts.items() if count > 1)
         assert len(duplicates) == 0, "Assumption Failed: Node must have unique source id among siblings ({} appears multiple times)".format(duplicates)
         return True
 
@@ -301,6 +601,7 @@ class ChannelNode(Node):
             thumbnail (str): file path or url of channel's thumbnail (optional)
             files ([<File>]): list of file objects for node (optional)
     """
+    __slots__ = ('channel_id', 'source_domain', 'source_id', 'tagline')
     kind = "Channel"
     def __init__(self, source_id, source_domain, tagline=None, channel_id=None, *args, **kwargs):
         # Map parameters to model variables
@@ -315,10 +616,14 @@ class ChannelNode(Node):
         return uuid.uuid5(uuid.NAMESPACE_DNS, self.source_domain)
 
     def get_content_id(self):
-        return uuid.uuid5(self.get_domain_namespace(), self.get_node_id().hex)
+        if not self.content_id:
+            self.content_id = uuid.uuid5(self.get_domain_namespace(), self.get_node_id().hex)
+        return self.content_id
 
     def get_node_id(self):
-        return uuid.uuid5(self.get_domain_namespace(), self.source_id)
+        if not self.node_id:
+            self.node_id = uuid.uuid5(self.get_domain_namespace(), self.source_id)
+        return self.node_id
 
     def truncate_fields(self):
         if self.description and len(self.description) > config.MAX_DESCRIPTION_LENGTH:
@@ -357,7 +662,7 @@ class ChannelNode(Node):
             assert self.language, "Channel must have a language"
             return super(ChannelNode, self).validate()
         except AssertionError as ae:
-            raise InvalidNodeException("Invalid channel ({}): {} - {}".format(ae.args[0], self.title, self.__dict__))
+            raise InvalidNodeException("Invalid channel ({}): {} - {}".format(ae.args[0], self.title, get_attributes(self)))
 
 
 class TreeNode(Node):
@@ -379,13 +684,15 @@ class TreeNode(Node):
             extra_fields (dict): any additional data needed for node (optional)
             domain_ns (str): who is providing the content (e.g. learningequality.org) (optional)
     """
+    __slots__ = ('source_id', 'author', 'aggregator', 'provider', 'tags', 'domain_ns', 'questions', 'extra_fields')
+
     def __init__(self, source_id, title, author="", aggregator="", provider="", tags=None, extra_fields=None, domain_ns=None, **kwargs):
         # Map parameters to model variables
         assert isinstance(source_id, str), "source_id must be a string"
         self.source_id = source_id
-        self.author = author or ""
-        self.aggregator = aggregator or ""
-        self.provider = provider or ""
+        self.author = intern_str(author) or ""
+        self.aggregator = intern_str(aggregator) or ""
+        self.provider = intern_str(provider) or ""
         self.tags = tags or []
         self.domain_ns = domain_ns
         self.questions = self.questions if hasattr(self, 'questions') else [] # Needed for to_dict method
@@ -437,7 +744,8 @@ class TreeNode(Node):
         if not key:
             convert = lambda text: int(text) if text.isdigit() else text.lower() 
             key = lambda key: [ convert(re.sub(r'[^A-Za-z0-9]+', '', c.replace('&', 'and'))) for c in re.split('([0-9]+)', key.title) ]
-        self.children = sorted(self.children, key = key, reverse = reverse)
+        list.sort(self._children, key=key, reverse=reverse)
+        self._invalidate_source_id_indexes()
         return self.children
 
     def to_dict(self):
@@ -496,6 +804,7 @@ class TopicNode(TreeNode):
             thumbnail (str): local path or url to thumbnail image (optional)
             derive_thumbnail (bool): set to generate tiled thumbnail from children (optional)
     """
+    __slots__ = ()
     kind = content_kinds.TOPIC
 
     def generate_thumbnail(self):
@@ -514,7 +823,7 @@ class TopicNode(TreeNode):
             assert self.kind == content_kinds.TOPIC, "Assumption Failed: Node is supposed to be a topic"
             return super(TopicNode, self).validate()
         except AssertionError as ae:
-            raise InvalidNodeException("Invalid node ({}): {} - {}".format(ae.args[0], self.title, self.__dict__))
+            raise InvalidNodeException("Invalid node ({}): {} - {}".format(ae.args[0], self.title, get_attributes(self)))
 
 
 class ContentNode(TreeNode):
@@ -537,10 +846,11 @@ class ContentNode(TreeNode):
             extra_fields (dict): any additional data needed for node (optional)
             domain_ns (str): who is providing the content (e.g. learningequality.org) (optional)
     """
+    __slots__ = ('role', 'license')
     required_file_format = None
 
     def __init__(self, source_id, title, license, role=roles.LEARNER, license_description=None, copyright_holder=None, **kwargs):
-        self.role = role
+        self.role = intern_str(role)
         self.set_license(license, copyright_holder=copyright_holder, description=license_description)
         super(ContentNode, self).__init__(source_id, title, **kwargs)
 
@@ -618,6 +928,7 @@ class VideoNode(ContentNode):
             domain_ns (str): who is providing the content (e.g. learningequality.org) (optional)
             files ([<File>]): list of file objects for node (optional)
     """
+    __slots__ = ()
     kind = content_kinds.VIDEO
     required_file_format = file_formats.MP4
 
@@ -667,7 +978,7 @@ class VideoNode(ContentNode):
             return super(VideoNode, self).validate()
 
         except AssertionError as ae:
-            raise InvalidNodeException("Invalid node ({}): {} - {}".format(ae.args[0], self.title, self.__dict__))
+            raise InvalidNodeException("Invalid node ({}): {} - {}".format(ae.args[0], self.title, get_attributes(self)))
 
 
 class AudioNode(ContentNode):
@@ -689,6 +1000,7 @@ class AudioNode(ContentNode):
             domain_ns (str): who is providing the content (e.g. learningequality.org) (optional)
             files ([<File>]): list of file objects for node (optional)
     """
+    __slots__ = ()
     kind = content_kinds.AUDIO
     required_file_format = file_formats.MP3
 
@@ -716,7 +1028,7 @@ class AudioNode(ContentNode):
             assert [f for f in self.files if isinstance(f, AudioFile)], "Assumption Failed: Audio should have at least one audio file"
             return super(AudioNode, self).validate()
         except AssertionError as ae:
-            raise InvalidNodeException("Invalid node ({}): {} - {}".format(ae.args[0], self.title, self.__dict__))
+            raise InvalidNodeException("Invalid node ({}): {} - {}".format(ae.args[0], self.title, get_attributes(self)))
 
 
 class DocumentNode(ContentNode):
@@ -738,6 +1050,7 @@ class DocumentNode(ContentNode):
             domain_ns (str): who is providing the content (e.g. learningequality.org) (optional)
             files ([<File>]): list of file objects for node (optional)
     """
+    __slots__ = ()
     kind = content_kinds.DOCUMENT
     required_file_format = file_formats.PDF # TODO(ivan) change ro allowed_formats
 
@@ -755,14 +1068,14 @@ class DocumentNode(ContentNode):
                 "Assumption Failed: Document should have at least one document file"
             return super(DocumentNode, self).validate()
         except AssertionError as ae:
-            raise InvalidNodeException("Invalid node ({}): {} - {}".format(ae.args[0], self.title, self.__dict__))
+            raise InvalidNodeException("Invalid node ({}): {} - {}".format(ae.args[0], self.title, get_attributes(self)))
 
     def generate_thumbnail(self):
         from .files import DocumentFile, EPubFile, ExtractedPdfThumbnailFile, ExtractedEPubThumbnailFile
         pdf_files = [f for f in self.files if isinstance(f, DocumentFile)]
         epub_files = [f for f in self.files if isinstance(f, EPubFile)]
         if pdf_files and epub_files:
-            raise InvalidNodeException("Invalid node (both PDF and ePub provided): {} - {}".format(self.title, self.__dict__))
+            raise InvalidNodeException("Invalid node (both PDF and ePub provided): {} - {}".format(self.title, get_attributes(self)))
         elif pdf_files:
             pdf_file = pdf_files[0]
             if pdf_file.filename and not pdf_file.error:
@@ -796,6 +1109,7 @@ class HTML5AppNode(ContentNode):
             domain_ns (str): who is providing the content (e.g. learningequality.org) (optional)
             files ([<File>]): list of file objects for node (optional)
     """
+    __slots__ = ()
     kind = content_kinds.HTML5
     required_file_format = file_formats.HTML5
 
@@ -822,7 +1136,7 @@ class HTML5AppNode(ContentNode):
             assert [f for f in self.files if isinstance(f, HTMLZipFile)], "Assumption Failed: HTML should have at least one html file"
             return super(HTML5AppNode, self).validate()
         except AssertionError as ae:
-            raise InvalidNodeException("Invalid node ({}): {} - {}".format(ae.args[0], self.title, self.__dict__))
+            raise InvalidNodeException("Invalid node ({}): {} - {}".format(ae.args[0], self.title, get_attributes(self)))
 
 
 class H5PAppNode(ContentNode):
@@ -843,6 +1157,7 @@ class H5PAppNode(ContentNode):
             domain_ns (str): who is providing the content (e.g. learningequality.org) (optional)
             files ([<File>]): list of file objects for node (optional)
     """
+    __slots__ = ()
     kind = content_kinds.H5P
     required_file_format = file_formats.H5P
 
@@ -858,7 +1173,7 @@ class H5PAppNode(ContentNode):
             assert [f for f in self.files if isinstance(f, H5PFile)], "Assumption Failed: H5PAppNode should have at least one h5p file"
             return super(H5PAppNode, self).validate()
         except AssertionError as ae:
-            raise InvalidNodeException("Invalid node ({}): {} - {}".format(ae.args[0], self.title, self.__dict__))
+            raise InvalidNodeException("Invalid node ({}): {} - {}".format(ae.args[0], self.title, get_attributes(self)))
 
 
 class ExerciseNode(ContentNode):
@@ -881,6 +1196,7 @@ class ExerciseNode(ContentNode):
             domain_ns (str): who is providing the content (e.g. learningequality.org) (optional)
             questions ([<Question>]): list of question objects for node (optional)
     """
+    __slots__ = ()
     kind = content_kinds.EXERCISE
 
     def __init__(self, source_id, title, license, questions=None, exercise_data=None, **kwargs):
@@ -916,6 +1232,8 @@ class ExerciseNode(ContentNode):
         """
         config.LOGGER.info("\t*** Processing images for exercise: {}".format(self.title))
         downloaded = super(ExerciseNode, self).process_files()
+        # Download images used in all questions at once
+        prefetch_images(self.questions)
         for question in self.questions:
             downloaded += question.process_question()
 
@@ -979,7 +1297,7 @@ class ExerciseNode(ContentNode):
 
             return super(ExerciseNode, self).validate()
         except (AssertionError, ValueError) as ae:
-            raise InvalidNodeException("Invalid node ({}): {} - {}".format(ae.args[0], self.title, self.__dict__))
+            raise InvalidNodeException("Invalid node ({}): {} - {}".format(ae.args[0], self.title, get_attributes(self)))
 
 
     def truncate_fields(self):
@@ -1007,9 +1325,11 @@ class SlideshowNode(ContentNode):
             extra_fields (dict): any additional data needed for node (optional)
             domain_ns (str): who is providing the content (e.g. learningequality.org) (optional)
     """
+    __slots__ = ('_slide_count',)
     kind = content_kinds.SLIDESHOW
 
     def __init__(self, source_id, title, license, slideshow_data=None, **kwargs):
+        self._slide_count = 0  # number of SlideImageFiles in self.files
         if slideshow_data:
             extra_fields = {'slideshow_data': slideshow_data}
         else:
@@ -1029,7 +1349,7 @@ class SlideshowNode(ContentNode):
         from .files import ThumbnailFile, SlideImageFile
         assert isinstance(file_to_add, ThumbnailFile) or isinstance(file_to_add, SlideImageFile), "Files being added must be instances of a subclass of File class"
 
-        if file_to_add not in self.files:
+        if not self.has_file(file_to_add):
             filename = file_to_add.get_filename()
             if filename:
                 checksum, ext = filename.split('.')  # <md5sum(contents)>.[png|jpg|jpeg]
@@ -1041,8 +1361,10 @@ class SlideshowNode(ContentNode):
             if isinstance(file_to_add, SlideImageFile):
                 #
                 # Find the idx of sort_order.next()
-                slideshow_image_files = [f for f in self.files if isinstance(f,SlideImageFile)]
-                idx = len(slideshow_image_files)  # next available index, assuming added in desired order
+                if self._slide_count is None:
+                    self._slide_count = len([f for f in self.files if isinstance(f, SlideImageFile)])
+                idx = self._slide_count  # next available index, assuming added in desired order
+                self._slide_count += 1
                 #
                 # Add slideshow data to extra_fields['slideshow_data'] (aka manifest)
                 slideshow_data = self.extra_fields['slideshow_data']
@@ -1059,8 +1381,12 @@ class SlideshowNode(ContentNode):
 
             #
             # Add node->file link
-            file_to_add.node = self
-            self.files.append(file_to_add)
+            super(SlideshowNode, self).add_file(file_to_add)
+
+    def _on_list_changed(self, node_list):
+        super(SlideshowNode, self)._on_list_changed(node_list)
+        if node_list is self._files:
+            self._slide_count = None  # recounted on the next add_file
 
     def validate(self):
         from .files import SlideImageFile, ThumbnailFile
@@ -1070,5 +1396,5 @@ class SlideshowNode(ContentNode):
             assert all([isinstance(f, SlideImageFile) or isinstance(f, ThumbnailFile) for f in self.files]), \
                    "Assumption Failed: SlideshowNode files must be of type SlideImageFile or ThumbnailFile."
         except AssertionError as ae:
-            raise InvalidNodeException("Invalid node ({}): {} - {}".format(ae.args[0], self.title, self.__dict__))
+            raise InvalidNodeException("Invalid node ({}): {} - {}".format(ae.args[0], self.title, get_attributes(self)))
         super(SlideshowNode, self).validate()
@@ -1,22 +1,91 @@
 # Question models for exercises
 
 import uuid
+import hashlib
 import json
 import html
+import os
 import re
 import copy
 import sys
 from bs4 import BeautifulSoup
-from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from le_utils.constants import content_kinds,file_formats, format_presets, licenses, exercises
 from .. import config
 from ..exceptions import UnknownQuestionTypeError, InvalidQuestionException
-from .files import _ExerciseImageFile, _ExerciseGraphieFile, _ExerciseBase64ImageFile
+from .files import FILECACHE, _ExerciseImageFile, _ExerciseGraphieFile, _ExerciseBase64ImageFile
 from pressurecooker.encodings import get_base64_encoding
 
 
 WEB_GRAPHIE_URL_REGEX = r'web\+graphie:(?P<rawpath>[^\)]+)'  # match web_graphie:{{path}}
 MARKDOWN_IMAGE_REGEX = r'!\[([^\]]+)?\]\(([^\)]+?)\)'        # match ![{{smth}}]({{url}})
+WEB_GRAPHIE_URL_PATTERN = re.compile(WEB_GRAPHIE_URL_REGEX, flags=re.IGNORECASE)
+MARKDOWN_IMAGE_PATTERN = re.compile(MARKDOWN_IMAGE_REGEX, flags=re.IGNORECASE)
+
+# Exercise image file classes that can be restored from processed perseus questions cache
+CACHEABLE_IMAGE_FILE_CLASSES = {
+    cls.__name__: cls for cls in [_ExerciseImageFile, _ExerciseGraphieFile, _ExerciseBase64ImageFile]
+}
+
+
+def prefetch_images(questions, max_workers=None):
+    """
+    Download all the images used by `questions` before they get processed.
+    Image strings are collected from every question, de-duplicated, and each
+    distinct image is downloaded once using a pool of `max_workers` threads.
+    The resulting file objects are shared with the questions so that the
+    `set_image` calls made by `process_question` don't download anything.
+    Args:
+      - questions ([<Question>]): list of questions (e.g. of an exercise node)
+      - max_workers (int): number of concurrent downloads (default config.DOWNLOAD_WORKERS)
+    Returns: dict {image string: exercise image file object}
+    """
+    prefetched = {}
+    for question in questions:
+        for text in question.get_image_texts():
+            if exercises.CONTENT_STORAGE_PLACEHOLDER in text:
+                continue
+            stripped_text = text.strip().replace('\\n', '')
+            if stripped_text not in prefetched:
+                prefetched[stripped_text] = question.create_image_file(stripped_text)
+
+    if prefetched:
+        with ThreadPoolExecutor(max_workers=max_workers or config.DOWNLOAD_WORKERS) as executor:
+            list(executor.map(lambda image_file: image_file.process_file(), prefetched.values()))
+
+    for question in questions:
+        question.prefetched_images = prefetched
+    return prefetched
+
+
+def iter_json_dicts(data):
+    """
+    Yield all the dicts contained in the JSON-like `data` (nested dicts and
+    lists), parents before children and in document order, without recursion.
+    """
+    stack = [data]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, dict):
+            yield item
+            values = item.values()
+        elif isinstance(item, list):
+            values = item
+        else:
+            continue
+        stack.extend(reversed([value for value in values if isinstance(value, (dict, list))]))
+
+
+def replace_all(text, replacements):
+    """
+    Replace every occurrence of the keys of `replacements` in `text` by the
+    corresponding values, in a single pass over `text`.
+    """
+    if not replacements:
+        return text
+    old_strings = sorted(replacements.keys(), key=len, reverse=True)
+    pattern = re.compile('|'.join(re.escape(old) for old in old_strings))
+    return pattern.sub(lambda match: replacements[match.group(0)], text)
 
 
 class BaseQuestion:
@@ -43,6 +112,8 @@ class BaseQuestion:
         self.source_url = source_url
         self.randomize = randomize
         self.id = uuid.uuid5(uuid.NAMESPACE_DNS, id)
+        self.prefetched_images = None
+        self._parsed_html = {}
 
     def truncate_fields(self):
         if self.source_url and len(self.source_url) > config.MAX_SOURCE_URL_LENGTH:
@@ -106,6 +177,7 @@ class BaseQuestion:
         self.hints = hints
 
         self.files += question_files + answer_files + hint_files
+        self.prefetched_images = None
         return [f.filename for f in self.files]
 
     def set_images(self, text, parse_html=True):
@@ -118,20 +190,40 @@ class BaseQuestion:
         # Set up return values and regex
         file_list = []
         if parse_html:
-            processed_string = self.parse_html(text)
+            processed_string = self._parsed_html.pop(text, None)
+            if processed_string is None:
+                processed_string = self.parse_html(text)
         else:
             processed_string = text
-        reg = re.compile(MARKDOWN_IMAGE_REGEX, flags=re.IGNORECASE)
-        matches = reg.findall(processed_string)
+        matches = MARKDOWN_IMAGE_PATTERN.findall(processed_string)
 
-        # Parse all matches
+        # Parse all matches, then substitute all replacements at once
+        replacements = {}
         for match in matches:
+            if match[1] in replacements:
+                continue
             file_result = self.set_image(match[1])
             if file_result[0] != "":
                 replacement, new_files = file_result
-                processed_string = processed_string.replace(match[1], replacement)
+                replacements[match[1]] = replacement
                 file_list += new_files
-        return processed_string, file_list
+        return replace_all(processed_string, replacements), file_list
+
+    def get_image_texts(self):
+        """ get_image_texts: Find image strings in question, answers, and hints
+            Args: None
+            Returns: list of image strings (paths or urls) found in question
+        """
+        texts = [self.question] + [answer['answer'] for answer in self.answers] + self.hints
+        image_texts = []
+        for text in texts:
+            if not isinstance(text, str):
+                continue
+            # Keep parsed html around so process_question doesn't parse it twice
+            if text not in self._parsed_html:
+                self._parsed_html[text] = self.parse_html(text)
+            image_texts += [match[1] for match in MARKDOWN_IMAGE_PATTERN.findall(self._parsed_html[text])]
+        return image_texts
 
     def parse_html(self, text):
         """ parse_html: Properly formats any img tags that might be in content
@@ -139,19 +231,25 @@ class BaseQuestion:
                 text (str): text to parse
             Returns: string with properly formatted images
         """
-        bs = BeautifulSoup(text, "html5lib")
-        file_reg = re.compile(MARKDOWN_IMAGE_REGEX, flags=re.IGNORECASE)
+        if '<' not in text and '&#' not in text and '\x00' not in text:
+            # Fast path: without any markup, parsing would only normalize line
+            # endings, leading whitespace and named character references
+            return html.unescape(text.replace('\r\n', '\n').replace('\r', '\n')).lstrip(' \t\n\f')
+
+        bs = BeautifulSoup(text, config.EXERCISE_HTML_PARSER)
         tags = bs.findAll('img')
 
         for tag in tags:
             # Look for src attribute, remove formatting if added to image
             src_text = tag.get("src") or ""
-            formatted_src_match = file_reg.search(src_text)
+            formatted_src_match = MARKDOWN_IMAGE_PATTERN.search(src_text)
             src_text = formatted_src_match.group(2) if formatted_src_match else src_text
 
             alt_text = tag.get("alt") or ""
             tag.replaceWith("![{alt}]({src})".format(alt=alt_text, src=src_text))
-        return html.unescape(bs.find('body').renderContents().decode('utf-8'))
+        # html5lib and lxml wrap the fragment in <html><body>, html.parser doesn't
+        root = bs.body or bs
+        return html.unescape(root.renderContents().decode('utf-8'))
 
     def set_image(self, text):
         """
@@ -168,29 +266,39 @@ class BaseQuestion:
             return text, []
         # Strip `text` of whitespace
         stripped_text = text.strip().replace('\\n', '')
+        if self.prefetched_images and stripped_text in self.prefetched_images:
+            # Already downloaded by `prefetch_images`
+            exercise_image_file = self.prefetched_images[stripped_text]
+        else:
+            exercise_image_file = self.create_image_file(stripped_text)
+            # Process file to make the replacement_str available
+            _filename = exercise_image_file.process_file()
+        # Get `new_text` = the replacement path for the image resource
+        new_text = exercises.CONTENT_STORAGE_FORMAT.format(exercise_image_file.get_replacement_str())
+        if isinstance(exercise_image_file, _ExerciseGraphieFile):
+            # need to put back the `web+graphie:` prefix
+            new_text = "web+graphie:" + new_text
+        return new_text, [exercise_image_file]
+
+    def create_image_file(self, stripped_text):
+        """
+        Create the (unprocessed) exercise image file object for the image
+        resource at `stripped_text`, which can be a web+graphie: path, a base64
+        encoded image, or a path or url to an image.
+        """
         # If `stripped_text` is a web+graphie: path, we need special processing
-        graphie_regex = re.compile(WEB_GRAPHIE_URL_REGEX, flags=re.IGNORECASE)
-        graphie_match = graphie_regex.match(stripped_text)
+        graphie_match = WEB_GRAPHIE_URL_PATTERN.match(stripped_text)
         if graphie_match:
-            is_web_plus_graphie = True
             graphie_rawpath = graphie_match.groupdict()['rawpath']
             graphie_path = graphie_rawpath.replace("//", "https://")
             exercise_image_file = _ExerciseGraphieFile(graphie_path)
         elif get_base64_encoding(stripped_text):
-            is_web_plus_graphie = False
             exercise_image_file = _ExerciseBase64ImageFile(stripped_text)
         else:
-            is_web_plus_graphie = False
             exercise_image_file = _ExerciseImageFile(stripped_text)
         # Setup link to assessment item
         exercise_image_file.assessment_item = self
-        # Process file to make the replacement_str available
-        _filename = exercise_image_file.process_file()
-        # Get `new_text` = the replacement path for the image resource
-        new_text = exercises.CONTENT_STORAGE_FORMAT.format(exercise_image_file.get_replacement_str())
-        if is_web_plus_graphie:     # need to put back the `web+graphie:` prefix
-            new_text = "web+graphie:" + new_text
-        return new_text, [exercise_image_file]
+        return exercise_image_file
 
     def validate(self):
         """ validate: Makes sure question is valid
@@ -246,6 +354,14 @@ class PerseusQuestion(BaseQuestion):
         processed: repalced by references to `CONTENTSTORAGE` + added as files.
         Returns: list of all files needed to render this question.
         """
+        cache_key = self.get_cache_key()
+        if self.load_from_cache(cache_key):
+            return [f.filename for f in self.files]
+
+        # Download all the images used in the question concurrently
+        if self.prefetched_images is None:
+            prefetch_images([self])
+
         image_files = []
         question_data = json.loads(self.raw_data)
 
@@ -280,10 +396,83 @@ class PerseusQuestion(BaseQuestion):
 
         # Combine all files processed
         self.files = image_files + data_files
+        self.prefetched_images = None
+        self.save_to_cache(cache_key)
 
         # Return all filenames
         return [f.filename for f in self.files]
 
+    def get_image_texts(self):
+        """ get_image_texts: Find all image strings in `raw_data` in a single scan
+            Args: None
+            Returns: list of image strings (paths or urls) found in question
+        """
+        if self.load_from_cache(self.get_cache_key(), restore=False):
+            return []
+        question_data = json.loads(self.raw_data)
+        image_texts = []
+
+        # `url` attributes of widgets
+        for item in iter_json_dicts(question_data):
+            if isinstance(item.get('url'), str) and item['url']:
+                image_texts.append(item['url'])
+
+        # `images` of question, hints and answers
+        fields = [question_data.get('question')] + question_data.get('hints', []) + question_data.get('answers', [])
+        for field in fields:
+            if isinstance(field, dict) and isinstance(field.get('images'), dict):
+                image_texts += list(field['images'].keys())
+
+        # markdown image links anywhere in the question
+        image_texts += [match[1] for match in MARKDOWN_IMAGE_PATTERN.findall(self.raw_data)]
+        return image_texts
+
+    def get_cache_key(self):
+        raw_data_hash = hashlib.md5(self.raw_data.encode('utf-8')).hexdigest()
+        return "PERSEUS: {} {}".format(self.source_id, raw_data_hash)
+
+    def load_from_cache(self, cache_key, restore=True):
+        """
+        Look up the result of processing this question in a previous run (see
+        `config.CACHE_PERSEUS_QUESTIONS`) and, if `restore` is True, set the
+        processed `raw_data` and the image files from it.
+        Returns: True if a usable cached result was found, otherwise False
+        """
+        if not config.CACHE_PERSEUS_QUESTIONS or config.UPDATE:
+            return False
+        cached = FILECACHE.get(cache_key)
+        if not cached:
+            return False
+        cached = json.loads(cached.decode('utf-8'))
+        for _cls_name, _source, filename in cached['files']:
+            if not os.path.isfile(config.get_storage_path(filename)):
+                return False
+        if restore:
+            self.files = []
+            for cls_name, source, filename in cached['files']:
+                image_file = CACHEABLE_IMAGE_FILE_CLASSES[cls_name](source)
+                image_file.filename = filename
+                image_file.assessment_item = self
+                self.files.append(image_file)
+            self.raw_data = cached['raw_data']
+        return True
+
+    def save_to_cache(self, cache_key):
+        """
+        Store the processed `raw_data` and image files of this question under
+        `cache_key` so later runs can skip processing it (only when all the
+        images were downloaded successfully).
+        """
+        if not config.CACHE_PERSEUS_QUESTIONS:
+            return
+        files = []
+        for image_file in self.files:
+            if not image_file.filename or image_file.__class__.__name__ not in CACHEABLE_IMAGE_FILE_CLASSES:
+                return
+            source = image_file.encoding if isinstance(image_file, _ExerciseBase64ImageFile) else image_file.path
+            files.append([image_file.__class__.__name__, source, image_file.filename])
+        cached = {'raw_data': self.raw_data, 'files': files}
+        FILECACHE.set(cache_key, bytes(json.dumps(cached, ensure_ascii=False), 'utf-8'))
 
     def process_image_field(self, data):
         """
@@ -322,8 +511,7 @@ class PerseusQuestion(BaseQuestion):
             image_replacements[old_url] = new_url
 
         # STEP 1B. look for additional `MARKDOWN_IMAGE_REGEX`-like link in `content` attr.
-        img_link_pat = re.compile(MARKDOWN_IMAGE_REGEX, flags=re.IGNORECASE)
-        img_link_matches = img_link_pat.findall(data['content'])
+        img_link_matches = MARKDOWN_IMAGE_PATTERN.findall(data['content'])
         for match in img_link_matches:
             old_url = match[1]
             if old_url not in image_replacements.keys():
@@ -332,17 +520,16 @@ class PerseusQuestion(BaseQuestion):
                 image_replacements[old_url] = new_url
 
         # Performd content replacent for all URLs in image_replacements
-        for old_url, new_url in image_replacements.items():
-            data['content'] = data['content'].replace(old_url, new_url)
+        data['content'] = replace_all(data['content'], image_replacements)
 
         return new_images_dict, image_files
 
 
     def _recursive_url_find(self, item, image_list):
         """
-        Recursively traverses a dictionary-like data structure for Khan Academy
-        assessment items in order to search for image links in `url` data attributes,
-        and if it finds any it adds them to `image_list` and rewrites `url` attribute.
+        Traverses a dictionary-like data structure for Khan Academy assessment
+        items in order to search for image links in `url` data attributes, and
+        if it finds any it adds them to `image_list` and rewrites `url` attribute.
         Use cases:
           - `backgroundImage.url` attributes for graphs and images
 
@@ -351,24 +538,12 @@ class PerseusQuestion(BaseQuestion):
             image_list (list): image files (File objects) found during the traversal
         Returns: None
         """
-
-        recursive_fn = partial(self._recursive_url_find, image_list=image_list)
-
-        if isinstance(item, list):
-            list(map(recursive_fn, item))
-
-        elif isinstance(item, dict):
-            if 'url' in item:
-                if item['url']:
-                    item['url'], image_file = self.set_image(item['url'])
+        for data in iter_json_dicts(item):
+            if 'url' in data:
+                if data['url']:
+                    data['url'], image_file = self.set_image(data['url'])
                     image_list += image_file
 
-            for field, field_data in item.items():
-                if isinstance(field_data, dict):
-                    self._recursive_url_find(field_data, image_list)
-                elif isinstance(field_data, list):
-                    list(map(recursive_fn, field_data))
-
 
 class MultipleSelectQuestion(BaseQuestion):
     """ Model representing multiple select questions
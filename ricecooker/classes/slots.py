@@ -0,0 +1,30 @@
+# Helpers for the compact (__slots__ based) node, file and license models
+
+import sys
+
+
+def intern_str(value):
+    """
+    Return the interned copy of `value` if it is a string, so that the many
+    nodes and files of a large tree that share a kind, license, language,
+    preset or author all point to a single string object.
+    Non-string values (e.g. None or Language objects) are returned as is.
+    """
+    if type(value) is str:
+        return sys.intern(value)
+    return value
+
+
+def get_attributes(obj):
+    """
+    Return a dict of all the attributes set on `obj`, both the ones stored in
+    its __slots__ and the ones stored in its __dict__ (used in error messages,
+    where the __dict__ alone would only show the non-slot attributes).
+    """
+    attributes = {}
+    for cls in reversed(type(obj).__mro__):
+        for name in cls.__dict__.get('__slots__', ()):
+            if name not in ('__dict__', '__weakref__') and hasattr(obj, name):
+                attributes[name] = getattr(obj, name)
+    attributes.update(getattr(obj, '__dict__', {}))
+    return attributes
@@ -12,6 +12,7 @@ from . import config, __version__
 from .classes.nodes import ChannelNode
 from .managers.progress import RestoreManager, Status
 from .managers.tree import ChannelManager
+from .utils.traversal import iter_preorder_with_depth
 
 # Fix to support Python 2.x.
 # http://stackoverflow.com/questions/954834/how-do-i-use-raw-input-in-python-3
@@ -249,6 +250,7 @@ def process_tree_files(tree):
     # Fill in values necessary for next steps
     config.LOGGER.info("Processing content...")
     files_to_diff = tree.process_tree(tree.channel)
+    config.LOGGER.info("   Channel contains {} ({:.1f} MB)".format(tree.channel.get_stats(), tree.channel.get_files_size() / 1e6))
     tree.check_for_files_failed()
     return files_to_diff, config.FAILED_FILES
 
@@ -309,16 +311,13 @@ def select_sample_nodes(channel, size=10, seed=42):
 
     # Step 1. channel to paths
     node_paths = []   # list of tuples of the form (topic1, topic2, leafnode)
-    def walk_tree(parents_path, subtree):
-        for child in subtree.children:
-            child_path = parents_path + (child,)
-            if child.children:
-                # recurse
-                walk_tree(child_path, child)
-            else:
-                # emit leaf node
-                node_paths.append(child_path)
-    walk_tree((), channel)
+    path = []         # the channel and the ancestors of the current node
+    for depth, node in iter_preorder_with_depth(channel):
+        del path[depth:]
+        if depth > 0 and not node.children:
+            # emit leaf node
+            node_paths.append(tuple(path[1:]) + (node,))
+        path.append(node)
 
     # Step 2. sample paths
     random.seed(seed)
@@ -337,16 +336,13 @@ def select_sample_nodes(channel, size=10, seed=42):
         language=channel.language,
         description='Sample from ' + channel.description
     )
-    def attach(parent, node_path):
-        if len(node_path) == 1:
-            # leaf node
-            parent.add_child(node_path[0])
-        else:
-            child = node_path[0]
+    for node_path in sample_paths:
+        parent = channel_sample
+        for child in node_path[:-1]:
             if not any(c.source_id == child.source_id for c in parent.children):
                 parent.add_child(child)
-            attach(child, node_path[1:])
-    for node_path in sample_paths:
-        attach(channel_sample, node_path)
+            parent = child
+        # leaf node
+        parent.add_child(node_path[-1])
 
     return channel_sample
@@ -198,6 +198,33 @@ FAILED_FILES = []
 DOWNLOAD_SESSION = requests.Session()
 DOWNLOAD_SESSION.mount('file://', FileAdapter())
 
+# Number of threads used to download resources concurrently (e.g. exercise images)
+DOWNLOAD_WORKERS = 5
+
+# Number of threads used to list directories concurrently when walking a
+# LineCook channeldir (see ricecooker.utils.paths.walk_sorted)
+WALK_WORKERS = 8
+
+# Number of threads used to send Studio API requests concurrently when applying
+# corrections to a channel (see ricecooker.utils.corrections)
+CORRECTIONS_WORKERS = 8
+
+# Number of threads used to read the metadata embedded in files when generating
+# Content.csv with LineCook --generate --probe (see ricecooker.utils.fileprobes)
+PROBE_WORKERS = 8
+
+# Number of threads used by StudioApi to GET the nodes of a channel tree concurrently
+STUDIO_API_WORKERS = 8
+
+# BeautifulSoup parser used to find <img> tags in exercise questions, answers
+# and hints; "html.parser" or "lxml" are faster but less lenient than html5lib
+EXERCISE_HTML_PARSER = "html5lib"
+
+# When set to true, the result of processing each perseus question (rewritten
+# raw_data and image files) is kept in the file cache and reused in later runs
+# as long as the question's raw_data doesn't change (ignored when UPDATE is set)
+CACHE_PERSEUS_QUESTIONS = False
+
 # Environment variable indicating we should use a proxy for youtube_dl downloads
 USEPROXY = False
 USEPROXY = True if os.getenv('USEPROXY') is not None or os.getenv('PROXY_LIST') is not None else False
@@ -45,6 +45,13 @@ class InvalidNodeException(Exception):
     def __init__(self,*args,**kwargs):
         Exception.__init__(self,*args,**kwargs)
 
+class InvalidTreeException(InvalidNodeException):
+    """ InvalidTreeException: raised when one or more nodes in a tree are improperly formatted """
+    def __init__(self, errors, *args, **kwargs):
+        self.errors = errors  # list of InvalidNodeException, one for each invalid node
+        message = "{} invalid node(s) in tree:\n".format(len(errors)) + "\n".join("  - {}".format(e) for e in errors)
+        InvalidNodeException.__init__(self, message, *args, **kwargs)
+
 class InvalidQuestionException(Exception):
     """ InvalidQuestionException: raised when question is improperly formatted """
     def __init__(self,*args,**kwargs):
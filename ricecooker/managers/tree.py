@@ -2,6 +2,8 @@ import json
 import sys
 
 from .. import config
+from ..classes.slots import get_attributes
+from ..utils.traversal import iter_postorder, iter_preorder
 
 
 class ChannelManager:
@@ -41,11 +43,9 @@ class ChannelManager:
         :param node: The root of the current sub-tree being processed
         :return: None.
         """
-        # Process node's children
-        for child_node in node.children:
-            self.process_tree_recur(file_names, child_node)  # Call children first in case a tiled thumbnail is needed
-
-        file_names.extend(node.process_files())
+        # Process children first in case a tiled thumbnail is needed
+        for subtree_node in iter_postorder(node):
+            file_names.extend(subtree_node.process_files())
 
 
     def check_for_files_failed(self):
@@ -62,7 +62,7 @@ class ChannelManager:
                     info = "{0} {id}".format("Question", id=f.assessment_item.source_id)
                 else:   # files not associated with a node or an assessment item
                     info = f.__class__.__name__
-                file_identifier = f.__dict__
+                file_identifier = get_attributes(f)
                 if hasattr(f, 'path') and f.path:
                     file_identifier = f.path
                 elif hasattr(f, 'youtube_url') and f.youtube_url:
@@ -134,6 +134,7 @@ class ChannelManager:
 
         config.LOGGER.info("\tPreparing fields...")
         self.truncate_fields(self.channel)
+        self.channel.compute_ids()
 
         self.add_nodes(root, self.channel)
         if self.check_failed(print_warning=False):
@@ -147,9 +148,8 @@ class ChannelManager:
         return channel_id, channel_link
 
     def truncate_fields(self, node):
-        node.truncate_fields()
-        for child in node.children:
-            self.truncate_fields(child)
+        for subtree_node in iter_preorder(node):
+            subtree_node.truncate_fields()
 
     def reattempt_failed(self, failed):
         for node_id in failed:
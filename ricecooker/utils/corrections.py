@@ -1,14 +1,18 @@
 #!/usr/bin/env python
 import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import copy
 import csv
 from datetime import datetime
 import dictdiffer
+import hashlib
 import json
 import os
 import requests
 
+from ricecooker import config
 from ricecooker.config import LOGGER
+from ricecooker.utils.traversal import get_dict_children, iter_preorder
 
 
 # CONFIG CONSTANTS for data directories
@@ -83,6 +87,42 @@ default_export = ['title', 'description', 'tags', 'copyright_holder', 'author']
 # Studio Tree Local Cache queries
 ################################################################################
 
+STUDIO_TREE_CACHE_VERSION = 1
+
+def flatten_channel_tree(channel_tree):
+    """
+    Return the compact indexed form of `channel_tree` saved in STUDIO_TREES_DIR:
+    a dict with the studio_id of the `root` and the dict `nodes` of all nodes by
+    studio_id, with `children` as lists of studio_ids.
+    """
+    nodes = {}
+    for node in iter_preorder(channel_tree, get_children=get_dict_children):
+        if node.get('children'):
+            node = dict(node, children=[child['id'] for child in node['children']])
+        nodes[node['id']] = node
+    return dict(version=STUDIO_TREE_CACHE_VERSION, root=channel_tree['id'], nodes=nodes)
+
+def unflatten_channel_tree(flat_tree):
+    """
+    Return the nested channel tree for the indexed form `flat_tree`.
+    """
+    nodes = {studio_id: dict(node) for studio_id, node in flat_tree['nodes'].items()}
+    for node in nodes.values():
+        if node.get('children'):
+            node['children'] = [nodes[child_id] for child_id in node['children'] if child_id in nodes]
+    return nodes[flat_tree['root']]
+
+def load_flat_channel_tree(filename):
+    """
+    Load the channel tree saved in `filename` in indexed form, converting trees
+    saved as nested json by previous versions.
+    """
+    with open(filename, 'r', encoding='utf-8') as tree_file:
+        data = json.load(tree_file)
+    if data.get('version') != STUDIO_TREE_CACHE_VERSION or 'nodes' not in data:
+        data = flatten_channel_tree(data)
+    return data
+
 def get_channel_tree(api, channel_id, suffix='', update=True):
     """
     Downloads the entire main tree of a Studio channel to a local json file.
@@ -90,15 +130,13 @@ def get_channel_tree(api, channel_id, suffix='', update=True):
     filename = os.path.join(STUDIO_TREES_DIR, channel_id + suffix + '.json')
     if os.path.exists(filename) and not update:
         print('  Loading cached tree for channel_id=', channel_id, 'from', filename)
-        channel_tree = json.load(open(filename, 'r'))
-        return channel_tree
-    else:
-        print('  Downloading tree for channel_id=', channel_id, ' and saving to', filename)
-        root_studio_id = api.get_channel_root_studio_id(channel_id)
-        # next step takes long since recursively making O(n) API calls!
-        channel_tree = api.get_tree_for_studio_id(root_studio_id)
-        json.dump(channel_tree, open(filename, 'w'), indent=4, ensure_ascii=False, sort_keys=True)
-        return channel_tree
+        return unflatten_channel_tree(load_flat_channel_tree(filename))
+    print('  Downloading tree for channel_id=', channel_id, ' and saving to', filename)
+    root_studio_id = api.get_channel_root_studio_id(channel_id)
+    channel_tree = api.get_tree_for_studio_id(root_studio_id)
+    with open(filename, 'w', encoding='utf-8') as tree_file:
+        json.dump(flatten_channel_tree(channel_tree), tree_file, ensure_ascii=False, separators=(',', ':'))
+    return channel_tree
 
 
 
@@ -353,32 +391,46 @@ def get_corrections_by_node_id(csvfilepath, modifyattrs):
     return correctionspath
 
 
-
 # Tree querying API
 ################################################################################
 
+INDEXED_ATTRS = ['node_id', 'content_id', 'original_source_node_id', 'id']
+
 
-def find_nodes_by_attr(subtree, attr, value):
+def get_tree_index(subtree):
+    """
+    Returns a dict {attr --> {value --> list of nodes}} of the nodes in `subtree`
+    for each attribute in INDEXED_ATTRS, with nodes in the same (pre-)order as
+    a recursive search. Build the index once and pass it to the `find_nodes_by_*`
+    functions to avoid walking the whole tree for every lookup.
+    """
+    index = {attr: {} for attr in INDEXED_ATTRS}
+    for node in iter_preorder(subtree, get_children=get_dict_children):
+        for attr, nodes_by_value in index.items():
+            if attr in node:
+                nodes_by_value.setdefault(node[attr], []).append(node)
+    return index
+
+def find_nodes_by_attr(subtree, attr, value, index=None):
     """
     Returns list of nodes in `subtree` that have attribute `attr` equal to `value`.
+    If `index` (see `get_tree_index`) is given, it is used instead of searching the tree.
     """
-    results = []
-    if subtree[attr] == value:
-        results.append(subtree)
-    if 'children' in subtree:
-        for child in subtree['children']:
-            child_restuls = find_nodes_by_attr(child, attr, value)
-            results.extend(child_restuls)
-    return results
+    if index is not None and attr in index:
+        return list(index[attr].get(value, []))
+    return [node for node in iter_preorder(subtree, get_children=get_dict_children) if node[attr] == value]
+
+def find_nodes_by_content_id(subtree, content_id, index=None):
+    return find_nodes_by_attr(subtree, 'content_id', content_id, index=index)
 
-def find_nodes_by_content_id(subtree, content_id):
-    return find_nodes_by_attr(subtree, 'content_id', content_id)
+def find_nodes_by_node_id(subtree, node_id, index=None):
+    return find_nodes_by_attr(subtree, 'node_id', node_id, index=index)
 
-def find_nodes_by_node_id(subtree, node_id):
-    return find_nodes_by_attr(subtree, 'node_id', node_id)
+def find_nodes_by_original_source_node_id(subtree, original_source_node_id, index=None):
+    return find_nodes_by_attr(subtree, 'original_source_node_id', original_source_node_id, index=index)
 
-def find_nodes_by_original_source_node_id(subtree, original_source_node_id):
-    return find_nodes_by_attr(subtree, 'original_source_node_id', original_source_node_id)
+def find_nodes_by_studio_id(subtree, studio_id, index=None):
+    return find_nodes_by_attr(subtree, 'id', studio_id, index=index)
 
 def unresolve_children(node):
     """
@@ -400,22 +452,32 @@ def unresolve_children(node):
 # SPECIAL REMAP NEEDED FOR ALDARYN CORRECTIONS
 ################################################################################
 
-def remap_original_source_node_id_to_node_id(channel_tree, corrections_by_original_source_node_id):
+def remap_corrections_to_node_id(channel_tree, corrections_by_key, attr):
+    """
+    Re-key the corrections in `corrections_by_key`, keyed by the value of the
+    attribute `attr` of the nodes (e.g. 'original_source_node_id' or 'id' for
+    studio_id), by the node_id of the matching node in `channel_tree`.
+    """
+    index = get_tree_index(channel_tree)
     ALL_COORECTIONS_KINDS = ['nodes_modified', 'nodes_added', 'nodes_deleted', 'nodes_moved']
     corrections_by_node_id = {}
     for correction_kind in ALL_COORECTIONS_KINDS:
-        if correction_kind in corrections_by_original_source_node_id:
+        if correction_kind in corrections_by_key:
             corrections_by_node_id[correction_kind] = {}
-            corrections_dict = corrections_by_original_source_node_id[correction_kind]
-            for original_source_node_id, correction in corrections_dict.items():
-                results = find_nodes_by_original_source_node_id(channel_tree, original_source_node_id)
-                assert results, 'no match found based on original_source_node_id search'
+            corrections_dict = corrections_by_key[correction_kind]
+            for key, correction in corrections_dict.items():
+                results = find_nodes_by_attr(channel_tree, attr, key, index=index)
+                assert results, 'no match found based on ' + attr + ' search'
                 assert len(results)==1, 'multiple matches found...'
                 tree_node = results[0]
-                node_id = tree_node['node_id'] 
+                node_id = tree_node['node_id']
                 corrections_by_node_id[correction_kind][node_id] = correction
     return corrections_by_node_id
 
+def remap_original_source_node_id_to_node_id(channel_tree, corrections_by_original_source_node_id):
+    return remap_corrections_to_node_id(channel_tree, corrections_by_original_source_node_id,
+                                        'original_source_node_id')
+
 
 
 
@@ -424,7 +486,15 @@ def remap_original_source_node_id_to_node_id(channel_tree, corrections_by_origin
 # CORRECTIONS API CALLS
 ################################################################################
 
-def apply_modifications_for_node_id(api, channel_tree, node_id, modifications_dict):
+def get_studio_id_for_node_id(channel_tree, node_id, index=None):
+    results = find_nodes_by_node_id(channel_tree, node_id, index=index)
+    assert results, 'no match found based on node_id search'
+    assert len(results)==1, 'multiple matches found...'
+    return results[0]['id']
+
+
+def apply_modifications_for_node_id(api, channel_tree, node_id, modifications_dict, node_before=None, verify=True,
+                                    index=None):
     """
     Given a modification dict of the form,
         modifications_dict = {
@@ -446,15 +516,15 @@ def apply_modifications_for_node_id(api, channel_tree, node_id, modifications_di
         }
     this function will make obtain GET the current node data from Studio API,
     apply the modifications to the local json data, then PUT the data on Studio.
+    The GET is skipped if the current node data is passed in `node_before`, and
+    the GET done to print what changed is skipped if `verify` is False.
+    Pass the `index` of `channel_tree` (see `get_tree_index`) when applying many
+    corrections to avoid searching the whole tree for each node_id.
     """
     # print('MODIFYING node_id=', node_id)
-    results = find_nodes_by_node_id(channel_tree, node_id)
-    assert results, 'no match found based on node_id search'
-    assert len(results)==1, 'multiple matches found...'
-    tree_node = results[0]
-    studio_id = tree_node['id']
-    # node_before = unresolve_children(tree_node)
-    node_before = api.get_contentnode(studio_id)
+    studio_id = get_studio_id_for_node_id(channel_tree, node_id, index=index)
+    if node_before is None:
+        node_before = api.get_contentnode(studio_id)
     # print('node_before', node_before)
 
     # PREPARE data for PUT request  (starting form copy of old)
@@ -484,20 +554,18 @@ def apply_modifications_for_node_id(api, channel_tree, node_id, modifications_di
     response_data = api.put_contentnode(data)
 
     # Check what changed
-    node_after = api.get_contentnode(studio_id)
-    diffs = list(dictdiffer.diff(node_before, node_after))
-    print('  diff=', diffs)
+    if verify:
+        node_after = api.get_contentnode(studio_id)
+        diffs = list(dictdiffer.diff(node_before, node_after))
+        print('  diff=', diffs)
     return response_data
 
 
-def apply_deletion_for_node_id(api, channel_tree, channel_id, node_id, deletion_dict):
-    results = find_nodes_by_node_id(channel_tree, node_id)
-    assert results, 'no match found based on node_id search'
-    assert len(results)==1, 'multiple matches found...'
-    tree_node = results[0]
-    studio_id = tree_node['id']
-    # node_before = unresolve_children(tree_node)
-    node_before = api.get_contentnode(studio_id)
+def apply_deletion_for_node_id(api, channel_tree, channel_id, node_id, deletion_dict, node_before=None,
+                               verify=True, trash_studio_id=None, index=None):
+    studio_id = get_studio_id_for_node_id(channel_tree, node_id, index=index)
+    if node_before is None:
+        node_before = api.get_contentnode(studio_id)
     
     # PREPARE data for DLETE request
     data = {}
@@ -505,17 +573,55 @@ def apply_deletion_for_node_id(api, channel_tree, channel_id, node_id, deletion_
 
     # DELETE
     print('DELETE studio_id=', studio_id, 'node_id=', node_id)
-    response_data = api.delete_contentnode(data, channel_id)
+    response_data = api.delete_contentnode(data, channel_id, trash_studio_id=trash_studio_id)
 
     # Check what changed
-    node_after = api.get_contentnode(studio_id)
-    diffs = list(dictdiffer.diff(node_before, node_after))
-    print('  diff=', diffs)
+    if verify:
+        node_after = api.get_contentnode(studio_id)
+        diffs = list(dictdiffer.diff(node_before, node_after))
+        print('  diff=', diffs)
 
     return response_data
 
 
-def apply_corrections_by_node_id(api, channel_tree, channel_id, corrections_by_node_id):
+def get_nodes_by_studio_ids(api, studio_ids, executor):
+    """
+    GET the Studio data of the nodes `studio_ids` (without their children) in
+    bulk requests run in `executor` and return a dict studio_id --> node data.
+    """
+    CHUNK_SIZE = 25
+    chunks = [studio_ids[i:i+CHUNK_SIZE] for i in range(0, len(studio_ids), CHUNK_SIZE)]
+    nodes_by_studio_id = {}
+    for chunk_nodes in executor.map(lambda chunk: api.get_nodes_by_ids_bulk(chunk, recursive=False), chunks):
+        for node in chunk_nodes:
+            nodes_by_studio_id[node['id']] = node
+    return nodes_by_studio_id
+
+
+def get_correction_digest(correction):
+    return hashlib.md5(json.dumps(correction, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def load_corrections_journal(journal_path):
+    """
+    Return the set of (correction kind, node_id, correction digest) of the
+    corrections recorded as applied in the journal file `journal_path`.
+    """
+    applied = set()
+    if journal_path is None or not os.path.exists(journal_path):
+        return applied
+    with open(journal_path, encoding='utf-8') as journal_file:
+        for line in journal_file:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # last line cut short by an interrupted run
+            applied.add((entry['kind'], entry['node_id'], entry['digest']))
+    return applied
+
+
+def apply_corrections_by_node_id(api, channel_tree, channel_id, corrections_by_node_id,
+                                 workers=1, verify=True, journal_path=None):
     """
     Given a dict `corrections_by_node_id` of the form,
     {
@@ -533,21 +639,116 @@ def apply_corrections_by_node_id(api, channel_tree, channel_id, corrections_by_n
             '<node_id (str)>': {'old_parent': (str), 'new_parent': (str), 'attributes': {...}},
         },
     }
-    this function will make the appropriate Studio API calls to apply the patch.
+    this function will make the appropriate Studio API calls to apply the patch,
+    sending up to `workers` requests concurrently. The current data of the nodes
+    is fetched with bulk GETs before applying the corrections and again after to
+    print what changed, unless `verify` is False in which case the node data from
+    `channel_tree` is used and nothing is fetched.
+    If `journal_path` is given, each correction applied is recorded in that file
+    and skipped when the function is run again, so an interrupted run can be
+    resumed; the journal is deleted once all the corrections were applied.
+    Returns the list of (correction kind, node_id) of the corrections that failed.
     """
     LOGGER.debug('Applying corrections...')
-    #
-    # Modifications
-    for node_id, modifications_dict in corrections_by_node_id['nodes_modified'].items():
-        apply_modifications_for_node_id(api, channel_tree, node_id, modifications_dict)
-    #
-    # Deletions
-    for node_id, deletion_dict in corrections_by_node_id['nodes_deleted'].items():
-        apply_deletion_for_node_id(api, channel_tree, channel_id, node_id, deletion_dict)
-    # TODO: Additions
-    # TODO: Moves
+    index = get_tree_index(channel_tree)
+    pending = get_pending_corrections(channel_tree, corrections_by_node_id, journal_path, index)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        studio_ids = [studio_id for _, _, _, studio_id in pending]
+        if verify:
+            nodes_before = get_nodes_by_studio_ids(api, studio_ids, executor)
+        else:
+            # only the attributes of the nodes are read, so their children don't need to be unresolved
+            nodes_before = {studio_id: find_nodes_by_studio_id(channel_tree, studio_id, index=index)[0]
+                            for studio_id in studio_ids}
+        trash_studio_id = None
+        if any(correction_kind == 'nodes_deleted' for correction_kind, _, _, _ in pending):
+            trash_studio_id = api.get_channel(channel_id)['trash_tree']['id']
+
+        def apply_correction(correction_kind, node_id, correction, studio_id):
+            if correction_kind == 'nodes_modified':
+                return apply_modifications_for_node_id(api, channel_tree, node_id, correction,
+                                                       node_before=nodes_before[studio_id], verify=False, index=index)
+            return apply_deletion_for_node_id(api, channel_tree, channel_id, node_id, correction,
+                                              node_before=nodes_before[studio_id], verify=False,
+                                              trash_studio_id=trash_studio_id, index=index)
+
+        futures = {executor.submit(apply_correction, *correction): correction for correction in pending}
+        applied_studio_ids, failed = wait_for_corrections(futures, journal_path)
+        if verify:
+            print_corrections_diffs(api, applied_studio_ids, nodes_before, executor)
+
+    if failed:
+        LOGGER.error('{} corrections failed; run the command again to retry them'.format(len(failed)))
+    elif journal_path and os.path.exists(journal_path):
+        os.remove(journal_path)
+    return failed
+
+
+def get_pending_corrections(channel_tree, corrections_by_node_id, journal_path, index):
+    """
+    Return the list of (correction kind, node_id, correction, studio_id) of the
+    corrections in `corrections_by_node_id` that are not recorded as applied in
+    the journal file `journal_path`.
+    """
+    applied = load_corrections_journal(journal_path)
+    pending = []
+    for correction_kind in ['nodes_modified', 'nodes_deleted']:  # TODO: Additions, Moves
+        for node_id, correction in corrections_by_node_id.get(correction_kind, {}).items():
+            if (correction_kind, node_id, get_correction_digest(correction)) in applied:
+                continue
+            studio_id = get_studio_id_for_node_id(channel_tree, node_id, index=index)
+            pending.append((correction_kind, node_id, correction, studio_id))
+    if applied:
+        LOGGER.info('Resuming corrections from journal {}: {} corrections left to apply'.format(
+            journal_path, len(pending)))
+    return pending
 
 
+def wait_for_corrections(futures, journal_path):
+    """
+    Wait for the `futures` applying corrections, a dict future --> (correction kind,
+    node_id, correction, studio_id), and record the corrections applied in the
+    journal file `journal_path` as they complete. Pending futures are cancelled
+    if the run is interrupted.
+    Returns the list of studio_ids of the nodes corrected and the list of
+    (correction kind, node_id) of the corrections that failed.
+    """
+    applied_studio_ids = []
+    failed = []
+    journal_file = open(journal_path, 'a', encoding='utf-8') if journal_path else None
+    try:
+        for future in as_completed(futures):
+            correction_kind, node_id, correction, studio_id = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                LOGGER.error('Failed to apply {} correction for node_id={}: {}'.format(correction_kind, node_id, e))
+                failed.append((correction_kind, node_id))
+                continue
+            applied_studio_ids.append(studio_id)
+            if journal_file:
+                entry = dict(kind=correction_kind, node_id=node_id, digest=get_correction_digest(correction))
+                journal_file.write(json.dumps(entry) + '\n')
+                journal_file.flush()
+    except KeyboardInterrupt:
+        for future in futures:
+            future.cancel()
+        raise
+    finally:
+        if journal_file:
+            journal_file.close()
+    return applied_studio_ids, failed
+
+
+def print_corrections_diffs(api, studio_ids, nodes_before, executor):
+    """
+    GET the nodes `studio_ids` again and print how they differ from `nodes_before`.
+    """
+    nodes_after = get_nodes_by_studio_ids(api, studio_ids, executor)
+    for studio_id in studio_ids:
+        diffs = list(dictdiffer.diff(nodes_before[studio_id], nodes_after.get(studio_id, {})))
+        print('  studio_id=', studio_id, 'diff=', diffs)
+
 
 
 
@@ -555,7 +756,7 @@ def apply_corrections_by_node_id(api, channel_tree, channel_id, corrections_by_n
 
 from ricecooker.utils.libstudio import StudioApi
 
-def get_studio_api(studio_creds=None):
+def get_studio_api(studio_creds=None, max_workers=None):
     if studio_creds is None:
         if not os.path.exists(STUDIO_CREDENTIALS):
             print('ERROR: Studio credentials file', STUDIO_CREDENTIALS, 'not found')
@@ -574,7 +775,8 @@ def get_studio_api(studio_creds=None):
             token=studio_creds['token'],
             username=studio_creds['username'],
             password=studio_creds['password'],
-            studio_url=studio_creds.get('studio_url', 'https://studio.learningequality.org')
+            studio_url=studio_creds.get('studio_url', 'https://studio.learningequality.org'),
+            max_workers=max_workers,
     )
     return api
 
@@ -589,7 +791,7 @@ def export_corrections_csv(args):
 
 def apply_corrections(args):
     # 1. LOAD Studio channel_tree (needed for lookups by node_id, content_id, etc.)
-    api = get_studio_api()
+    api = get_studio_api(max_workers=args.workers)
     channel_tree = get_channel_tree(api, args.channel_id, suffix='-before')
     #
     # 2. IMPORT the corrections from the Spreadsheet
@@ -603,14 +805,17 @@ def apply_corrections(args):
     # Special case: when export was performed on source channel, but we want to
     # apply the corrections to a cloned channel. In that cases, the `Node ID`
     # column in the CSV corresponds to the `original_source_node_id` attribute
-    # of the nodes in the derivative channel so we must do a remapping:
-    if args.primarykey == 'original_source_node_id':
-        corrections_by_original_source_node_id = json.load(open(correctionspath))
-        corrections_by_node_id = remap_original_source_node_id_to_node_id(channel_tree, corrections_by_original_source_node_id)
+    # of the nodes in the derivative channel so we must do a remapping.
+    # The same remapping is done when the column contains studio_ids.
+    if args.primarykey in ['original_source_node_id', 'studio_id']:
+        attr = 'id' if args.primarykey == 'studio_id' else args.primarykey
+        corrections_by_key = json.load(open(correctionspath))
+        corrections_by_node_id = remap_corrections_to_node_id(channel_tree, corrections_by_key, attr)
         json.dump(corrections_by_node_id, open(correctionspath, 'w'), indent=4, ensure_ascii=False, sort_keys=True)
-        print('Finished original_source_node_id-->node_id lookup and remapping.')
-    elif args.primarykey in ['content_id', 'studio_id']:
-        raise NotImplementedError('Using content_id and studio_id not ready yet.')
+        print('Finished ' + args.primarykey + '-->node_id lookup and remapping.')
+    elif args.primarykey == 'content_id':
+        # content_ids are shared by the copies of a node, so a correction can match many nodes
+        raise NotImplementedError('Using content_id not ready yet.')
     #
     # Early exit if running the `importonly` command
     if args.command == 'importonly':
@@ -620,8 +825,10 @@ def apply_corrections(args):
     # 4. LOAD corrections.json (four lists of corrections organized by nod_id)
     corrections_by_node_id = json.load(open(correctionspath))
     #
-    # 5. Apply the corrections
-    apply_corrections_by_node_id(api, channel_tree, args.channel_id, corrections_by_node_id)
+    # 5. Apply the corrections (resuming from the journal of an interrupted run)
+    journal_path = os.path.join(CORRECTIONS_DIR, args.channel_id + '-journal.jsonl')
+    apply_corrections_by_node_id(api, channel_tree, args.channel_id, corrections_by_node_id,
+                                 workers=args.workers, verify=not args.noverify, journal_path=journal_path)
     #
     # 6. SAVE the Studio tree after corrections for review of what was changed
     channel_tree = get_channel_tree(api, args.channel_id, suffix='-after')
@@ -643,6 +850,10 @@ def correctionsmain():
     parser.add_argument('--gid', help='The gid argument to indicate which sheet', default='0')
     parser.add_argument('--modifyattrs', help='Which attributes to modify',
                         default='title,description,author,copyright_holder')
+    parser.add_argument('--workers', type=int, default=config.CORRECTIONS_WORKERS,
+                        help='Number of Studio API requests to send concurrently')
+    parser.add_argument('--noverify', action='store_true',
+                        help='Skip the GET requests done to show what changed in each node')
     args = parser.parse_args()
     # print("in corrections.main with cliargs", args)
     if args.command == 'export':
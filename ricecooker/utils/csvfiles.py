@@ -0,0 +1,18 @@
+import gzip
+
+
+CSV_BUFFER_SIZE = 1024 * 1024
+
+
+def open_csv(path, mode='r', compress=None):
+    """
+    Open the csv file at `path` in `mode` ('r', 'w' or 'a') as utf-8 text with
+    the newline handling the csv module expects, and with a large buffer so
+    writing many rows doesn't result in many small writes. The file is
+    gzip-compressed if `compress` is set (by default when `path` ends in `.gz`).
+    """
+    if compress is None:
+        compress = path.endswith('.gz')
+    if compress:
+        return gzip.open(path, mode + 't', encoding='utf-8', newline='')
+    return open(path, mode, encoding='utf-8', newline='', buffering=CSV_BUFFER_SIZE)
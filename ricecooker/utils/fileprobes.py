@@ -0,0 +1,185 @@
+"""
+Extract the metadata embedded in content files (PDF document info, EPUB package
+metadata, MP3/MP4 tags) used to pre-fill the rows of Content.csv.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import posixpath
+import subprocess
+import xml.etree.ElementTree as ET
+import zipfile
+
+from le_utils.constants import languages
+from PyPDF2 import PdfFileReader
+
+from ricecooker import config
+from ricecooker.config import LOGGER
+
+
+PROBED_FIELDS = ['title', 'author', 'description', 'language']
+PROBE_CACHE_VERSION = 1  # incremented when the metadata returned by probe_file changes
+
+# ISO 639-2 (bibliographic and terminology) codes used in media tags, for the
+# languages whose le-utils code is their ISO 639-1 code
+ISO_639_2_TO_1 = {
+    'amh': 'am', 'ara': 'ar', 'ben': 'bn', 'bur': 'my', 'chi': 'zh', 'dut': 'nl', 'ell': 'el',
+    'eng': 'en', 'fas': 'fa', 'fra': 'fr', 'fre': 'fr', 'ger': 'de', 'deu': 'de', 'gre': 'el',
+    'guj': 'gu', 'hau': 'ha', 'heb': 'he', 'hin': 'hi', 'ibo': 'ig', 'ind': 'id', 'ita': 'it',
+    'jpn': 'ja', 'kan': 'kn', 'khm': 'km', 'kor': 'ko', 'mal': 'ml', 'mar': 'mr', 'mya': 'my',
+    'nep': 'ne', 'nld': 'nl', 'pan': 'pa', 'per': 'fa', 'pol': 'pl', 'por': 'pt', 'ron': 'ro',
+    'rum': 'ro', 'rus': 'ru', 'som': 'so', 'spa': 'es', 'swa': 'sw', 'tam': 'ta', 'tel': 'te',
+    'tha': 'th', 'tur': 'tr', 'ukr': 'uk', 'urd': 'ur', 'vie': 'vi', 'yor': 'yo', 'zho': 'zh',
+}
+DC_NS = 'http://purl.org/dc/elements/1.1/'
+CONTAINER_NS = 'urn:oasis:names:tc:opendocument:xmlns:container'
+
+
+def _probe_pdf(path):
+    with open(path, 'rb') as pdf_file:
+        info = PdfFileReader(pdf_file, strict=False).getDocumentInfo()
+        if info is None:
+            return {}
+        return dict(title=info.title, author=info.author, description=info.subject)
+
+
+def _probe_epub(path):
+    with zipfile.ZipFile(path) as epub_zip:
+        container = ET.fromstring(epub_zip.read('META-INF/container.xml'))
+        rootfile = container.find('.//{%s}rootfile' % CONTAINER_NS)
+        opf = ET.fromstring(epub_zip.read(posixpath.normpath(rootfile.get('full-path'))))
+    metadata = {}
+    for field, dc_element in [('title', 'title'), ('author', 'creator'),
+                              ('description', 'description'), ('language', 'language')]:
+        element = opf.find('.//{%s}%s' % (DC_NS, dc_element))
+        if element is not None:
+            metadata[field] = element.text
+    return metadata
+
+
+def _probe_media(path):
+    try:
+        output = subprocess.check_output(
+            ['ffprobe', '-v', 'error', '-show_entries', 'format_tags=title,artist,comment,language',
+             '-of', 'json', path],
+            stderr=subprocess.DEVNULL,
+        )
+    except FileNotFoundError:
+        return {}  # ffprobe is not installed
+    tags = json.loads(output.decode('utf-8')).get('format', {}).get('tags', {})
+    tags = {key.lower(): value for key, value in tags.items()}
+    return dict(title=tags.get('title'), author=tags.get('artist'),
+                description=tags.get('comment'), language=tags.get('language'))
+
+
+PROBES = {
+    'pdf': _probe_pdf,
+    'epub': _probe_epub,
+    'mp3': _probe_media,
+    'mp4': _probe_media,
+}
+
+
+def normalize_language(tag):
+    """
+    Return the le-utils language code for the language tag `tag` embedded in
+    a file (e.g. 'en', 'en-US', 'en_US', 'eng' or 'English'), trying the primary
+    subtag of tags with a region, or None if the language can't be resolved.
+    """
+    tag = tag.strip().replace('_', '-')
+    primary_subtag = tag.split('-')[0].lower()
+    if primary_subtag == 'und':  # undetermined, the default language of media streams
+        return None
+    for code in [tag, primary_subtag]:
+        language = languages.getlang(code) or languages.getlang(ISO_639_2_TO_1.get(code, ''))
+        # getlang_by_alpha2 is not available in all le-utils versions
+        if language is None and hasattr(languages, 'getlang_by_alpha2') and len(code) == 2:
+            language = languages.getlang_by_alpha2(code)
+        if language is None:
+            language = languages.getlang_by_name(code)
+        if language is not None:
+            return language.code
+    return None
+
+
+def probe_file(path):
+    """
+    Return a dict with the title, author, description and language embedded in
+    the file at `path` (only the fields that are set), or an empty dict if the
+    file type is not supported or the file cannot be read.
+    """
+    ext = os.path.splitext(path)[1][1:].lower()
+    probe = PROBES.get(ext)
+    if probe is None:
+        return {}
+    try:
+        metadata = probe(path)
+    except Exception as e:
+        LOGGER.debug('Could not probe {}: {}'.format(path, e))
+        return {}
+    metadata = {field: value.strip() for field, value in metadata.items()
+                if field in PROBED_FIELDS and isinstance(value, str) and value.strip()}
+    if 'language' in metadata:
+        language = normalize_language(metadata.pop('language'))
+        if language:
+            metadata['language'] = language
+    return metadata
+
+
+def _get_fingerprint(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _load_probe_cache(cache_path):
+    """
+    Return the dict path --> {fingerprint, metadata} saved in `cache_path`, or
+    an empty dict if there is no cache or it was saved by a different version.
+    """
+    if not cache_path or not os.path.exists(cache_path):
+        return {}
+    try:
+        with open(cache_path, encoding='utf-8') as cache_file:
+            data = json.load(cache_file)
+    except ValueError:
+        LOGGER.warning('Ignoring invalid file probe cache ' + cache_path)
+        return {}
+    if data.get('version') != PROBE_CACHE_VERSION:
+        return {}
+    return data['files']
+
+
+def probe_files(paths, cache_path=None, max_workers=None):
+    """
+    Probe the files in `paths` with `probe_file` in a pool of `max_workers`
+    threads (most of the time is spent reading files and waiting for ffprobe)
+    and return a dict path --> metadata.
+    If `cache_path` is given, the results are saved there in a json file keyed by
+    path and only the files whose size or mtime changed are probed again.
+    """
+    cache = _load_probe_cache(cache_path)
+    results = {}
+    fingerprints = {}
+    paths_to_probe = []
+    for path in paths:
+        if os.path.splitext(path)[1][1:].lower() not in PROBES:
+            results[path] = {}
+            continue
+        fingerprint = _get_fingerprint(path)
+        cached = cache.get(path)
+        if cached and cached['fingerprint'] == fingerprint:
+            results[path] = cached['metadata']
+        else:
+            fingerprints[path] = fingerprint
+            paths_to_probe.append(path)
+
+    if paths_to_probe:
+        LOGGER.info('Probing {} files for embedded metadata'.format(len(paths_to_probe)))
+        with ThreadPoolExecutor(max_workers=max_workers or config.PROBE_WORKERS) as executor:
+            for path, metadata in zip(paths_to_probe, executor.map(probe_file, paths_to_probe)):
+                results[path] = metadata
+                cache[path] = dict(fingerprint=fingerprints[path], metadata=metadata)
+        if cache_path:
+            with open(cache_path, 'w', encoding='utf-8') as cache_file:
+                json.dump(dict(version=PROBE_CACHE_VERSION, files=cache), cache_file)
+    return results
@@ -1,6 +1,8 @@
 
+import gzip
 import json
 import os
+import re
 
 from ricecooker.classes import files, nodes, questions
 from ricecooker.classes.licenses import get_license
@@ -12,7 +14,6 @@ from ricecooker.classes.nodes import ChannelNode
 
 # CONSTANTS USED TO SELECT APPROPRIATE CLASS DURING DESERIALIZATION FROM JSON
 ################################################################################
-from le_utils.constants import roles
 
 from le_utils.constants import content_kinds
 TOPIC_NODE = content_kinds.TOPIC
@@ -67,6 +68,272 @@ def write_tree_to_json_tree(destpath, json_tree):
     with open(destpath, 'w', encoding='utf8') as json_file:
         json.dump(json_tree, json_file, indent=2, ensure_ascii=False)
 
+def iterencode_channel_tree(channel, indent=None, separators=None, ensure_ascii=True):
+    """
+    Encode the json tree of the node `channel` one node at a time, yielding
+    strings whose concatenation is the same as
+    `json.dumps(channel.get_json_tree(), indent=indent, ...)`, but without ever
+    building the json tree of the whole channel in memory.
+    """
+    encoder = json.JSONEncoder(indent=indent, separators=separators, ensure_ascii=ensure_ascii)
+    item_separator, key_separator = encoder.item_separator, encoder.key_separator
+    indent_str = ' ' * indent if isinstance(indent, int) else indent
+
+    def newlines(level):
+        if indent is None:
+            return ''
+        return '\n' + indent_str * level
+
+    children_key = encoder.encode('children') + key_separator
+
+    # stack of (node, nesting level, is first child), where a None node closes
+    # the children list of the node at that level
+    stack = [(channel, 0, True)]
+    while stack:
+        node, level, is_first = stack.pop()
+        if node is None:
+            yield newlines(level + 1) + ']' + newlines(level) + '}'
+            continue
+        if level > 0:
+            yield newlines(level) if is_first else item_separator + newlines(level)
+        encoded = encoder.encode(node.to_dict())
+        if indent is not None and level > 0:
+            encoded = encoded.replace('\n', newlines(level))
+        children = node.children
+        if not children:
+            yield encoded
+            continue
+        # leave the node's dict open to append its "children" list
+        closing_brace = newlines(level) + '}'
+        yield encoded[:-len(closing_brace)] + item_separator + newlines(level + 1) + children_key + '['
+        stack.append((None, level, False))
+        stack.extend((child, level + 2, False) for child in reversed(children[1:]))
+        stack.append((children[0], level + 2, True))
+
+def write_channel_tree_to_json(destpath, channel, indent=2, separators=None, ensure_ascii=True, compress=None):
+    """
+    Save the json tree of the node `channel` to the json file at `destpath`,
+    streaming it one node at a time so memory use does not grow with the size
+    of the channel. Use `indent=None` and `separators=(',', ':')` for compact
+    output. The file is gzip-compressed if `compress` is set (by default when
+    `destpath` ends in `.gz`).
+    """
+    if compress is None:
+        compress = destpath.endswith('.gz')
+    parent_dir, _ = os.path.split(destpath)
+    if parent_dir and not os.path.exists(parent_dir):
+        os.makedirs(parent_dir, exist_ok=True)
+    open_fn = gzip.open if compress else open
+    with open_fn(destpath, 'wt', encoding='utf8') as json_file:
+        for chunk in iterencode_channel_tree(channel, indent=indent, separators=separators, ensure_ascii=ensure_ascii):
+            json_file.write(chunk)
+
+
+def _open_json_tree(srcpath, mode='rt'):
+    if srcpath.endswith('.gz'):
+        return gzip.open(srcpath, mode, encoding='utf8')
+    return open(srcpath, mode, encoding='utf8')
+
+def read_tree_root_from_json(srcpath):
+    """
+    Load only the top-level attributes of the ricecooker json tree file at
+    `srcpath` (the channel info), skipping over the `children` list without
+    decoding it.
+    """
+    with _open_json_tree(srcpath) as infile:
+        return _JsonTreeReader(infile).read_root()
+
+
+JSON_TREE_CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE_RE = re.compile(r'[ \t\n\r]*')
+_SKIPPABLE_RE = re.compile(r'[^"\[\]{}]*')
+_STRING_END_RE = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+_ATTRIBUTE_RE = re.compile(r'[ \t\n\r]*(,?)[ \t\n\r]*"([^"\\]*)"[ \t\n\r]*:[ \t\n\r]*')
+# characters that can continue a number, i.e. the number decoded was cut by the end of the buffer
+_NUMBER_CONTINUATION_CHARS = frozenset('.eE+-0123456789')
+
+class _JsonTreeReader(object):
+    """
+    Incremental reader for ricecooker json trees: reads the file a chunk at a
+    time, walks the nested objects and `children` lists itself and decodes
+    the other values of each node with `json.JSONDecoder.raw_decode`, so only
+    the attributes of the nodes being read are held in memory as dicts.
+    """
+
+    def __init__(self, infile, chunk_size=JSON_TREE_CHUNK_SIZE):
+        self.infile = infile
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _read_more(self):
+        if self.eof:
+            raise ValueError('Unexpected end of json tree at position {}'.format(self.pos))
+        # drop the part already read, and read at least as much as is buffered
+        # so values larger than a chunk are decoded in amortized linear time
+        self.buf = self.buf[self.pos:]
+        self.pos = 0
+        chunk = self.infile.read(max(self.chunk_size, len(self.buf)))
+        if not chunk:
+            self.eof = True
+        self.buf += chunk
+
+    def _peek(self):
+        """ Skip whitespace and return the next character without consuming it. """
+        while True:
+            self.pos = _WHITESPACE_RE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            self._read_more()
+
+    def _expect(self, expected):
+        char = self._peek()
+        if char not in expected:
+            raise ValueError('Expected {} in json tree, found {!r}'.format(' or '.join(expected), char))
+        self.pos += 1
+        return char
+
+    def _decode_value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            else:
+                # a number that ends at or near the end of the buffer may continue in the next chunk
+                if self.eof or (end < len(self.buf) and self.buf[end] not in _NUMBER_CONTINUATION_CHARS):
+                    self.pos = end
+                    return value
+            self._read_more()
+
+    def _decode_key(self):
+        if self._peek() != '"':
+            raise ValueError('Expected an attribute name in json tree, found {!r}'.format(self._peek()))
+        key = self._decode_value()
+        self._expect(':')
+        return key
+
+    def _skip_value(self):
+        """ Move past the list or object that starts at the next character. """
+        self._peek()
+        depth = 0
+        while True:
+            self.pos = _SKIPPABLE_RE.match(self.buf, self.pos).end()
+            if self.pos == len(self.buf):
+                self._read_more()
+                continue
+            char = self.buf[self.pos]
+            if char == '"':
+                match = _STRING_END_RE.match(self.buf, self.pos + 1)
+                if match is None:  # string continues in the next chunk
+                    self._read_more()
+                    continue
+                self.pos = match.end()
+            else:
+                self.pos += 1
+                depth += 1 if char in '[{' else -1
+                if depth == 0:
+                    return
+
+    def read_root(self):
+        """ Return the attributes of the top-level object, skipping its children. """
+        self._expect('{')
+        fields = {}
+        first = True
+        while self._peek() != '}':
+            if not first:
+                self._expect(',')
+            key = self._decode_key()
+            if key == 'children' and self._peek() == '[':
+                self._skip_value()
+            else:
+                fields[key] = self._decode_value()
+            first = False
+        self.pos += 1
+        return fields
+
+    def _read_attribute_fast(self, fields, first):
+        """
+        Fast path for the common case of a `"key": value` pair (with no escapes in
+        the key) that is entirely in the buffer. Returns None if the pair was not
+        read, True if it opened a children list and False if it was read into `fields`.
+        """
+        buf = self.buf
+        match = _ATTRIBUTE_RE.match(buf, self.pos)
+        if match is None or (match.group(1) == '') != first or match.end() >= len(buf):
+            return None
+        key, pos = match.group(2), match.end()
+        if key == 'children' and buf[pos] == '[':
+            self.pos = pos + 1
+            return True
+        try:
+            value, end = self.decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            return None
+        if end >= len(buf) or buf[end] in _NUMBER_CONTINUATION_CHARS:
+            return None
+        fields[key] = value
+        self.pos = end
+        return False
+
+    def _read_attribute(self, fields, first):
+        """
+        Read the next `"key": value` pair into `fields`. Returns True if it opened a
+        children list instead.
+        """
+        if not first:
+            self._expect(',')
+        key = self._decode_key()
+        if key == 'children' and self._peek() == '[':
+            self.pos += 1
+            return True
+        fields[key] = self._decode_value()
+        return False
+
+    def _start_child(self, stack, first):
+        """
+        Read the start of the next item of the children list of stack[-1], pushing
+        its attributes dict on `stack`. Returns `(in_children, first)` for what follows.
+        """
+        if self._peek() == ']':
+            self.pos += 1
+            return False, False
+        if not first:
+            self._expect(',')
+        self._expect('{')
+        stack.append({})
+        return False, True
+
+    def iter_nodes(self):
+        """
+        Yield a `(depth, fields)` tuple for each object in the tree in post-order
+        (the children of a node before the node), where `fields` is the dict of
+        the object's attributes other than `children` and `depth` is 0 for the root.
+        """
+        self._expect('{')
+        stack = [{}]          # attributes of the objects being read
+        in_children = False   # whether we are in the children list of stack[-1]
+        first = True          # whether the next item is the first of its object or list
+        while stack:
+            if in_children:
+                in_children, first = self._start_child(stack, first)
+                continue
+            opened_children = self._read_attribute_fast(stack[-1], first)
+            if opened_children is None:
+                if self._peek() == '}':
+                    self.pos += 1
+                    fields = stack.pop()
+                    yield len(stack), fields
+                    in_children, first = True, False
+                    continue
+                opened_children = self._read_attribute(stack[-1], first)
+            in_children = first = opened_children
+
 
 # CONSTRUCT CHANNEL FROM RICECOOKER JSON TREE
 ################################################################################
@@ -88,152 +355,117 @@ def get_channel_node_from_json(json_tree):
 
 def build_tree_from_json(parent_node, sourcetree):
     """
-    Recusively parse nodes in the list `sourcetree` and add them as children
-    to the `parent_node`. Usually called with `parent_node` being a `ChannelNode`.
+    Parse nodes in the list `sourcetree` and add them as children to the
+    `parent_node`, descending into the children of topic nodes (iteratively, so
+    any depth of nesting works). Usually called with `parent_node` being a `ChannelNode`.
     """
-    EXPECTED_NODE_TYPES = [TOPIC_NODE, VIDEO_NODE, AUDIO_NODE, EXERCISE_NODE,
-                           DOCUMENT_NODE, HTML5_NODE, SLIDESHOW_NODE]
+    factory = _JsonNodeFactory()
+    stack = [(parent_node, iter(sourcetree))]
+    while stack:
+        parent, source_nodes = stack[-1]
+        source_node = next(source_nodes, None)
+        if source_node is None:
+            stack.pop()
+            continue
+        child_node = factory.make_node(source_node)
+        parent.add_child(child_node)
+        if source_node['kind'] == TOPIC_NODE:
+            stack.append((child_node, iter(source_node.get('children') or [])))
+    return parent_node
 
-    for source_node in sourcetree:
+
+def build_tree_from_json_file(srcpath, parent_node=None, chunk_size=JSON_TREE_CHUNK_SIZE):
+    """
+    Build the nodes of the ricecooker json tree file at `srcpath` while reading
+    it, instead of loading the whole file with `read_tree_from_json` first: the
+    json dict of each node is dropped as soon as its node is created, so large
+    trees load with a fraction of the memory. The top-level children are added
+    to `parent_node`, or to a new `ChannelNode` made from the top-level
+    attributes when `parent_node` is None. Returns that node.
+    Files ending in `.gz` are read as gzip-compressed json.
+    """
+    pending = []  # nodes at each depth waiting for their parent object to end
+    factory = _JsonNodeFactory()
+    with _open_json_tree(srcpath) as infile:
+        for depth, fields in _JsonTreeReader(infile, chunk_size=chunk_size).iter_nodes():
+            children = pending[depth + 1] if len(pending) > depth + 1 else []
+            del pending[depth + 1:]
+            if depth == 0:
+                node = parent_node if parent_node is not None else get_channel_node_from_json(fields)
+            else:
+                node = factory.make_node(fields)
+                if fields['kind'] != TOPIC_NODE:
+                    children = []  # only topics have children
+            for child in children:
+                node.add_child(child)
+            while len(pending) <= depth:
+                pending.append([])
+            pending[depth].append(node)
+    return pending[0][0]
+
+
+# attributes of the json dict passed on to the node for each kind of node, when
+# present (documents don't take derive_thumbnail)
+_TOPIC_ATTRIBUTES = ('description', 'author', 'aggregator', 'provider', 'language',
+                     'thumbnail', 'derive_thumbnail', 'tags')
+_CONTENT_ATTRIBUTES = _TOPIC_ATTRIBUTES + ('role',)
+_DOCUMENT_ATTRIBUTES = tuple(name for name in _CONTENT_ATTRIBUTES if name != 'derive_thumbnail')
+
+NODE_TYPES = {
+    TOPIC_NODE: (nodes.TopicNode, _TOPIC_ATTRIBUTES),
+    VIDEO_NODE: (nodes.VideoNode, _CONTENT_ATTRIBUTES),
+    AUDIO_NODE: (nodes.AudioNode, _CONTENT_ATTRIBUTES),
+    EXERCISE_NODE: (nodes.ExerciseNode, _CONTENT_ATTRIBUTES + ('exercise_data',)),
+    DOCUMENT_NODE: (nodes.DocumentNode, _DOCUMENT_ATTRIBUTES),
+    HTML5_NODE: (nodes.HTML5AppNode, _CONTENT_ATTRIBUTES),
+    SLIDESHOW_NODE: (nodes.SlideshowNode, _CONTENT_ATTRIBUTES),
+    # TODO: add support for H5P content kind
+}
+
+class _JsonNodeFactory(object):
+    """
+    Creates the nodes described by the json dicts of a ricecooker json tree,
+    using the node class and attributes listed in NODE_TYPES for their kind.
+    Content nodes with the same license attributes share one License object.
+    """
+
+    def __init__(self):
+        self.licenses = {}
+
+    def get_license(self, license_dict):
+        key = tuple(license_dict.items())
+        license = self.licenses.get(key)
+        if license is None:
+            license = self.licenses[key] = get_license(**license_dict)
+        return license
+
+    def make_node(self, source_node):
+        """
+        Create the node for the json dict `source_node`, along with its files
+        or questions but without its children.
+        """
         kind = source_node['kind']
-        if kind not in EXPECTED_NODE_TYPES:
+        if kind not in NODE_TYPES:
             LOGGER.critical('Unexpected node kind found: ' + kind)
             raise NotImplementedError('Unexpected node kind found in json data.')
+        node_class, attributes = NODE_TYPES[kind]
+        kwargs = {name: source_node[name] for name in attributes if name in source_node}
 
         if kind == TOPIC_NODE:
-            child_node = nodes.TopicNode(
-                source_id=source_node.get('source_id', None),
-                title=source_node['title'],
-                description=source_node.get('description'),
-                author=source_node.get('author'),
-                aggregator=source_node.get('aggregator'),
-                provider=source_node.get('provider'),
-                # no role for topics (computed dynaically from descendants)
-                language=source_node.get('language'),
-                thumbnail=source_node.get('thumbnail'),
-                derive_thumbnail=source_node.get('derive_thumbnail', False),
-                tags=source_node.get('tags'),
-            )
-            parent_node.add_child(child_node)
-            source_tree_children = source_node.get('children', [])
-            build_tree_from_json(child_node, source_tree_children)
-
-        elif kind == VIDEO_NODE:
-            child_node = nodes.VideoNode(
-                source_id=source_node['source_id'],
-                title=source_node['title'],
-                description=source_node.get('description'),
-                license=get_license(**source_node['license']),
-                author=source_node.get('author'),
-                aggregator=source_node.get('aggregator'),
-                provider=source_node.get('provider'),
-                role=source_node.get('role', roles.LEARNER),
-                language=source_node.get('language'),
-                thumbnail=source_node.get('thumbnail'),
-                derive_thumbnail=source_node.get('derive_thumbnail', False),
-                tags=source_node.get('tags'),
-            )
-            add_files(child_node, source_node.get('files') or [])
-            parent_node.add_child(child_node)
-
-        elif kind == AUDIO_NODE:
-            child_node = nodes.AudioNode(
-                source_id=source_node['source_id'],
-                title=source_node['title'],
-                description=source_node.get('description'),
-                license=get_license(**source_node['license']),
-                author=source_node.get('author'),
-                aggregator=source_node.get('aggregator'),
-                provider=source_node.get('provider'),
-                role=source_node.get('role', roles.LEARNER),
-                language=source_node.get('language'),
-                thumbnail=source_node.get('thumbnail'),
-                derive_thumbnail=source_node.get('derive_thumbnail', False),
-                tags=source_node.get('tags'),
-            )
-            add_files(child_node, source_node.get('files') or [])
-            parent_node.add_child(child_node)
-
-        elif kind == EXERCISE_NODE:
-            child_node = nodes.ExerciseNode(
-                source_id=source_node['source_id'],
-                title=source_node['title'],
-                description=source_node.get('description'),
-                license=get_license(**source_node['license']),
-                author=source_node.get('author'),
-                aggregator=source_node.get('aggregator'),
-                provider=source_node.get('provider'),
-                role=source_node.get('role', roles.LEARNER),
-                language=source_node.get('language'),
-                thumbnail=source_node.get('thumbnail'),
-                derive_thumbnail=source_node.get('derive_thumbnail', False),  # not supported yet
-                tags=source_node.get('tags'),
-                exercise_data=source_node.get('exercise_data'),
-                questions=[],
-            )
-            add_questions(child_node, source_node.get('questions') or [])
-            parent_node.add_child(child_node)
-
-        elif kind == DOCUMENT_NODE:
-            child_node = nodes.DocumentNode(
-                source_id=source_node['source_id'],
-                title=source_node['title'],
-                description=source_node.get('description'),
-                license=get_license(**source_node['license']),
-                author=source_node.get('author'),
-                aggregator=source_node.get('aggregator'),
-                provider=source_node.get('provider'),
-                role=source_node.get('role', roles.LEARNER),
-                language=source_node.get('language'),
-                thumbnail=source_node.get('thumbnail'),
-                tags=source_node.get('tags'),
-            )
-            add_files(child_node, source_node.get('files') or [])
-            parent_node.add_child(child_node)
-
-        elif kind == HTML5_NODE:
-            child_node = nodes.HTML5AppNode(
-                source_id=source_node['source_id'],
-                title=source_node['title'],
-                description=source_node.get('description'),
-                license=get_license(**source_node['license']),
-                author=source_node.get('author'),
-                aggregator=source_node.get('aggregator'),
-                provider=source_node.get('provider'),
-                role=source_node.get('role', roles.LEARNER),
-                language=source_node.get('language'),
-                thumbnail=source_node.get('thumbnail'),
-                derive_thumbnail=source_node.get('derive_thumbnail', False),
-                tags=source_node.get('tags'),
-            )
-            add_files(child_node, source_node.get('files') or [])
-            parent_node.add_child(child_node)
-
-        elif kind == SLIDESHOW_NODE:
-            child_node = nodes.SlideshowNode(
-                source_id=source_node['source_id'],
-                title=source_node['title'],
-                description=source_node.get('description'),
-                license=get_license(**source_node['license']),
-                author=source_node.get('author'),
-                aggregator=source_node.get('aggregator'),
-                provider=source_node.get('provider'),
-                role=source_node.get('role', roles.LEARNER),
-                language=source_node.get('language'),
-                thumbnail=source_node.get('thumbnail'),
-                derive_thumbnail=source_node.get('derive_thumbnail', False),
-                tags=source_node.get('tags')
-            )
-            add_files(child_node, source_node.get('files') or [])
-            parent_node.add_child(child_node)
-
-        # TODO: add support for H5P content kind
-
+            # no license or role for topics (role is computed dynamically from descendants)
+            return node_class(source_id=source_node.get('source_id'), title=source_node['title'], **kwargs)
+
+        node = node_class(
+            source_id=source_node['source_id'],
+            title=source_node['title'],
+            license=self.get_license(source_node['license']),
+            **kwargs
+        )
+        if kind == EXERCISE_NODE:
+            add_questions(node, source_node.get('questions') or [])
         else:
-            LOGGER.critical('Encountered an unknown kind: ' + str(source_node))
-            continue
-
-    return parent_node
+            add_files(node, source_node.get('files') or [])
+        return node
 
 
 def add_files(node, file_list):
@@ -1,4 +1,8 @@
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
+
+from ricecooker import config
 from ricecooker.config import LOGGER
 
 
@@ -18,18 +22,39 @@ class StudioApi(object):
     corrections, and other automation.
     """
 
-    def __init__(self, token, username=None, password=None, studio_url=DEFAULT_STUDIO_URL):
+    def __init__(self, token, username=None, password=None, studio_url=DEFAULT_STUDIO_URL, max_workers=None):
         self.studio_url = studio_url.rstrip('/')
         self.token = token
+        self.max_workers = max_workers or config.STUDIO_API_WORKERS
+        self.token_session = self._create_token_session()
         self.licenses_by_id = self.get_licenses()
         if username and password:
             self.session = self._create_logged_in_session(username, password)
         else:
             self.session = None
 
+    def _create_pooled_session(self):
+        """
+        Session with a connection pool large enough to reuse connections for
+        `max_workers` concurrent requests.
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def _create_token_session(self):
+        """
+        Session for the endpoints that use token auth.
+        """
+        session = self._create_pooled_session()
+        session.headers.update({"Authorization": "Token {0}".format(self.token)})
+        return session
+
     def _create_logged_in_session(self, username, password):
         LOGIN_ENDPOINT = self.studio_url + '/accounts/login/'
-        session = requests.session()
+        session = self._create_pooled_session()
         session.headers.update({"referer": self.studio_url})
         session.headers.update({'User-Agent': 'Mozilla/5.0 Firefox/63.0'})
         session.get(LOGIN_ENDPOINT)
@@ -43,6 +68,9 @@ class StudioApi(object):
         }
         response2 = session.post(LOGIN_ENDPOINT, data=post_data)
         assert response2.status_code == 200, 'Login POST failed'
+        # the csrf token changes on login; set its header once here since the
+        # session is shared by the threads that apply corrections concurrently
+        session.headers.update({"x-csrftoken": session.cookies.get("csrftoken")})
         return session
 
 
@@ -79,8 +107,7 @@ class StudioApi(object):
 
     def get_licenses(self):
         LICENSES_LIST_ENDPOINT = self.studio_url + '/api/license'
-        headers = {"Authorization": "Token {0}".format(self.token)}
-        response = requests.get(LICENSES_LIST_ENDPOINT, headers=headers)
+        response = self.token_session.get(LICENSES_LIST_ENDPOINT)
         licenses_list = response.json()
         licenses_dict = {}
         for license in licenses_list:
@@ -93,45 +120,75 @@ class StudioApi(object):
         Get the complete JSON representation of a content node from the Studio API.
         """
         NODES_ENDPOINT = self.studio_url + '/api/get_nodes_by_ids_complete/'
-        headers = {"Authorization": "Token {0}".format(self.token)}
         url = NODES_ENDPOINT + studio_id
         LOGGER.info('  GET ' + url)
-        response = requests.get(url, headers=headers)
+        response = self.token_session.get(url)
         studio_node = response.json()[0]
         return studio_node
 
-    def get_nodes_by_ids_bulk(self, studio_ids):
+    def _get_nodes_chunk(self, studio_ids):
+        NODES_ENDPOINT = self.studio_url + '/api/get_nodes_by_ids_complete/'
+        url = NODES_ENDPOINT + ','.join(studio_ids)
+        LOGGER.info('  GET ' + url)
+        response = self.token_session.get(url)
+        response.raise_for_status()
+        return response.json()
+
+    def _get_nodes_in_chunks(self, studio_ids, executor=None):
         """
-        A more efficient version of `get_nodes_by_ids_complete` that GETs tree
-        content node data in chunks of 10 from the Studio API.
+        GET the nodes `studio_ids` in chunks of 25, concurrently in `executor`
+        if given, and return them in the order of `studio_ids`.
         """
         CHUNK_SIZE = 25
-        NODES_ENDPOINT = self.studio_url + '/api/get_nodes_by_ids_complete/'
-        headers = {"Authorization": "Token {0}".format(self.token)}
-        studio_nodes = []
         studio_ids_chunks = [studio_ids[i:i+CHUNK_SIZE] for i in range(0, len(studio_ids), CHUNK_SIZE)]
-        for studio_ids_chunk in studio_ids_chunks:
-            studio_ids_csv = ','.join(studio_ids_chunk)
-            url = NODES_ENDPOINT + studio_ids_csv
-            LOGGER.info('  GET ' + url)
-            response = requests.get(url, headers=headers)
-            chunk_nodes = response.json()
+        if executor is None or len(studio_ids_chunks) <= 1:
+            chunks_nodes = map(self._get_nodes_chunk, studio_ids_chunks)
+        else:
+            chunks_nodes = executor.map(self._get_nodes_chunk, studio_ids_chunks)
+        nodes_by_id = {}
+        for chunk_nodes in chunks_nodes:
             for chunk_node in chunk_nodes:
-                if 'children' in chunk_node:
-                    child_nodes = self.get_nodes_by_ids_bulk(chunk_node['children'])
-                    chunk_node['children'] = child_nodes
-            studio_nodes.extend(chunk_nodes)
+                nodes_by_id[chunk_node['id']] = chunk_node
+        return [nodes_by_id[studio_id] for studio_id in studio_ids if studio_id in nodes_by_id]
+
+    def _get_descendants(self, studio_nodes, executor):
+        """
+        Replace the `children` studio_ids of `studio_nodes` by the complete
+        child nodes, recursively. The tree is fetched level by level, so the
+        requests for all the nodes at the same depth are sent concurrently.
+        """
+        level = studio_nodes
+        while level:
+            parents = [node for node in level if node.get('children')]
+            child_ids = [child_id for node in parents for child_id in node['children']]
+            child_nodes = self._get_nodes_in_chunks(child_ids, executor=executor)
+            child_nodes_by_id = {child_node['id']: child_node for child_node in child_nodes}
+            for node in parents:
+                node['children'] = [child_nodes_by_id[child_id] for child_id in node['children']
+                                    if child_id in child_nodes_by_id]
+            level = child_nodes
+
+    def get_nodes_by_ids_bulk(self, studio_ids, recursive=True):
+        """
+        A more efficient version of `get_nodes_by_ids_complete` that GETs tree
+        content node data in chunks of 25 from the Studio API, sending up to
+        `max_workers` requests concurrently. The `children` of the nodes are
+        also fetched unless `recursive` is False, in which case they are left
+        as lists of studio_ids.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            studio_nodes = self._get_nodes_in_chunks(studio_ids, executor=executor)
+            if recursive:
+                self._get_descendants(studio_nodes, executor)
         return studio_nodes
 
     def get_tree_for_studio_id(self, studio_id):
         """
-        Returns the full json tree (recusive calls to /api/get_nodes_by_ids_complete)
+        Returns the full json tree (level by level calls to /api/get_nodes_by_ids_complete)
         """
         channel_root = self.get_nodes_by_ids_complete(studio_id)
-        if 'children' in channel_root:
-            children_refs = channel_root['children']
-            studio_nodes = self.get_nodes_by_ids_bulk(children_refs)
-            channel_root['children'] = studio_nodes
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            self._get_descendants([channel_root], executor)
         return channel_root
 
 
@@ -151,8 +208,6 @@ class StudioApi(object):
         # studio_id = data['id']
         url = CONTENTNODE_ENDPOINT
         # print('  semantic PATCH using PUT ' + url)
-        csrftoken = self.session.cookies.get("csrftoken")
-        self.session.headers.update({"x-csrftoken": csrftoken})
         response = self.session.put(url, json=[data])
         node_data = response.json()
         return node_data
@@ -177,8 +232,6 @@ class StudioApi(object):
         }
         url = MOVE_NODES_ENDPOINT
         # print('  semantic DELETE using POST to ' + url)
-        csrftoken = self.session.cookies.get("csrftoken")
-        self.session.headers.update({"x-csrftoken": csrftoken})
         response = self.session.post(url, json=post_data)
         deleted_datas = response.json()
         return deleted_datas
@@ -198,8 +251,6 @@ class StudioApi(object):
         }
         url = DUPLICATE_NODE_INLINE_ENDPOINT
         # print('  semantic COPY using POST to ' + url)
-        csrftoken = self.session.cookies.get("csrftoken")
-        self.session.headers.update({"x-csrftoken": csrftoken})
         response = self.session.post(url, json=post_data)
         copied_data_list = response.json()
         return copied_data_list
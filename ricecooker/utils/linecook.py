@@ -1,9 +1,12 @@
 import argparse
+import hashlib
+import json
 import os
 
 from ricecooker.config import LOGGER
 from le_utils.constants import content_kinds
 from .metadata_provider import path_to_tuple
+from .paths import walk_sorted
 from .jsontrees import (TOPIC_NODE, VIDEO_NODE, AUDIO_NODE, EXERCISE_NODE,
                         DOCUMENT_NODE, HTML5_NODE)
 from .jsontrees import (VIDEO_FILE, AUDIO_FILE, DOCUMENT_FILE, EPUB_FILE, HTML5_FILE,
@@ -17,6 +20,7 @@ DIR_EXCLUDE_PATTERNS = []
 FILE_EXCLUDE_EXTENTIONS = ['.DS_Store', 'Thumbs.db', 'ehthumbs.db', 'ehthumbs_vista.db', '.gitkeep']
 FILE_SKIP_PATTENRS = []
 FILE_SKIP_THUMBNAILS = []  # global list of paths that correspond to thumbails for other content nodes
+FOLDER_CACHE_VERSION = 1   # increment when the nodes created by process_folder change
 
 
 
@@ -58,11 +62,15 @@ def rel_path_from_chan_path(chan_path, channeldir, windows=False):
     rel_path = os.path.join(channeldir, *chan_path_list)
     return rel_path
 
-def get_topic_for_path(channel, chan_path_tuple):
+def get_topic_for_path(channel, chan_path_tuple, topics_by_path=None):
     """
     Given channel (dict) that contains a hierary of TopicNode dicts, we use the
     walk the path given in `chan_path_tuple` to find the corresponding TopicNode.
+    Topics in the `topics_by_path` index (chan_path_tuple --> TopicNode dict)
+    are returned directly.
     """
+    if topics_by_path is not None and tuple(chan_path_tuple) in topics_by_path:
+        return topics_by_path[tuple(chan_path_tuple)]
     assert chan_path_tuple[0] == channel['dirname'], 'Wrong channeldir'
     chan_path_list = list(chan_path_tuple)
     chan_path_list.pop(0)    # skip the channel name
@@ -102,7 +110,7 @@ def filter_thumbnail_files(chan_path, filenames, metadata_provider):
     """
     We don't want to create `ContentNode` from thumbnail files.
     """
-    thumbnail_files_to_skip = metadata_provider.get_thumbnail_paths()
+    thumbnail_files_to_skip = metadata_provider.get_thumbnail_path_set()
     filenames_cleaned = []
     for filename in filenames:
         keep = True
@@ -125,14 +133,16 @@ def keep_folder(raw_path):
             keep = False
     return keep
 
-def process_folder(channel, rel_path, filenames, metadata_provider):
+def process_folder(channel, rel_path, filenames, metadata_provider, topics_by_path=None):
     """
     Create `ContentNode`s from each file in this folder and the node to `channel`
-    under the path `rel_path`.
+    under the path `rel_path`. The topic created for the folder is added to the
+    `topics_by_path` index if given (see `get_topic_for_path`).
+    Returns the topic (None for the channel root) and the list of content nodes.
     """
     LOGGER.debug('IN process_folder ' + str(rel_path) + '     ' + str(filenames))
     if not keep_folder(rel_path):
-        return
+        return None, []
 
     chan_path = chan_path_from_rel_path(rel_path, metadata_provider.channeldir)
     chan_path_tuple = path_to_tuple(chan_path)
@@ -143,12 +153,13 @@ def process_folder(channel, rel_path, filenames, metadata_provider):
     if len(chan_path_list) == 1:
         # CASE CHANNEL ROOT: `rel_path` points to `channeldir`
         # No need to create a topic node here since channel already exists
+        topic = None
         containing_node = channel  # attach content nodes in filenames directly to channel
 
     else:
         # CASE TOPIC FOLDER: `rel_path` points to a channelroot subfolder (a.k.a TopicNode)
         dirname = chan_path_list.pop()  # name of the folder (used as ID for internal lookup)
-        topic_parent_node = get_topic_for_path(channel, chan_path_list)
+        topic_parent_node = get_topic_for_path(channel, chan_path_list, topics_by_path)
 
         # read topic metadata to get title and description for the TopicNode
         topic_metadata = metadata_provider.get(chan_path_tuple)
@@ -171,6 +182,8 @@ def process_folder(channel, rel_path, filenames, metadata_provider):
             children=[],
         )
         topic_parent_node['children'].append(topic)
+        if topics_by_path is not None:
+            topics_by_path[chan_path_tuple] = topic
         containing_node = topic  # attach content nodes in filenames to the newly created topic
 
     # filter filenames
@@ -178,17 +191,95 @@ def process_folder(channel, rel_path, filenames, metadata_provider):
     filenames_cleaned2 = filter_thumbnail_files(chan_path, filenames_cleaned, metadata_provider)
 
     # PROCESS FILES
+    nodes = []
     for filename in filenames_cleaned2:
         chan_filepath = os.path.join(chan_path, filename)
         chan_filepath_tuple = path_to_tuple(chan_filepath)
         metadata = metadata_provider.get(chan_filepath_tuple)
         node = make_content_node(metadata_provider.channeldir, rel_path, filename, metadata)
-        containing_node['children'].append(node)  # attach content node to containing_node
+        nodes.append(node)
+    containing_node['children'].extend(nodes)  # attach content nodes to containing_node
+    return topic, nodes
+
+
+def add_cached_folder(channel, rel_path, topic_fields, nodes, metadata_provider, topics_by_path):
+    """
+    Add the topic and content nodes that `process_folder` created for the folder
+    `rel_path` in a previous run (see `build_ricecooker_json_tree`) to `channel`.
+    """
+    if not keep_folder(rel_path):
+        return
+    chan_path = chan_path_from_rel_path(rel_path, metadata_provider.channeldir)
+    chan_path_tuple = path_to_tuple(chan_path)
+    if len(chan_path_tuple) == 1:
+        containing_node = channel
+    else:
+        topic_parent_node = get_topic_for_path(channel, list(chan_path_tuple[:-1]), topics_by_path)
+        containing_node = dict(topic_fields, children=[])
+        topic_parent_node['children'].append(containing_node)
+        topics_by_path[chan_path_tuple] = containing_node
+    containing_node['children'].extend(nodes)
+
+
+def get_folder_metadata_digest(rel_path, filenames, metadata_provider):
+    """
+    Return a digest of all the metadata `process_folder` uses for the folder
+    `rel_path` containing `filenames`, used to check if the nodes created for the
+    folder in a previous run can be reused after the metadata files changed.
+    """
+    chan_path = chan_path_from_rel_path(rel_path, metadata_provider.channeldir)
+    thumbnail_paths = metadata_provider.get_thumbnail_path_set()
+    metadata = [metadata_provider.get(path_to_tuple(chan_path), warn_missing=False)]
+    for filename in filenames:
+        chan_filepath_tuple = path_to_tuple(os.path.join(chan_path, filename))
+        metadata.append([chan_filepath_tuple in thumbnail_paths,
+                         metadata_provider.get(chan_filepath_tuple, warn_missing=False)])
+    metadata_json = json.dumps(metadata, sort_keys=True, default=str)
+    return hashlib.md5(metadata_json.encode('utf-8')).hexdigest()
+
+
+def _get_file_key(path):
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return [path, stat.st_mtime_ns, stat.st_size]
+
+
+def _load_folder_cache(cache_path):
+    if cache_path is None or not os.path.exists(cache_path):
+        return {}
+    try:
+        with open(cache_path, encoding='utf-8') as cache_file:
+            cache = json.load(cache_file)
+    except ValueError:
+        LOGGER.warning('Ignoring invalid LineCook folder cache ' + cache_path)
+        return {}
+    if cache.get('version') != FOLDER_CACHE_VERSION:
+        return {}
+    return cache
+
+
+def _get_reusable_folder_entry(entry, rel_path, sorted_filenames, metadata_provider, metadata_unchanged):
+    """
+    Return the folder cache `entry` of the folder `rel_path` if its nodes can be
+    reused: the folder has the same files and their metadata didn't change.
+    Otherwise return None.
+    """
+    if not entry or entry['filenames'] != sorted_filenames:
+        return None
+    if not metadata_unchanged:
+        digest = get_folder_metadata_digest(rel_path, sorted_filenames, metadata_provider)
+        if digest != entry['digest']:
+            return None
+    return entry
 
 
-def build_ricecooker_json_tree(args, options, metadata_provider, json_tree_path):
+def build_ricecooker_json_tree(args, options, metadata_provider, json_tree_path, cache_path=None):
     """
     Download all categories, subpages, modules, and resources from open.edu.
+    If `cache_path` is given, the nodes created for each folder are saved there
+    along with the folder's listing and a digest of its metadata, and reused
+    in the next run for the folders where neither changed.
     """
     LOGGER.info('Starting to build the ricecooker_json_tree')
 
@@ -216,10 +307,18 @@ def build_ricecooker_json_tree(args, options, metadata_provider, json_tree_path)
         thumbnail=thumbnail_rel_path,
         children=[],
     )
+    topics_by_path = {}  # chan_path_tuple --> topic dict, for finding the parent of each folder
+    cache = _load_folder_cache(cache_path)
+    cached_folders = cache.get('folders', {})
+    metadata_key = metadata_provider.get_metadata_key()
+    # folders' metadata digests only need to be checked when the metadata changed
+    metadata_unchanged = metadata_key is not None and cache.get('metadata_key') == metadata_key
+    folders = {}  # rel_path --> folder cache entry, for the folders in this run
+    num_cached = 0
     channeldir = args['channeldir']
-    content_folders = sorted(os.walk(channeldir))
+    content_folders = walk_sorted(channeldir)
 
-    # MAIN PROCESSING OF os.walk OUTPUT
+    # MAIN PROCESSING OF os.walk OUTPUT (in sorted order)
     ############################################################################
     # TODO(ivan): figure out all the implications of the
     # _ = content_folders.pop(0)  # Skip over channel folder because handled above
@@ -238,11 +337,54 @@ def build_ricecooker_json_tree(args, options, metadata_provider, json_tree_path)
             filenames.extend(exercises_filenames)
 
         sorted_filenames = sorted(filenames)
-        process_folder(ricecooker_json_tree, rel_path, sorted_filenames, metadata_provider)
+        if cache_path is None:
+            process_folder(ricecooker_json_tree, rel_path, sorted_filenames, metadata_provider, topics_by_path)
+            continue
+
+        entry = _get_reusable_folder_entry(cached_folders.get(rel_path), rel_path, sorted_filenames,
+                                           metadata_provider, metadata_unchanged)
+        if entry is not None:
+            add_cached_folder(ricecooker_json_tree, rel_path, entry['topic'], entry['nodes'],
+                              metadata_provider, topics_by_path)
+            num_cached += 1
+        else:
+            topic, nodes = process_folder(ricecooker_json_tree, rel_path, sorted_filenames, metadata_provider,
+                                          topics_by_path)
+            entry = dict(
+                filenames=sorted_filenames,
+                digest=get_folder_metadata_digest(rel_path, sorted_filenames, metadata_provider),
+                topic={key: value for key, value in topic.items() if key != 'children'} if topic else None,
+                nodes=nodes,
+            )
+        folders[rel_path] = entry
+
+    if cache_path is None:
+        # Write out ricecooker_json_tree.json
+        write_tree_to_json_tree(json_tree_path, ricecooker_json_tree)
+        LOGGER.info('Folder hierarchy walk result stored in ' + json_tree_path)
+        return
 
-    # Write out ricecooker_json_tree.json
-    write_tree_to_json_tree(json_tree_path, ricecooker_json_tree)
-    LOGGER.info('Folder hierarchy walk result stored in ' + json_tree_path)
+    # Write out ricecooker_json_tree.json, unless this same tree was written there
+    # in the previous run (all the folders were reused and the channel is the same)
+    LOGGER.info('Reused the nodes of {} unchanged folders out of {}'.format(num_cached, len(folders)))
+    channel_fields = {key: value for key, value in ricecooker_json_tree.items() if key != 'children'}
+    if num_cached == len(folders) == len(cached_folders) and cache.get('channel') == channel_fields \
+            and cache.get('json_tree') == _get_file_key(json_tree_path):
+        LOGGER.info('Folder hierarchy unchanged since it was stored in ' + json_tree_path)
+        if cache.get('metadata_key') == metadata_key:
+            return
+    else:
+        write_tree_to_json_tree(json_tree_path, ricecooker_json_tree)
+        LOGGER.info('Folder hierarchy walk result stored in ' + json_tree_path)
+    cache = dict(
+        version=FOLDER_CACHE_VERSION,
+        metadata_key=metadata_key,
+        channel=channel_fields,
+        json_tree=_get_file_key(json_tree_path),
+        folders=folders,
+    )
+    with open(cache_path, 'w', encoding='utf-8') as cache_file:
+        cache_file.write(json.dumps(cache, separators=(',', ':')))
 
 
 def make_content_node(channeldir, rel_path, filename, metadata):
@@ -1,16 +1,22 @@
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 import csv
 import json
 import os
+import pickle
 import re
 import requests
 from unicodedata import normalize
 
 from le_utils.constants import content_kinds, exercises
 from ricecooker.config import LOGGER
+from ricecooker.utils.csvfiles import open_csv
+from ricecooker.utils.fileprobes import probe_files
 from ricecooker.utils.libstudio import StudioApi
+from ricecooker.utils.paths import walk_sorted
+from ricecooker.utils.xlsxfiles import iter_xlsx_rows
 
 from ricecooker.classes.questions import MARKDOWN_IMAGE_REGEX
+from ricecooker.classes.slots import intern_str
 
 
 # CONSTANTS
@@ -20,6 +26,7 @@ CSV_STR_TRUE_VALUES = ['on', 'yes', '1', 'true']
 CSV_STR_FALSE_VALUES = ['off', 'no', '0', 'false']
 
 DEFAULT_CHANNEL_INFO_FILENAME = 'Channel.csv'
+DEFAULT_CHANNEL_INFO_XLSX_FILENAME = 'Channel.xlsx'
 CHANNEL_TITLE_KEY = 'Title'
 CHANNEL_DESCRIPTION_KEY = 'Description'
 CHANNEL_DOMAIN_KEY = 'Domain'
@@ -36,6 +43,7 @@ CHANNEL_INFO_HEADER = [
 ]
 
 DEFAULT_CONTENT_INFO_FILENAME = 'Content.csv'
+DEFAULT_CONTENT_INFO_XLSX_FILENAME = 'Content.xlsx'
 CONTENT_PATH_KEY = 'Path *'
 CONTENT_TITLE_KEY = 'Title *'
 CONTENT_SOURCEID_KEY = 'Source ID'
@@ -60,6 +68,7 @@ CONTENT_INFO_HEADER = [
 ]
 
 DEFAULT_EXERCISES_INFO_FILENAME = 'Exercises.csv'
+DEFAULT_EXERCISES_INFO_XLSX_FILENAME = 'Exercises.xlsx'
 EXERCISE_SOURCEID_KEY = 'Source ID *'
 EXERCISE_M_KEY = 'Number Correct'     # (integer)
 EXERCISE_N_KEY = 'Out of Total'       # (integer)
@@ -81,6 +90,7 @@ EXERCISE_INFO_HEADER = [
 ]
 
 DEFAULT_EXERCISE_QUESTIONS_INFO_FILENAME = 'ExerciseQuestions.csv'
+DEFAULT_EXERCISE_QUESTIONS_INFO_XLSX_FILENAME = 'ExerciseQuestions.xlsx'
 EXERCISE_QUESTIONS_QUESTIONID_KEY = 'Question ID *'  # unique idendifier for this question
 EXERCISE_QUESTIONS_TYPE_KEY = 'Question type *'      # one of ['SingleSelectQuestion', 'MultipleSelectQuestion', 'InputQuestion']
 EXERCISE_QUESTIONS_QUESTION_KEY = 'Question *'       # string that contains the question setup and the prompt
@@ -123,6 +133,15 @@ EXERCISE_QUESTIONS_INFO_HEADER = [
     EXERCISE_QUESTIONS_HINT_6789_KEY
 ]
 
+# Compact representation of the rows of Content.csv and Exercises.csv kept in
+# CsvMetadataProvider.contentcache (converted to dicts by `get`)
+CONTENT_ROW_FIELDS = ('chan_path', 'title', 'source_id', 'description', 'author', 'language',
+                      'license', 'thumbnail_chan_path')
+ContentRow = namedtuple('ContentRow', CONTENT_ROW_FIELDS)
+ExerciseRow = namedtuple('ExerciseRow', CONTENT_ROW_FIELDS + ('exercise_data', 'questions'))
+
+CSV_SNAPSHOT_VERSION = 1  # increment when the format of the pickled contentcache changes
+
 
 # HELPER FUNCTIONS
 ################################################################################
@@ -158,6 +177,22 @@ class MetadataProvider(object):
         """Check if metadata provided is valid."""
         pass
 
+    def get_metadata_key(self):
+        """
+        Return a key that changes when the metadata changes, or None if unknown.
+        """
+        return None
+
+    def get_thumbnail_path_set(self):
+        """
+        Return the set of path tuples returned by `get_thumbnail_paths`, computed
+        on the first call so checking each file of the channeldir is O(1).
+        Set `self.thumbnail_path_set` to None after changing the metadata.
+        """
+        if getattr(self, 'thumbnail_path_set', None) is None:
+            self.thumbnail_path_set = set(self.get_thumbnail_paths())
+        return self.thumbnail_path_set
+
 
 class CsvMetadataProvider(MetadataProvider):
 
@@ -166,12 +201,14 @@ class CsvMetadataProvider(MetadataProvider):
                  contentinfo=DEFAULT_CONTENT_INFO_FILENAME,
                  exercisesinfo=DEFAULT_EXERCISES_INFO_FILENAME,
                  questionsinfo=DEFAULT_EXERCISE_QUESTIONS_INFO_FILENAME,
-                 winpaths=False, validate_and_cache=True):
+                 winpaths=False, validate_and_cache=True, snapshot_path=None):
         """
         Load the metadata from CSV files `channelinfo`, `contentinfo`, and optionally
         exericies data from `exercisesinfo` and `questionsinfo` files.
           - Set winpaths=True if paths in .csv use Windows-style separator
           - Set validate_and_cache=False to use the class for generating .csv templates
+          - Set snapshot_path to save the parsed metadata to a pickle file there,
+            which is loaded instead of parsing the CSV files while they don't change
         """
         if channeldir.endswith(os.path.sep):
             channeldir = channeldir.rstrip(os.path.sep)
@@ -180,9 +217,13 @@ class CsvMetadataProvider(MetadataProvider):
         self.contentinfo = contentinfo
         self.exercisesinfo = exercisesinfo
         self.questionsinfo = questionsinfo
-        self.contentcache = {}                # { ('chan', 'path','as','tuple's) --> node metadata dict
+        self.contentcache = {}                # { ('chan', 'path','as','tuple's) --> ContentRow or ExerciseRow
         self.exercise_filenames_in_dir = defaultdict(list)   # { ('chan', 'path','some','dir) --> list of exercises (virtual filenames)
         self.winpaths = winpaths  # paths separator in .csv is windows '\'
+        self.csvwriters = {}      # { metadata filename --> (open csv file, csv.DictWriter) } for files being generated
+        self.thumbnail_path_set = None  # see get_thumbnail_path_set
+        self.snapshot_path = snapshot_path
+        self.licenses = {}        # { (license_id, description, copyright_holder) --> license dict shared by rows }
         if validate_and_cache:
             self.validate_headers()
             self.cache_contentinfo()   # read and parse CSV to build cache lookup table
@@ -195,26 +236,27 @@ class CsvMetadataProvider(MetadataProvider):
     def cache_contentinfo(self):
         """
         Main workhorse that runs at the end of __init__ which sets up:
-          - self.contentcache   path_tuple --> metadata dict for any path
+          - self.contentcache   path_tuple --> metadata row for any path
           - self.exercise_filenames_in_dir  path_tuple (to a folder)--> list
             virtual exercise filenams in that folder
+        The CSV files are read row by row, and if `self.snapshot_path` is set the
+        result is loaded from (or saved to) the snapshot instead.
         """
+        self.thumbnail_path_set = None
+        if self.snapshot_path and self._load_snapshot():
+            return
         csv_filename = get_metadata_file_path(self.channeldir, self.contentinfo)
-        csv_lines = _read_csv_lines(csv_filename)
-        dict_reader = csv.DictReader(csv_lines)
-        for row in dict_reader:
-            row_dict = self._map_content_row_to_dict(row)
-            path_tuple = path_to_tuple(row_dict['chan_path'], windows=self.winpaths)
-            self.contentcache[path_tuple] = row_dict
+        for row in self._read_metadata_rows(csv_filename):
+            content_row = self._map_content_row(row)
+            path_tuple = path_to_tuple(content_row.chan_path, windows=self.winpaths)
+            self.contentcache[path_tuple] = content_row
 
         # Additional handling of data in Exercises.csv and ExerciseQuestions.txt
         if self.has_exercises():
             # A. Load exercise questions
             questions_by_source_id = defaultdict(list)
             csv_filename = get_metadata_file_path(self.channeldir, self.questionsinfo)
-            csv_lines = _read_csv_lines(csv_filename)
-            dict_reader = csv.DictReader(csv_lines)
-            for question_row in dict_reader:
+            for question_row in self._read_metadata_rows(csv_filename):
                 question_dict = self._map_exercise_question_row_to_dict(question_row)
                 question_source_id = question_dict['source_id']
                 del question_dict['source_id']
@@ -222,30 +264,90 @@ class CsvMetadataProvider(MetadataProvider):
 
             # B. Load exercises
             csv_filename = get_metadata_file_path(self.channeldir, self.exercisesinfo)
-            csv_lines = _read_csv_lines(csv_filename)
-            dict_reader = csv.DictReader(csv_lines)
-            for exercise_row in dict_reader:
-                exercise_dict = self._map_exercise_row_to_dict(exercise_row)
-                path_tuple = path_to_tuple(exercise_dict['chan_path'], windows=self.winpaths)
-                question_source_id = exercise_dict['source_id']
-                exercise_dict['questions'] = questions_by_source_id[question_source_id]
+            for exercise_row in self._read_metadata_rows(csv_filename):
+                exercise = self._map_exercise_row(exercise_row, questions_by_source_id)
+                path_tuple = path_to_tuple(exercise.chan_path, windows=self.winpaths)
                 # B1: exercises are standard content nodes, so add to contentcache
-                self.contentcache[path_tuple] = exercise_dict
+                self.contentcache[path_tuple] = exercise
                 # B2: add exercise to list of virtual filanames for current folder
                 dir_path_tuple = path_tuple[0:-1]
                 vfilename = path_tuple[-1]
                 self.exercise_filenames_in_dir[dir_path_tuple].append(vfilename)
 
-    def get(self, path_tuple):
+        if self.snapshot_path:
+            self._save_snapshot()
+
+    def get_metadata_key(self):
+        """
+        Return a json-serializable key made of the path, mtime and size of each
+        of the metadata files, which changes whenever one of them is modified.
+        """
+        key = [CSV_SNAPSHOT_VERSION, self.winpaths]
+        for filename in [self.channelinfo, self.contentinfo, self.exercisesinfo, self.questionsinfo]:
+            csv_filename = get_metadata_file_path(self.channeldir, filename)
+            if os.path.exists(csv_filename):
+                stat = os.stat(csv_filename)
+                key.append([csv_filename, stat.st_mtime_ns, stat.st_size])
+            else:
+                key.append([csv_filename, None, None])
+        return key
+
+    def _load_snapshot(self):
+        """
+        Load contentcache and exercise_filenames_in_dir from the snapshot saved at
+        `self.snapshot_path` if the CSV files haven't changed since it was saved.
+        Returns True if the snapshot was loaded.
+        """
+        if not os.path.exists(self.snapshot_path):
+            return False
+        try:
+            with open(self.snapshot_path, 'rb') as snapshot_file:
+                snapshot = pickle.load(snapshot_file)
+        except (OSError, EOFError, AttributeError, pickle.UnpicklingError):
+            LOGGER.warning('Ignoring unreadable CSV metadata snapshot ' + self.snapshot_path)
+            return False
+        if snapshot.get('key') != self.get_metadata_key():
+            return False
+        self.contentcache = snapshot['contentcache']
+        self.exercise_filenames_in_dir = defaultdict(list, snapshot['exercise_filenames_in_dir'])
+        LOGGER.info('Loaded CSV metadata from snapshot ' + self.snapshot_path)
+        return True
+
+    def _save_snapshot(self):
+        snapshot = dict(
+            key=self.get_metadata_key(),
+            contentcache=self.contentcache,
+            exercise_filenames_in_dir=dict(self.exercise_filenames_in_dir),
+        )
+        with open(self.snapshot_path, 'wb') as snapshot_file:
+            pickle.dump(snapshot, snapshot_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def _read_metadata_rows(self, path):
+        """
+        Generate a dict keyed by the header for each row of the metadata file `path`.
+        """
+        return csv.DictReader(_read_csv_lines(path))
+
+    def _read_metadata_header(self, path):
+        """
+        Return the list of column names in the header of the metadata file `path`.
+        """
+        csv_lines = _read_csv_lines(path)
+        header = csv.DictReader(csv_lines).fieldnames
+        csv_lines.close()
+        return header
+
+    def get(self, path_tuple, warn_missing=True):
         """
         Returns metadata dict for path in `path_tuple`.
         """
         if path_tuple in self.contentcache:
-            metadata = self.contentcache[path_tuple]
+            metadata = self.contentcache[path_tuple]._asdict()
         else:
             # TODO: make chef robust to missing metadata
             # LOGGER.error(
-            LOGGER.warning('No metadata found for path_tuple ' + str(path_tuple))
+            if warn_missing:
+                LOGGER.warning('No metadata found for path_tuple ' + str(path_tuple))
             metadata = dict(
                 filepath=os.path.sep.join(path_tuple),
                 title=os.path.sep.join(path_tuple)
@@ -257,9 +359,7 @@ class CsvMetadataProvider(MetadataProvider):
         Returns the first data row from Channel.csv
         """
         csv_filename = get_metadata_file_path(channeldir=self.channeldir, filename=self.channelinfo)
-        csv_lines = _read_csv_lines(csv_filename)
-        dict_reader = csv.DictReader(csv_lines)
-        channel_csvs_list =  list(dict_reader)
+        channel_csvs_list =  list(self._read_metadata_rows(csv_filename))
         channel_csv = channel_csvs_list[0]
         if len(channel_csvs_list) > 1:
             raise ValueError('Found multiple channel rows in ' + self.channelinfo)
@@ -280,7 +380,7 @@ class CsvMetadataProvider(MetadataProvider):
             thumbnail_path_tuples.append(chthumbnail_path_tuple)
         # content thumbnails
         for content_file_path_tuple, row in self.contentcache.items():
-            thumbnail_path = row.get('thumbnail_chan_path', None)
+            thumbnail_path = row.thumbnail_chan_path
             if thumbnail_path:
                 thumbnail_path_tuple = path_to_tuple(thumbnail_path, windows=self.winpaths)
                 thumbnail_path_tuples.append(thumbnail_path_tuple)
@@ -307,33 +407,44 @@ class CsvMetadataProvider(MetadataProvider):
         )
         return channel_dict
 
-    def _map_content_row_to_dict(self, row):
+    def _get_license_dict(self, row_cleaned):
         """
-        Convert dictionary keys from raw csv format (see CONTENT_INFO_HEADER),
-        to ricecooker-like keys, e.g., 'Title *' --> 'title'
+        Return the license dict for the license columns of `row_cleaned`, shared by
+        all the rows with the same license, or None if the row has no license.
         """
-        row_cleaned = _clean_dict(row)
         license_id = row_cleaned[CONTENT_LICENSE_ID_KEY]
-        if license_id:
+        if not license_id:
+            return None
+        description = row_cleaned.get(CONTENT_LICENSE_DESCRIPTION_KEY, None)
+        copyright_holder = row_cleaned.get(CONTENT_LICENSE_COPYRIGHT_HOLDER_KEY, None)
+        license_key = (license_id, description, copyright_holder)
+        license_dict = self.licenses.get(license_key)
+        if license_dict is None:
             license_dict = dict(
-                license_id=row_cleaned[CONTENT_LICENSE_ID_KEY],
-                description=row_cleaned.get(CONTENT_LICENSE_DESCRIPTION_KEY, None),
-                copyright_holder=row_cleaned.get(CONTENT_LICENSE_COPYRIGHT_HOLDER_KEY, None)
+                license_id=license_id,
+                description=description,
+                copyright_holder=copyright_holder
             )
-        else:
-            license_dict = None
-        # row_dict represents either a topic node or a content node
-        row_dict = dict(
+            self.licenses[license_key] = license_dict
+        return license_dict
+
+    def _map_content_row(self, row):
+        """
+        Convert a row in raw csv format (see CONTENT_INFO_HEADER) to a ContentRow
+        with ricecooker-like keys, e.g., 'Title *' --> 'title'
+        """
+        row_cleaned = _clean_dict(row)
+        # the row represents either a topic node or a content node
+        return ContentRow(
             chan_path=row_cleaned[CONTENT_PATH_KEY],
             title=row_cleaned[CONTENT_TITLE_KEY],
             source_id=row_cleaned.get(CONTENT_SOURCEID_KEY, None),
             description=row_cleaned.get(CONTENT_DESCRIPTION_KEY, None),
-            author=row_cleaned.get(CONTENT_AUTHOR_KEY, None),
-            language=row_cleaned.get(CONTENT_LANGUAGE_KEY, None),
-            license=license_dict,
+            author=intern_str(row_cleaned.get(CONTENT_AUTHOR_KEY, None)),
+            language=intern_str(row_cleaned.get(CONTENT_LANGUAGE_KEY, None)),
+            license=self._get_license_dict(row_cleaned),
             thumbnail_chan_path=row_cleaned.get(CONTENT_THUMBNAIL_KEY, None)
         )
-        return row_dict
 
 
 
@@ -356,20 +467,12 @@ class CsvMetadataProvider(MetadataProvider):
         return self.exercise_filenames_in_dir[dir_path_tuple]
 
 
-    def _map_exercise_row_to_dict(self, row):
+    def _map_exercise_row(self, row, questions_by_source_id):
         """
-        Convert dictionary keys from raw CSV Exercise format to ricecooker keys.
+        Convert a row in raw CSV Exercise format to an ExerciseRow with ricecooker
+        keys, taking its questions from the lists in `questions_by_source_id`.
         """
         row_cleaned = _clean_dict(row)
-        license_id = row_cleaned[CONTENT_LICENSE_ID_KEY]
-        if license_id:
-            license_dict = dict(
-                license_id=row_cleaned[CONTENT_LICENSE_ID_KEY],
-                description=row_cleaned.get(CONTENT_LICENSE_DESCRIPTION_KEY, None),
-                copyright_holder=row_cleaned.get(CONTENT_LICENSE_COPYRIGHT_HOLDER_KEY, None)
-            )
-        else:
-            license_dict = None
 
         # Parse exercise_data
         randomize_raw = row_cleaned.get(EXERCISE_RANDOMIZE_KEY, None)
@@ -390,18 +493,18 @@ class CsvMetadataProvider(MetadataProvider):
         if n_value:
             exercise_data['n'] = int(n_value)
 
-        exercise_dict = dict(
+        return ExerciseRow(
             chan_path=row_cleaned[CONTENT_PATH_KEY],
             title=row_cleaned[CONTENT_TITLE_KEY],
             source_id=row_cleaned[EXERCISE_SOURCEID_KEY],
             description=row_cleaned.get(CONTENT_DESCRIPTION_KEY, None),
-            author=row_cleaned.get(CONTENT_AUTHOR_KEY, None),
-            language=row_cleaned.get(CONTENT_LANGUAGE_KEY, None),
-            license=license_dict,
+            author=intern_str(row_cleaned.get(CONTENT_AUTHOR_KEY, None)),
+            language=intern_str(row_cleaned.get(CONTENT_LANGUAGE_KEY, None)),
+            license=self._get_license_dict(row_cleaned),
+            thumbnail_chan_path=row_cleaned.get(CONTENT_THUMBNAIL_KEY, None),
             exercise_data=exercise_data,
-            thumbnail_chan_path=row_cleaned.get(CONTENT_THUMBNAIL_KEY, None)
+            questions=questions_by_source_id[row_cleaned[EXERCISE_SOURCEID_KEY]],
         )
-        return exercise_dict
 
     def _map_exercise_question_row_to_dict(self, row):
         """
@@ -523,9 +626,7 @@ class CsvMetadataProvider(MetadataProvider):
         """
         expected = set(expected_header)
         csv_filename = get_metadata_file_path(channeldir, filename)
-        csv_lines = _read_csv_lines(csv_filename)
-        dict_reader = csv.DictReader(csv_lines)
-        actual = set(dict_reader.fieldnames)
+        actual = set(self._read_metadata_header(csv_filename))
         if not actual == expected:
             raise ValueError('Unexpected CSV file header in ' + csv_filename \
                              + ' Expected header:' + str(expected))
@@ -551,18 +652,6 @@ class CsvMetadataProvider(MetadataProvider):
         json.dump(channel_dict, open('chefdata/studiotree.json', 'w'), indent=4, ensure_ascii=False, sort_keys=True)
 
         soure_ids_seen = []
-        def _generate_source_id(subtree):
-            """
-            Creates a Source ID form title and ensures it is unique withing channel.
-            """
-            candidate = subtree['title'].replace(' ', '_')
-            if candidate not in soure_ids_seen:
-                source_id = candidate
-                soure_ids_seen.append(source_id)
-            else:
-                source_id = candidate + subtree['node_id'][0:7]
-                soure_ids_seen.append(source_id)
-            return source_id
 
         def _write_subtree(path_tuple, subtree, is_root=False):
             print('    '*len(path_tuple) + '  - ', subtree['title'])
@@ -582,7 +671,7 @@ class CsvMetadataProvider(MetadataProvider):
 
             # EXERCISE #########################################################
             elif kind == 'exercise':
-                source_id = _generate_source_id(subtree)
+                source_id = self._generate_source_id_from_studio_dict(subtree, soure_ids_seen)
                 self.write_exercice_row_from_studio_dict(path_tuple, subtree, source_id)
                 for question_dict in subtree['assessment_items']:
                     self.write_question_row_from_question_dict(source_id, question_dict)
@@ -591,7 +680,23 @@ class CsvMetadataProvider(MetadataProvider):
                 print('skipping node', subtree['title'])
 
         path_tuple = [ self.channeldir.split('/')[-1] ]
-        _write_subtree(path_tuple, channel_dict, is_root=True)
+        try:
+            _write_subtree(path_tuple, channel_dict, is_root=True)
+        finally:
+            self.close_csv_writers()
+
+    def _generate_source_id_from_studio_dict(self, subtree, soure_ids_seen):
+        """
+        Creates a Source ID form title and ensures it is unique withing channel.
+        """
+        candidate = subtree['title'].replace(' ', '_')
+        if candidate not in soure_ids_seen:
+            source_id = candidate
+            soure_ids_seen.append(source_id)
+        else:
+            source_id = candidate + subtree['node_id'][0:7]
+            soure_ids_seen.append(source_id)
+        return source_id
 
     def write_commont_studio_dict_from_row(self, studio_dict, row):
         if studio_dict['license']:
@@ -612,40 +717,36 @@ class CsvMetadataProvider(MetadataProvider):
         if is_root:
             return
         # print('Generating Content.csv rows folders and file in channeldir for path_tuple ', path_tuple, studio_dict['title'])
-        file_path = get_metadata_file_path(self.channeldir, self.contentinfo)
-        with open(file_path, 'a') as csv_file:
-            csvwriter = csv.DictWriter(csv_file, CONTENT_INFO_HEADER)
-            title = studio_dict['title']
-            path_with_self = '/'.join(path_tuple+[title])
-            if not os.path.exists(path_with_self):
-                os.makedirs(path_with_self, exist_ok=True)
-            topic_row = {}
-            self.write_commont_studio_dict_from_row(studio_dict, topic_row)
-            # WRITE TOPIC ROW
-            topic_row[CONTENT_PATH_KEY] = path_with_self
-            topic_row[CONTENT_SOURCEID_KEY] = studio_dict['node_id'][0:7]
-            csvwriter.writerow(topic_row)
+        csvwriter = self.get_csv_writer(self.contentinfo, CONTENT_INFO_HEADER)
+        title = studio_dict['title']
+        path_with_self = '/'.join(path_tuple+[title])
+        if not os.path.exists(path_with_self):
+            os.makedirs(path_with_self, exist_ok=True)
+        topic_row = {}
+        self.write_commont_studio_dict_from_row(studio_dict, topic_row)
+        # WRITE TOPIC ROW
+        topic_row[CONTENT_PATH_KEY] = path_with_self
+        topic_row[CONTENT_SOURCEID_KEY] = studio_dict['node_id'][0:7]
+        csvwriter.writerow(topic_row)
 
 
     def write_exercice_row_from_studio_dict(self, path_tuple, studio_dict, source_id):
-        file_path = get_metadata_file_path(self.channeldir, self.exercisesinfo)
-        with open(file_path, 'a') as csv_file:
-            csvwriter = csv.DictWriter(csv_file, EXERCISE_INFO_HEADER)
-            exercise_row = {}
-            self.write_commont_studio_dict_from_row(studio_dict, exercise_row)
-            exercise_title = studio_dict['title']
-            exercise_row[CONTENT_PATH_KEY] = '/'.join(path_tuple+[exercise_title])
-            exercise_row[EXERCISE_SOURCEID_KEY] = source_id
-            # Exercises specifics
-            if isinstance(studio_dict['extra_fields'], str):
-                extra_fields = json.loads(studio_dict['extra_fields'])
-            else:
-                extra_fields = studio_dict['extra_fields']
-            exercise_row[EXERCISE_M_KEY] = int(extra_fields['m'])
-            exercise_row[EXERCISE_N_KEY] = int(extra_fields['n'])
-            exercise_row[EXERCISE_RANDOMIZE_KEY] = extra_fields['randomize']
-            # WRITE EXERCISE ROW
-            csvwriter.writerow(exercise_row)
+        csvwriter = self.get_csv_writer(self.exercisesinfo, EXERCISE_INFO_HEADER)
+        exercise_row = {}
+        self.write_commont_studio_dict_from_row(studio_dict, exercise_row)
+        exercise_title = studio_dict['title']
+        exercise_row[CONTENT_PATH_KEY] = '/'.join(path_tuple+[exercise_title])
+        exercise_row[EXERCISE_SOURCEID_KEY] = source_id
+        # Exercises specifics
+        if isinstance(studio_dict['extra_fields'], str):
+            extra_fields = json.loads(studio_dict['extra_fields'])
+        else:
+            extra_fields = studio_dict['extra_fields']
+        exercise_row[EXERCISE_M_KEY] = int(extra_fields['m'])
+        exercise_row[EXERCISE_N_KEY] = int(extra_fields['n'])
+        exercise_row[EXERCISE_RANDOMIZE_KEY] = extra_fields['randomize']
+        # WRITE EXERCISE ROW
+        csvwriter.writerow(exercise_row)
 
 
 
@@ -705,73 +806,71 @@ class CsvMetadataProvider(MetadataProvider):
 
 
     def write_question_row_from_question_dict(self, source_id, question_dict):
-        file_path = get_metadata_file_path(self.channeldir, self.questionsinfo)
         if question_dict['type'] == 'perseus_question':
             print('Skipping perseus_question -- not supported in CSV workflow.')
             return
-        with open(file_path, 'a') as csv_file:
-            csvwriter = csv.DictWriter(csv_file, EXERCISE_QUESTIONS_INFO_HEADER)
-
-            def _safe_list_get(l, idx, default):
-                try:
-                    return l[idx]
-                except IndexError:
-                    return default
-
-            # change image links to local
-            question_dict = self._make_local_question_images(question_dict)
-
-            type_lookup = {
-                'single_selection': exercises.SINGLE_SELECTION,
-                'true_false': exercises.SINGLE_SELECTION,
-                'multiple_selection': exercises.MULTIPLE_SELECTION,
-                'input_question': exercises.INPUT_QUESTION,
-            }
-
-            # ANSWERS
-            answers = json.loads(question_dict['answers'])
-            options = []  # all options
-            correct = []  # correct andwers
-            for ans in answers:
-                options.append(ans['answer'])
-                if ans['correct']:
-                    correct.append(ans['answer'])
-            extra_options = DEFAULT_EXTRA_ITEMS_SEPARATOR.join(options[5:])
-
-            # HINTS
-            hints_raw = json.loads(question_dict['hints'])
-            if hints_raw:
-                raise ValueError('Found hints but not handled..')
-
-            LOGGER.info('     - writing question with studio_id=' + question_dict['assessment_id'])
-            question_row = {}
-            question_row[EXERCISE_SOURCEID_KEY] = source_id
-            question_row[EXERCISE_QUESTIONS_QUESTIONID_KEY] = question_dict['assessment_id'] # question_dict['assessment_id']
-            question_row[EXERCISE_QUESTIONS_TYPE_KEY] = type_lookup[question_dict['type']]
-            question_row[EXERCISE_QUESTIONS_QUESTION_KEY] = question_dict['question']
-            question_row[EXERCISE_QUESTIONS_OPTION_A_KEY] = _safe_list_get(options, 0, None)
-            question_row[EXERCISE_QUESTIONS_OPTION_B_KEY] = _safe_list_get(options, 1, None)
-            question_row[EXERCISE_QUESTIONS_OPTION_C_KEY] = _safe_list_get(options, 2, None)
-            question_row[EXERCISE_QUESTIONS_OPTION_D_KEY] = _safe_list_get(options, 3, None)
-            question_row[EXERCISE_QUESTIONS_OPTION_E_KEY] = _safe_list_get(options, 4, None)
-            question_row[EXERCISE_QUESTIONS_OPTION_FGHI_KEY] = extra_options
-            question_row[EXERCISE_QUESTIONS_CORRECT_ANSWER_KEY] = _safe_list_get(correct, 0, None)
-            question_row[EXERCISE_QUESTIONS_CORRECT_ANSWER2_KEY] = _safe_list_get(correct, 1, None)
-            question_row[EXERCISE_QUESTIONS_CORRECT_ANSWER3_KEY] = _safe_list_get(correct, 2, None)
-            question_row[EXERCISE_QUESTIONS_HINT_1_KEY] = None # TODO
-            question_row[EXERCISE_QUESTIONS_HINT_2_KEY] = None # TODO
-            question_row[EXERCISE_QUESTIONS_HINT_3_KEY] = None # TODO
-            question_row[EXERCISE_QUESTIONS_HINT_4_KEY] = None # TODO
-            question_row[EXERCISE_QUESTIONS_HINT_5_KEY] = None # TODO
-            question_row[EXERCISE_QUESTIONS_HINT_6789_KEY] = None # TODO
-            # WRITE QUESTION ROW
-            csvwriter.writerow(question_row)
-            #            'files': [],
-            #            'raw_data': '',
-            #            'order': 2,
-            #            'source_url': None,
-            #            'randomize': True,
-            #            'deleted': False},
+        csvwriter = self.get_csv_writer(self.questionsinfo, EXERCISE_QUESTIONS_INFO_HEADER)
+
+        def _safe_list_get(l, idx, default):
+            try:
+                return l[idx]
+            except IndexError:
+                return default
+
+        # change image links to local
+        question_dict = self._make_local_question_images(question_dict)
+
+        type_lookup = {
+            'single_selection': exercises.SINGLE_SELECTION,
+            'true_false': exercises.SINGLE_SELECTION,
+            'multiple_selection': exercises.MULTIPLE_SELECTION,
+            'input_question': exercises.INPUT_QUESTION,
+        }
+
+        # ANSWERS
+        answers = json.loads(question_dict['answers'])
+        options = []  # all options
+        correct = []  # correct andwers
+        for ans in answers:
+            options.append(ans['answer'])
+            if ans['correct']:
+                correct.append(ans['answer'])
+        extra_options = DEFAULT_EXTRA_ITEMS_SEPARATOR.join(options[5:])
+
+        # HINTS
+        hints_raw = json.loads(question_dict['hints'])
+        if hints_raw:
+            raise ValueError('Found hints but not handled..')
+
+        LOGGER.info('     - writing question with studio_id=' + question_dict['assessment_id'])
+        question_row = {}
+        question_row[EXERCISE_SOURCEID_KEY] = source_id
+        question_row[EXERCISE_QUESTIONS_QUESTIONID_KEY] = question_dict['assessment_id'] # question_dict['assessment_id']
+        question_row[EXERCISE_QUESTIONS_TYPE_KEY] = type_lookup[question_dict['type']]
+        question_row[EXERCISE_QUESTIONS_QUESTION_KEY] = question_dict['question']
+        question_row[EXERCISE_QUESTIONS_OPTION_A_KEY] = _safe_list_get(options, 0, None)
+        question_row[EXERCISE_QUESTIONS_OPTION_B_KEY] = _safe_list_get(options, 1, None)
+        question_row[EXERCISE_QUESTIONS_OPTION_C_KEY] = _safe_list_get(options, 2, None)
+        question_row[EXERCISE_QUESTIONS_OPTION_D_KEY] = _safe_list_get(options, 3, None)
+        question_row[EXERCISE_QUESTIONS_OPTION_E_KEY] = _safe_list_get(options, 4, None)
+        question_row[EXERCISE_QUESTIONS_OPTION_FGHI_KEY] = extra_options
+        question_row[EXERCISE_QUESTIONS_CORRECT_ANSWER_KEY] = _safe_list_get(correct, 0, None)
+        question_row[EXERCISE_QUESTIONS_CORRECT_ANSWER2_KEY] = _safe_list_get(correct, 1, None)
+        question_row[EXERCISE_QUESTIONS_CORRECT_ANSWER3_KEY] = _safe_list_get(correct, 2, None)
+        question_row[EXERCISE_QUESTIONS_HINT_1_KEY] = None # TODO
+        question_row[EXERCISE_QUESTIONS_HINT_2_KEY] = None # TODO
+        question_row[EXERCISE_QUESTIONS_HINT_3_KEY] = None # TODO
+        question_row[EXERCISE_QUESTIONS_HINT_4_KEY] = None # TODO
+        question_row[EXERCISE_QUESTIONS_HINT_5_KEY] = None # TODO
+        question_row[EXERCISE_QUESTIONS_HINT_6789_KEY] = None # TODO
+        # WRITE QUESTION ROW
+        csvwriter.writerow(question_row)
+        #            'files': [],
+        #            'raw_data': '',
+        #            'order': 2,
+        #            'source_url': None,
+        #            'randomize': True,
+        #            'deleted': False},
 
 
 
@@ -779,32 +878,44 @@ class CsvMetadataProvider(MetadataProvider):
     # Generate CSV from folder structure in channeldir
     ############################################################################
 
-    def generate_contentinfo_from_channeldir(self, args, options):
+    def generate_contentinfo_from_channeldir(self, args, options, probe_cache_path=None):
         """
         Create rows in Content.csv for each folder and file in `self.channeldir`.
+        If args['probe'] is set, the title, author, description and language of
+        the files are taken from the metadata embedded in them when available
+        (see `probe_files`, which caches its results in `probe_cache_path`).
         """
         LOGGER.info('Generating Content.csv rows folders and file in channeldir')
-        file_path = get_metadata_file_path(self.channeldir, self.contentinfo)
-        with open(file_path, 'a') as csv_file:
-            csvwriter = csv.DictWriter(csv_file, CONTENT_INFO_HEADER)
+        csvwriter = self.get_csv_writer(self.contentinfo, CONTENT_INFO_HEADER)
 
-            channeldir = args['channeldir']
-            if channeldir.endswith(os.path.sep):
-                channeldir.rstrip(os.path.sep)
-
-            # MAIN PROCESSING OF os.walk OUTPUT
-            content_folders = sorted(os.walk(channeldir))
-            _ = content_folders.pop(0)           # Skip over channel root folder
+        channeldir = args['channeldir']
+        if channeldir.endswith(os.path.sep):
+            channeldir.rstrip(os.path.sep)
+
+        # MAIN PROCESSING OF os.walk OUTPUT (in sorted order)
+        content_folders = walk_sorted(channeldir)
+        _ = next(content_folders, None)      # Skip over channel root folder
+        probes = None
+        if args.get('probe'):
+            # list all the folders first to probe all the files in one process pool
+            content_folders = list(content_folders)
+            paths = [os.path.join(rel_path, filename)
+                     for rel_path, _subfolders, filenames in content_folders for filename in filenames]
+            probes = probe_files(paths, cache_path=probe_cache_path)
+        try:
             for rel_path, _subfolders, filenames in content_folders:
                 LOGGER.info('processing folder ' + str(rel_path))
                 sorted_filenames = sorted(filenames)
-                self.generate_contentinfo_from_folder(csvwriter, rel_path, sorted_filenames)
+                self.generate_contentinfo_from_folder(csvwriter, rel_path, sorted_filenames, probes=probes)
+        finally:
+            self.close_csv_writers()
         LOGGER.info('Generted {} row for all folders and files in {}'.format(self.contentinfo, self.channeldir))
 
-    def generate_contentinfo_from_folder(self, csvwriter, rel_path, filenames):
+    def generate_contentinfo_from_folder(self, csvwriter, rel_path, filenames, probes=None):
         """
         Create a topic node row in Content.csv for the folder at `rel_path` and
-        add content node rows for all the files in the `rel_path` folder.
+        add content node rows for all the files in the `rel_path` folder, using
+        the embedded metadata in `probes` (file path --> metadata dict) if given.
         """
         LOGGER.debug('IN process_folder ' + str(rel_path) + '     ' + str(filenames))
         from ricecooker.utils.linecook import filter_filenames, filter_thumbnail_files, chan_path_from_rel_path
@@ -821,6 +932,8 @@ class CsvMetadataProvider(MetadataProvider):
             path_tuple = rel_path.split(os.path.sep)
             path_tuple.append(filename)
             filerow = self.channeldir_node_to_row(path_tuple)
+            if probes:
+                self.apply_probe_to_row(filerow, probes.get(os.path.join(rel_path, filename), {}))
             csvwriter.writerow(filerow)
 
 
@@ -840,6 +953,16 @@ class CsvMetadataProvider(MetadataProvider):
         row[CONTENT_SOURCEID_KEY] = path_tuple[-1]
         return row
 
+    def apply_probe_to_row(self, row, probe):
+        """
+        Fill the Content.csv columns of `row` with the metadata in `probe`
+        extracted from the file by `probe_file`.
+        """
+        for field, key in [('title', CONTENT_TITLE_KEY), ('author', CONTENT_AUTHOR_KEY),
+                           ('description', CONTENT_DESCRIPTION_KEY), ('language', CONTENT_LANGUAGE_KEY)]:
+            if probe.get(field):
+                row[key] = probe[field]
+
 
 
 
@@ -872,20 +995,39 @@ class CsvMetadataProvider(MetadataProvider):
         """
         file_path = get_metadata_file_path(channeldir, filename)
         if not os.path.exists(file_path):
-            with open(file_path, 'w') as csv_file:
+            with open_csv(file_path, 'w') as csv_file:
                 csvwriter = csv.DictWriter(csv_file, header)
                 csvwriter.writeheader()
 
+    def get_csv_writer(self, filename, header):
+        """
+        Return a `csv.DictWriter` with fields `header` that appends rows to the
+        metadata file `filename`. The file stays open (and buffered) so rows can
+        be written one at a time, until `close_csv_writers` is called.
+        """
+        if filename not in self.csvwriters:
+            csv_file = open_csv(get_metadata_file_path(self.channeldir, filename), 'a')
+            self.csvwriters[filename] = (csv_file, csv.DictWriter(csv_file, header))
+        return self.csvwriters[filename][1]
+
+    def close_csv_writers(self):
+        """
+        Flush and close the metadata files opened by `get_csv_writer`.
+        """
+        for csv_file, _ in self.csvwriters.values():
+            csv_file.close()
+        self.csvwriters = {}
+
 
 def _read_csv_lines(path):
     """
-    Opens CSV file `path` and returns list of rows.
+    Generate the non-blank lines of CSV file `path`, reading the file lazily.
     Pass output of this function to `csv.DictReader` for reading data.
     """
-    csv_file = open(path, 'r')
-    csv_lines_raw = csv_file.readlines()
-    csv_lines_clean = [line for line in csv_lines_raw if len(line.strip()) > 0]
-    return csv_lines_clean
+    with open_csv(path) as csv_file:
+        for line in csv_file:
+            if len(line.strip()) > 0:
+                yield line
 
 
 def _clean_dict(row):
@@ -903,12 +1045,55 @@ def _clean_dict(row):
 
 
 
-class ExcelMetadataProvider(MetadataProvider):
-    # LIBRARIES COULD USE
-    # https://github.com/jmcnamara/XlsxWriter/blob/95334f999d3a5fb58d8da3197260e920be357638/dev/docs/source/alternatives.rst
+class ExcelMetadataProvider(CsvMetadataProvider):
+    """
+    Load the same metadata as CsvMetadataProvider from .xlsx workbooks that have
+    the CSV headers and rows in their first sheet, e.g., Channel.xlsx, Content.xlsx.
+    The worksheets are read row by row, so large workbooks are never entirely
+    loaded in memory. Metadata files that don't end in .xlsx are read as CSV, and
+    templates and generated metadata are still written as CSV.
+    """
 
-    def validate(self):
-        """
-        Checks if provided .xlsx/.xls is valid as a whole.
-        """
-        pass
+    def __init__(self, channeldir,
+                 channelinfo=DEFAULT_CHANNEL_INFO_XLSX_FILENAME,
+                 contentinfo=DEFAULT_CONTENT_INFO_XLSX_FILENAME,
+                 exercisesinfo=DEFAULT_EXERCISES_INFO_XLSX_FILENAME,
+                 questionsinfo=DEFAULT_EXERCISE_QUESTIONS_INFO_XLSX_FILENAME,
+                 **kwargs):
+        super().__init__(channeldir, channelinfo=channelinfo, contentinfo=contentinfo,
+                         exercisesinfo=exercisesinfo, questionsinfo=questionsinfo, **kwargs)
+
+    def _read_metadata_rows(self, path):
+        if not path.endswith('.xlsx'):
+            return super()._read_metadata_rows(path)
+        return self._read_xlsx_rows(path)
+
+    def _read_xlsx_rows(self, path):
+        rows = iter_xlsx_rows(path)
+        header = _get_xlsx_header(rows)
+        for row in rows:
+            if not any(row):
+                continue  # skip blank rows like _read_csv_lines does
+            if len(row) < len(header):
+                row.extend([None] * (len(header) - len(row)))
+            yield dict(zip(header, row))
+
+    def _read_metadata_header(self, path):
+        if not path.endswith('.xlsx'):
+            return super()._read_metadata_header(path)
+        rows = iter_xlsx_rows(path)
+        header = _get_xlsx_header(rows)
+        rows.close()
+        return header
+
+
+def _get_xlsx_header(rows):
+    """
+    Return the first non-blank row of `rows` without its trailing empty cells.
+    """
+    for row in rows:
+        if any(row):
+            while row and not row[-1]:
+                row.pop()
+            return row
+    return []
@@ -1,7 +1,11 @@
+from concurrent.futures import ThreadPoolExecutor
+import heapq
 import ntpath
 import os
 from pathlib import Path
 
+from ricecooker import config
+
 
 def dir_exists(filepath):
     file_ = Path(filepath)
@@ -55,3 +59,78 @@ def build_path(levels):
     if not dir_exists(path):
         os.makedirs(path)
     return path
+
+
+def _get_entry_type(entry):
+    """
+    Return `(is_dir, is_symlink)` for the `os.scandir` entry `entry`, treating
+    entries that cannot be stat'ed as files like `os.walk` does.
+    """
+    try:
+        is_dir = entry.is_dir()
+    except OSError:
+        return False, False
+    try:
+        is_symlink = entry.is_symlink()
+    except OSError:
+        is_symlink = False
+    return is_dir, is_symlink
+
+
+def _scan_dir(path):
+    """
+    List the folder at `path` like a single step of `os.walk` does, returning
+    `(dirnames, filenames, subdir_paths)` where `subdir_paths` are the paths of
+    the subfolders to walk into (symlinks to folders are not followed), or
+    `None` if the folder cannot be listed.
+    """
+    dirnames, filenames, subdir_paths = [], [], []
+    try:
+        entries = os.scandir(path)
+    except OSError:
+        return None
+    try:
+        for entry in entries:
+            is_dir, is_symlink = _get_entry_type(entry)
+            if not is_dir:
+                filenames.append(entry.name)
+                continue
+            dirnames.append(entry.name)
+            if not is_symlink:
+                subdir_paths.append(entry.path)
+    except OSError:
+        return None
+    finally:
+        # the scandir iterator is a context manager with a close method from Python 3.6
+        if hasattr(entries, 'close'):
+            entries.close()
+    return dirnames, filenames, subdir_paths
+
+
+def walk_sorted(top, max_workers=None):
+    """
+    Generate the `(dirpath, dirnames, filenames)` tuples of `os.walk(top)` in the
+    order of `sorted(os.walk(top))`, without walking the whole tree first.
+    Folders are listed with `os.scandir` by a pool of `max_workers` threads
+    (default config.WALK_WORKERS): the subfolders of each folder are listed in
+    the background while the caller processes the folders that sort before them,
+    which hides the latency of each listing on network filesystems.
+    Like `os.walk`, folders that cannot be listed are skipped.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers or config.WALK_WORKERS) as executor:
+        # Every folder sorts before its subfolders, so the smallest dirpath among
+        # the folders submitted but not yet yielded is always the next one
+        pending = [(top, executor.submit(_scan_dir, top))]
+        try:
+            while pending:
+                dirpath, future = heapq.heappop(pending)
+                result = future.result()
+                if result is None:
+                    continue
+                dirnames, filenames, subdir_paths = result
+                for subdir_path in subdir_paths:
+                    heapq.heappush(pending, (subdir_path, executor.submit(_scan_dir, subdir_path)))
+                yield dirpath, dirnames, filenames
+        finally:
+            for _, future in pending:
+                future.cancel()
@@ -0,0 +1,85 @@
+"""
+Iterative tree traversals.
+
+The generators in this module walk a tree without recursion, so they work on
+trees of any depth (no RecursionError for deep folder hierarchies) and avoid
+one Python function call per node. They work both on ricecooker node objects
+(the default, using their `children` attribute) and on json/dict trees by
+passing a `get_children` function:
+
+    for node in iter_preorder(json_tree, get_children=get_dict_children):
+        ...
+"""
+from collections import deque
+from itertools import repeat
+
+
+def _get_node_children(node):
+    return node.children
+
+
+def get_dict_children(node):
+    """ Children of a node in a json/dict tree (e.g. a ricecooker json tree or a Studio tree). """
+    return node.get('children') or []
+
+
+def iter_preorder(root, get_children=None):
+    """
+    Yield the nodes of the tree rooted at `root` in depth-first pre-order
+    (each node before its children, children in order), the same order as a
+    recursive walk. `get_children` can return an empty list to skip a subtree.
+    """
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        yield node
+        children = node.children if get_children is None else get_children(node)
+        if children:
+            stack.extend(reversed(children))
+
+
+def iter_preorder_with_depth(root, get_children=None):
+    """
+    Yield `(depth, node)` tuples in depth-first pre-order, where `depth` is 0 for
+    `root`. Callers that need a node's ancestors can keep a list of the current
+    path and truncate it to `depth` at each step.
+    """
+    stack = [(0, root)]
+    while stack:
+        depth, node = stack.pop()
+        yield depth, node
+        children = node.children if get_children is None else get_children(node)
+        if children:
+            stack.extend(zip(repeat(depth + 1), reversed(children)))
+
+
+def iter_postorder(root, get_children=None):
+    """
+    Yield the nodes of the tree rooted at `root` in depth-first post-order
+    (all the children of a node, in order, before the node itself).
+    """
+    if get_children is None:
+        get_children = _get_node_children
+    stack = [(root, iter(get_children(root) or ()))]
+    while stack:
+        node, children = stack[-1]
+        child = next(children, None)
+        if child is None:
+            stack.pop()
+            yield node
+        else:
+            stack.append((child, iter(get_children(child) or ())))
+
+
+def iter_levelorder(root, get_children=None):
+    """
+    Yield the nodes of the tree rooted at `root` in breadth-first order
+    (level by level, left to right).
+    """
+    queue = deque([root])
+    while queue:
+        node = queue.popleft()
+        yield node
+        children = node.children if get_children is None else get_children(node)
+        if children:
+            queue.extend(children)
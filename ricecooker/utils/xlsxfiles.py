@@ -0,0 +1,153 @@
+import posixpath
+import xml.etree.ElementTree as ET
+import zipfile
+
+
+RELATIONSHIPS_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+
+
+def _local_name(tag):
+    # ignore namespaces so both transitional and strict OOXML workbooks are read
+    return tag.rsplit('}', 1)[-1]
+
+
+def _namespace(tag):
+    return tag[:tag.index('}') + 1] if tag.startswith('{') else ''
+
+
+def _column_index(column_letters):
+    """
+    Return the 0-based index of the column named `column_letters`, e.g. 'C' -> 2.
+    """
+    index = 0
+    for letter in column_letters:
+        index = index * 26 + ord(letter) - ord('A') + 1
+    return index - 1
+
+
+def _get_part_paths(xlsx_zip):
+    """
+    Return the paths in the xlsx zip file of the first worksheet of the workbook
+    and of its shared strings table (None if the workbook doesn't have one).
+    """
+    relationships = {}
+    shared_strings_path = None
+    rels_root = ET.fromstring(xlsx_zip.read('xl/_rels/workbook.xml.rels'))
+    for relationship in rels_root:
+        target = relationship.get('Target')
+        if target.startswith('/'):
+            target = target[1:]
+        else:
+            target = posixpath.normpath(posixpath.join('xl', target))
+        relationships[relationship.get('Id')] = target
+        if relationship.get('Type', '').endswith('/sharedStrings'):
+            shared_strings_path = target
+    workbook_root = ET.fromstring(xlsx_zip.read('xl/workbook.xml'))
+    for element in workbook_root.iter():
+        if _local_name(element.tag) == 'sheet':
+            relationship_id = element.get('{%s}id' % RELATIONSHIPS_NS)
+            if relationship_id is None:  # strict OOXML namespace
+                relationship_id = [v for k, v in element.attrib.items() if _local_name(k) == 'id'][0]
+            return relationships[relationship_id], shared_strings_path
+    raise ValueError('No worksheets found in workbook')
+
+
+def _read_shared_strings(xlsx_zip, path):
+    shared_strings = []
+    with xlsx_zip.open(path) as xml_file:
+        table = None
+        for event, element in ET.iterparse(xml_file, events=('start', 'end')):
+            if event == 'start':
+                if table is None:
+                    table = element  # the <sst> root element
+                    ns = _namespace(element.tag)
+                    si_tag, t_tag, r_tag = ns + 'si', ns + 't', ns + 'r'
+                continue
+            if element.tag != si_tag:
+                continue
+            # plain text is in <si><t>, rich text in <si><r><t> (skip phonetic <rPh> runs)
+            parts = []
+            for child in element:
+                if child.tag == t_tag:
+                    parts.append(child.text or '')
+                elif child.tag == r_tag:
+                    parts.extend(t.text or '' for t in child if t.tag == t_tag)
+            shared_strings.append(''.join(parts))
+            table.clear()
+    return shared_strings
+
+
+def _get_cell_value(cell, shared_strings, ns):
+    cell_type = cell.get('t', 'n')
+    value = None
+    for child in cell:
+        if child.tag == ns + 'v':
+            value = child.text
+        elif child.tag == ns + 'is':  # inline string
+            value = ''.join(t.text or '' for t in child.iter(ns + 't'))
+    if value is None:
+        return None
+    if cell_type == 's':
+        return shared_strings[int(value)]
+    if cell_type == 'b':
+        return 'TRUE' if value == '1' else 'FALSE'
+    return value
+
+
+def _read_row(row_element, cell_tag, shared_strings, ns, column_indexes):
+    """
+    Return the list of cell values of the `row` element `row_element`, with None
+    for the cells missing before a cell. `column_indexes` is a dict column letters
+    --> column index shared by the rows of the sheet.
+    """
+    row = []
+    for cell in row_element:
+        if cell.tag != cell_tag:
+            continue
+        cell_ref = cell.get('r')
+        if cell_ref:
+            column_letters = cell_ref.rstrip('0123456789')
+            column = column_indexes.get(column_letters)
+            if column is None:
+                column = column_indexes[column_letters] = _column_index(column_letters)
+            row.extend([None] * (column - len(row)))
+        row.append(_get_cell_value(cell, shared_strings, ns))
+    return row
+
+
+def iter_xlsx_rows(path):
+    """
+    Generate the rows of the first worksheet of the .xlsx workbook at `path` as
+    lists of cell values, which are strings (numbers and booleans as written
+    in the sheet, dates as serial numbers) or None for empty cells.
+    The worksheet is parsed incrementally, so only the current row and the
+    shared strings table of the workbook are kept in memory.
+    """
+    with zipfile.ZipFile(path) as xlsx_zip:
+        sheet_path, shared_strings_path = _get_part_paths(xlsx_zip)
+        shared_strings = []
+        if shared_strings_path and shared_strings_path in xlsx_zip.namelist():
+            shared_strings = _read_shared_strings(xlsx_zip, shared_strings_path)
+        with xlsx_zip.open(sheet_path) as xml_file:
+            sheet_data = None
+            row_tag = cell_tag = None
+            column_indexes = {}  # column letters --> column index
+            row_number = 0
+            for event, element in ET.iterparse(xml_file, events=('start', 'end')):
+                if event == 'start':
+                    if sheet_data is None and _local_name(element.tag) == 'sheetData':
+                        sheet_data = element
+                        ns = _namespace(element.tag)
+                        row_tag, cell_tag = ns + 'row', ns + 'c'
+                    continue
+                if element.tag != row_tag:
+                    continue
+                # yield empty rows for the row numbers skipped in the sheet
+                current_row_number = int(element.get('r', row_number + 1))
+                while row_number < current_row_number - 1:
+                    row_number += 1
+                    yield []
+                row_number = current_row_number
+                yield _read_row(element, cell_tag, shared_strings, ns, column_indexes)
+                # drop the rows already read from the tree being built by iterparse
+                sheet_data.clear()
@@ -0,0 +1,142 @@
+"""
+Benchmark resolving corrections against a large Studio channel tree.
+
+Run from the repo root with:
+
+    python tests/benchmarks/bench_corrections.py [--nodes N] [--per-topic K] [--corrections C] [--latency S]
+
+Builds a Studio-like tree (as exported by `get_channel_tree`) with N content
+nodes in topics of K nodes, then compares the time to look up C nodes with the
+recursive search corrections.py used to do to `find_nodes_by_node_id` with
+the index returned by `get_tree_index` (including the time to build it), and
+the time of `remap_original_source_node_id_to_node_id` for C corrections.
+Then applies C title modifications with `apply_corrections_by_node_id` against
+a fake Studio API where each request takes S seconds: one at a time with a GET
+before and after each PUT (as corrections used to be applied), and with
+--workers and --noverify.
+"""
+import argparse
+import contextlib
+import io
+import random
+import time
+
+from ricecooker.utils.corrections import apply_corrections_by_node_id, apply_modifications_for_node_id
+from ricecooker.utils.corrections import find_nodes_by_node_id, get_tree_index
+from ricecooker.utils.corrections import remap_original_source_node_id_to_node_id
+
+
+def make_studio_node(i, kind):
+    return dict(
+        id='studio-{}'.format(i),
+        node_id='node-{}'.format(i),
+        content_id='content-{}'.format(i),
+        original_source_node_id='source-{}'.format(i),
+        title='Node {}'.format(i),
+        kind=kind,
+        tags=[],
+        prerequisite=[],
+        parent=None,
+        files=[],
+        children=[],
+    )
+
+
+def make_channel_tree(num_nodes, per_topic):
+    channel_tree = make_studio_node('root', 'topic')
+    topic = None
+    for i in range(num_nodes):
+        if i % per_topic == 0:
+            topic = make_studio_node('topic-{}'.format(i // per_topic), 'topic')
+            channel_tree['children'].append(topic)
+        topic['children'].append(make_studio_node(i, 'document'))
+    return channel_tree
+
+
+def recursive_find_nodes_by_attr(subtree, attr, value):
+    results = []
+    if subtree[attr] == value:
+        results.append(subtree)
+    if 'children' in subtree:
+        for child in subtree['children']:
+            results.extend(recursive_find_nodes_by_attr(child, attr, value))
+    return results
+
+
+def get_node_data(studio_id):
+    return make_studio_node(studio_id[len('studio-'):], 'document')
+
+
+class SlowStudioApi(object):
+    def __init__(self, latency):
+        self.latency = latency
+
+    def get_channel(self, channel_id):
+        time.sleep(self.latency)
+        return {'trash_tree': {'id': 'trash'}}
+
+    def get_contentnode(self, studio_id):
+        time.sleep(self.latency)
+        return get_node_data(studio_id)
+
+    def get_nodes_by_ids_bulk(self, studio_ids, recursive=True):
+        time.sleep(self.latency)
+        return [get_node_data(studio_id) for studio_id in studio_ids]
+
+    def put_contentnode(self, data):
+        time.sleep(self.latency)
+        return [data]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nodes', type=int, default=100000, help='number of content nodes')
+    parser.add_argument('--per-topic', type=int, default=100, help='content nodes per topic')
+    parser.add_argument('--corrections', type=int, default=200, help='number of nodes to look up')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds taken by each fake Studio request')
+    parser.add_argument('--workers', type=int, default=8, help='concurrent Studio requests')
+    args = parser.parse_args()
+
+    channel_tree = make_channel_tree(args.nodes, args.per_topic)
+    ids = random.Random(0).sample(range(args.nodes), args.corrections)
+    print('Looking up {} nodes in a tree of {} nodes'.format(args.corrections, args.nodes))
+
+    start = time.perf_counter()
+    for i in ids:
+        assert len(recursive_find_nodes_by_attr(channel_tree, 'node_id', 'node-{}'.format(i))) == 1
+    print('  {:<28} {:7.2f}s'.format('recursive search', time.perf_counter() - start))
+
+    start = time.perf_counter()
+    index = get_tree_index(channel_tree)
+    for i in ids:
+        assert len(find_nodes_by_node_id(channel_tree, 'node-{}'.format(i), index=index)) == 1
+    print('  {:<28} {:7.2f}s'.format('find_nodes_by_node_id', time.perf_counter() - start))
+
+    corrections = {'nodes_modified': {'source-{}'.format(i): {'attributes': {}} for i in ids}}
+    start = time.perf_counter()
+    remap_original_source_node_id_to_node_id(channel_tree, corrections)
+    print('  {:<28} {:7.2f}s'.format('remap', time.perf_counter() - start))
+
+    api = SlowStudioApi(args.latency)
+    corrections = {'nodes_modified': {
+        'node-{}'.format(i): {'attributes': {'title': {'changed': True, 'value': 'New', 'old_value': 'Node {}'.format(i)}}}
+        for i in ids}}
+    print('Applying {} corrections with {:.0f}ms per request'.format(args.corrections, args.latency * 1000))
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for node_id, modifications_dict in corrections['nodes_modified'].items():
+            apply_modifications_for_node_id(api, channel_tree, node_id, modifications_dict)
+        serial = time.perf_counter() - start
+        start = time.perf_counter()
+        apply_corrections_by_node_id(api, channel_tree, 'channel', corrections, workers=args.workers)
+        concurrent = time.perf_counter() - start
+        start = time.perf_counter()
+        apply_corrections_by_node_id(api, channel_tree, 'channel', corrections, workers=args.workers, verify=False)
+        noverify = time.perf_counter() - start
+    print('  {:<28} {:7.2f}s'.format('serial GET, PUT, GET', serial))
+    print('  {:<28} {:7.2f}s'.format('--workers {}'.format(args.workers), concurrent))
+    print('  {:<28} {:7.2f}s'.format('--workers {} --noverify'.format(args.workers), noverify))
+
+
+if __name__ == '__main__':
+    main()
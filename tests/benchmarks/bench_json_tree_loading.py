@@ -0,0 +1,92 @@
+"""
+Benchmark loading a large ricecooker json tree, as JsonTreeChef does.
+
+Run from the repo root with:
+
+    python tests/benchmarks/bench_json_tree_loading.py [--nodes N] [--per-topic K]
+
+Writes a ricecooker json tree with N document nodes grouped into topics of K
+nodes, then compares the time and peak memory (tracemalloc) of loading it with
+`read_tree_from_json` + `build_tree_from_json` to building the nodes while
+reading the file with `build_tree_from_json_file`. Also reports the time to
+construct the nodes from the already decoded json tree with `build_tree_from_json`
+(best of --repeat runs) and the number of distinct License objects in the tree.
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from ricecooker.utils.jsontrees import build_tree_from_json, build_tree_from_json_file
+from ricecooker.utils.jsontrees import get_channel_node_from_json, read_tree_from_json
+from ricecooker.utils.jsontrees import write_tree_to_json_tree
+
+
+def make_json_tree(num_nodes, per_topic):
+    json_tree = dict(
+        title='Bench', description='', source_domain='bench.org', source_id='bench-channel',
+        language='en', children=[],
+    )
+    topic = None
+    for i in range(num_nodes):
+        if i % per_topic == 0:
+            topic = dict(kind='topic', source_id='topic-{}'.format(i // per_topic),
+                         title='Topic {}'.format(i // per_topic), children=[])
+            json_tree['children'].append(topic)
+        topic['children'].append(dict(
+            kind='document',
+            source_id='doc-{}'.format(i),
+            title='Document {}'.format(i),
+            description='Description of document {}'.format(i),
+            author='Some Author',
+            license=dict(license_id='CC BY', copyright_holder='Some Organization'),
+            files=[dict(file_type='document', path='docs/doc-{}.pdf'.format(i))],
+        ))
+    return json_tree
+
+
+def load_json_tree(path):
+    json_tree = read_tree_from_json(path)
+    return build_tree_from_json(get_channel_node_from_json(json_tree), json_tree['children'])
+
+
+def measure(label, fn, path):
+    # time without tracemalloc, which slows down python code much more than json's C decoder
+    start = time.perf_counter()
+    fn(path)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    channel = fn(path)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('  {:<28} {:6.2f}s  peak {:7.1f} MB  tree {:7.1f} MB  ({} nodes)'.format(
+        label, elapsed, peak / 1e6, current / 1e6, channel.count() + 1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nodes', type=int, default=100000, help='number of document nodes')
+    parser.add_argument('--per-topic', type=int, default=100, help='document nodes per topic')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed node constructions')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'ricecooker_json_tree.json')
+        write_tree_to_json_tree(path, make_json_tree(args.nodes, args.per_topic))
+        print('Loading a {:.1f} MB json tree'.format(os.path.getsize(path) / 1e6))
+        measure('json.load + build', load_json_tree, path)
+        measure('build_tree_from_json_file', build_tree_from_json_file, path)
+
+        json_tree = read_tree_from_json(path)
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            channel = build_tree_from_json(get_channel_node_from_json(json_tree), json_tree['children'])
+            timings.append(time.perf_counter() - start)
+        licenses = {id(node.license) for node in channel.get_non_topic_descendants()}
+        print('  {:<28} {:6.2f}s  ({} License objects)'.format('build_tree_from_json', min(timings), len(licenses)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Benchmark downloading a channel tree with StudioApi.get_tree_for_studio_id.
+
+Run from the repo root with:
+
+    python tests/benchmarks/bench_libstudio.py [--depth D] [--branching B] [--latency S] [--workers W]
+
+Serves a synthetic tree D levels deep where each topic has B children from a
+local stub of the /api/get_nodes_by_ids_complete/ endpoint that takes S seconds
+to answer each request, and compares the depth-first download with one request
+per chunk of 25 children at a time (as get_tree_for_studio_id used to do) with
+the level by level download using W concurrent requests.
+"""
+import argparse
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+from socketserver import ThreadingMixIn
+import threading
+import time
+
+import requests
+
+from ricecooker.utils.libstudio import StudioApi
+
+
+def make_tree(depth, branching):
+    nodes = {'root': dict(id='root', kind='topic', children=[])}
+    level = ['root']
+    for d in range(depth):
+        next_level = []
+        for parent_id in level:
+            for i in range(branching):
+                node_id = '{}-{}'.format(parent_id, i)
+                nodes[parent_id]['children'].append(node_id)
+                nodes[node_id] = dict(id=node_id, kind='topic' if d < depth - 1 else 'document', children=[])
+                next_level.append(node_id)
+        level = next_level
+    return nodes
+
+
+class StubStudioServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start_stub_server(nodes, latency):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            time.sleep(latency)
+            if self.path == '/api/license':
+                body = []
+            else:
+                body = [nodes[studio_id] for studio_id in self.path.rsplit('/', 1)[1].split(',')]
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = StubStudioServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def depth_first_get_nodes(studio_url, studio_ids):
+    studio_nodes = []
+    for i in range(0, len(studio_ids), 25):
+        url = studio_url + '/api/get_nodes_by_ids_complete/' + ','.join(studio_ids[i:i+25])
+        chunk_nodes = requests.get(url).json()
+        for chunk_node in chunk_nodes:
+            if chunk_node.get('children'):
+                chunk_node['children'] = depth_first_get_nodes(studio_url, chunk_node['children'])
+        studio_nodes.extend(chunk_nodes)
+    return studio_nodes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--depth', type=int, default=4, help='depth of the tree')
+    parser.add_argument('--branching', type=int, default=8, help='children of each topic')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds taken by each request')
+    parser.add_argument('--workers', type=int, default=8, help='concurrent requests')
+    args = parser.parse_args()
+
+    nodes = make_tree(args.depth, args.branching)
+    server = start_stub_server(nodes, args.latency)
+    studio_url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    print('Downloading a tree of {} nodes with {:.0f}ms per request'.format(len(nodes), args.latency * 1000))
+    try:
+        start = time.perf_counter()
+        depth_first_get_nodes(studio_url, ['root'])
+        print('  {:<28} {:7.2f}s'.format('depth-first', time.perf_counter() - start))
+
+        api = StudioApi(token='token', studio_url=studio_url, max_workers=args.workers)
+        start = time.perf_counter()
+        api.get_tree_for_studio_id('root')
+        print('  {:<28} {:7.2f}s'.format('level by level', time.perf_counter() - start))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Benchmark building the ricecooker json tree of a LineCook channeldir.
+
+Run from the repo root with:
+
+    python tests/benchmarks/bench_linecook.py [--depth D] [--branching B] [--files F]
+
+Creates a synthetic channeldir in a temporary directory: a folder tree D levels
+deep where each folder has B subfolders, F document files and one thumbnail
+image used as the folder's thumbnail, along with the Channel.csv and
+Content.csv metadata for all of it. Reports the time and peak memory
+(tracemalloc) to load the metadata with CsvMetadataProvider, the time to load it
+again from the snapshot saved by the first load, and the time to run
+`build_ricecooker_json_tree`, also with a folder cache (--incremental) on the
+first run and on a re-run where nothing changed.
+"""
+import argparse
+import csv
+import logging
+import os
+import tempfile
+import time
+import tracemalloc
+
+from ricecooker.config import LOGGER
+from ricecooker.utils.linecook import build_ricecooker_json_tree
+from ricecooker.utils.metadata_provider import CHANNEL_INFO_HEADER, CONTENT_INFO_HEADER, CsvMetadataProvider
+
+
+def make_channeldir(basedir, depth, branching, num_files):
+    channeldir = os.path.join(basedir, 'channeldir')
+    with open(os.path.join(basedir, 'Channel.csv'), 'w', newline='') as channel_csv:
+        writer = csv.writer(channel_csv)
+        writer.writerow(CHANNEL_INFO_HEADER)
+        writer.writerow(['Bench channel', 'Description', 'bench.org', 'bench-channel', 'en', None])
+    num_folders = 0
+    with open(os.path.join(basedir, 'Content.csv'), 'w', newline='') as content_csv:
+        writer = csv.writer(content_csv)
+        writer.writerow(CONTENT_INFO_HEADER)
+        folders = [('channeldir',)]
+        while folders:
+            chan_path = folders.pop()
+            os.makedirs(os.path.join(basedir, *chan_path), exist_ok=True)
+            thumbnail = '/'.join(chan_path + ('thumbnail.png',))
+            open(os.path.join(basedir, *chan_path, 'thumbnail.png'), 'w').close()
+            if len(chan_path) > 1:
+                num_folders += 1
+                writer.writerow(['/'.join(chan_path), chan_path[-1], None, None, None, 'en', None, None, None, thumbnail])
+            for i in range(num_files):
+                filename = 'document-{}.pdf'.format(i)
+                open(os.path.join(basedir, *chan_path, filename), 'w').close()
+                writer.writerow(['/'.join(chan_path + (filename,)), 'Document {}'.format(i), None, None, None, 'en',
+                                 'CC BY', None, 'Bench', thumbnail])
+            if len(chan_path) <= depth:
+                folders.extend(chan_path + ('folder-{}'.format(j),) for j in range(branching))
+    return channeldir, num_folders
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--depth', type=int, default=4, help='depth of the folder tree')
+    parser.add_argument('--branching', type=int, default=5, help='subfolders of each folder')
+    parser.add_argument('--files', type=int, default=40, help='document files in each folder')
+    args = parser.parse_args()
+
+    LOGGER.setLevel(logging.WARNING)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.chdir(tmpdir)
+        try:
+            channeldir, num_folders = make_channeldir(tmpdir, args.depth, args.branching, args.files)
+            print('channeldir with {} folders and {} files'.format(num_folders, (num_folders + 1) * args.files))
+
+            start = time.perf_counter()
+            CsvMetadataProvider('channeldir')
+            elapsed = time.perf_counter() - start
+            tracemalloc.start()
+            metadata_provider = CsvMetadataProvider('channeldir')
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print('  {:<28} {:6.2f}s  peak {:7.1f} MB  cache {:7.1f} MB'.format(
+                'CsvMetadataProvider', elapsed, peak / 1e6, current / 1e6))
+
+            snapshot_path = os.path.join(tmpdir, 'snapshot.pickle')
+            CsvMetadataProvider('channeldir', snapshot_path=snapshot_path)
+            start = time.perf_counter()
+            metadata_provider = CsvMetadataProvider('channeldir', snapshot_path=snapshot_path)
+            print('  {:<28} {:6.2f}s'.format('CsvMetadataProvider snapshot', time.perf_counter() - start))
+
+            json_tree_path = os.path.join(tmpdir, 'ricecooker_json_tree.json')
+            cache_path = os.path.join(tmpdir, 'folder_cache.json')
+            for label, cache in [('build_ricecooker_json_tree', None), ('incremental, first run', cache_path),
+                                 ('incremental, re-run', cache_path)]:
+                start = time.perf_counter()
+                build_ricecooker_json_tree({'channeldir': 'channeldir'}, {}, metadata_provider, json_tree_path,
+                                           cache_path=cache)
+                print('  {:<28} {:6.2f}s'.format(label, time.perf_counter() - start))
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == '__main__':
+    main()
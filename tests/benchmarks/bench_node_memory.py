@@ -0,0 +1,73 @@
+"""
+Benchmark the memory used by a large synthetic channel tree.
+
+Run from the repo root with:
+
+    python tests/benchmarks/bench_node_memory.py [--nodes N] [--per-topic K]
+
+Builds a channel with N document nodes (each with a document file, metadata
+shared across nodes the way it is in large aggregations, and values that come
+from parsed json/csv so they are distinct string objects) grouped into topics of
+K nodes, and reports the memory allocated per node as measured by tracemalloc.
+"""
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+
+from le_utils.constants import licenses
+
+from ricecooker.classes.files import DocumentFile
+from ricecooker.classes.licenses import get_license
+from ricecooker.classes.nodes import ChannelNode, DocumentNode, TopicNode
+
+
+def build_tree(num_nodes, per_topic):
+    channel = ChannelNode(source_id='bench-channel', source_domain='bench.org', title='Bench', language='en')
+    topic = None
+    for i in range(num_nodes):
+        # simulate metadata decoded from a json tree, which yields new str objects per node
+        metadata = json.loads(json.dumps({
+            'author': 'Some Author', 'provider': 'Some Provider', 'language': 'en',
+            'copyright_holder': 'Some Organization', 'preset': 'document',
+        }))
+        if i % per_topic == 0:
+            topic = TopicNode('topic-{}'.format(i // per_topic), 'Topic {}'.format(i // per_topic))
+            channel.add_child(topic)
+        node = DocumentNode(
+            'doc-{}'.format(i),
+            'Document {}'.format(i),
+            get_license(licenses.CC_BY, copyright_holder=metadata['copyright_holder']),
+            author=metadata['author'],
+            provider=metadata['provider'],
+            language=metadata['language'],
+            files=[DocumentFile('docs/doc-{}.pdf'.format(i), language=metadata['language'], preset=metadata['preset'])],
+        )
+        topic.add_child(node)
+    return channel
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nodes', type=int, default=100000, help='number of document nodes')
+    parser.add_argument('--per-topic', type=int, default=100, help='document nodes per topic')
+    args = parser.parse_args()
+
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    channel = build_tree(args.nodes, args.per_topic)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    total_nodes = channel.count()
+    print('{} nodes built in {:.2f}s'.format(total_nodes, elapsed))
+    print('  allocated: {:.1f} MB ({:.0f} bytes/node), peak {:.1f} MB'.format(
+        current / 1e6, current / total_nodes, peak / 1e6))
+
+
+if __name__ == '__main__':
+    main()
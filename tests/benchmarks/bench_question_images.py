@@ -0,0 +1,78 @@
+"""
+Benchmark the html parsing and image string matching done for exercise questions.
+
+Run from the repo root with:
+
+    python tests/benchmarks/bench_question_images.py [--repeat N]
+
+Strings are taken from the test perseus questions in tests/testcontent/exercises
+and from typical plain-text answers and hints (no markup at all).
+"""
+import argparse
+import glob
+import html
+import json
+import os
+import re
+import timeit
+
+from bs4 import BeautifulSoup
+
+from ricecooker import config
+from ricecooker.classes.questions import BaseQuestion, MARKDOWN_IMAGE_REGEX, MARKDOWN_IMAGE_PATTERN
+
+EXERCISES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'testcontent', 'exercises')
+
+
+def get_test_strings():
+    strings = []
+    for path in sorted(glob.glob(os.path.join(EXERCISES_DIR, 'perseus_question_*.json'))):
+        with open(path) as jsonf:
+            data = json.load(jsonf)
+        strings.append(data['question']['content'])
+        strings.extend(hint['content'] for hint in data['hints'])
+    strings.extend([
+        'What is $\\frac{3}{4}$ of 20?',
+        '15',
+        'Multiply both sides by $4$.',
+        'See <img src="https://learningequality.org/static/img/no-wifi.png" alt="no wifi">',
+    ])
+    return strings
+
+
+def parse_html_html5lib(text):
+    """ The original implementation: full html5lib parse with a regex compiled per call. """
+    bs = BeautifulSoup(text, "html5lib")
+    file_reg = re.compile(MARKDOWN_IMAGE_REGEX, flags=re.IGNORECASE)
+    for tag in bs.findAll('img'):
+        src_text = tag.get("src") or ""
+        formatted_src_match = file_reg.search(src_text)
+        src_text = formatted_src_match.group(2) if formatted_src_match else src_text
+        tag.replaceWith("![{alt}]({src})".format(alt=tag.get("alt") or "", src=src_text))
+    processed = html.unescape(bs.find('body').renderContents().decode('utf-8'))
+    return re.compile(MARKDOWN_IMAGE_REGEX, flags=re.IGNORECASE).findall(processed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=200, help='times each string is processed')
+    args = parser.parse_args()
+
+    strings = get_test_strings()
+    question = BaseQuestion(id='bench', question='', question_type='input')
+
+    def run_current():
+        for text in strings:
+            MARKDOWN_IMAGE_PATTERN.findall(question.parse_html(text))
+
+    print('{} strings x {} repeats'.format(len(strings), args.repeat))
+    baseline = timeit.timeit(lambda: [parse_html_html5lib(s) for s in strings], number=args.repeat)
+    print('  html5lib, regex compiled per call:  {:.3f}s'.format(baseline))
+    for parser_name in ['html5lib', 'html.parser']:
+        config.EXERCISE_HTML_PARSER = parser_name
+        elapsed = timeit.timeit(run_current, number=args.repeat)
+        print('  parse_html ({:>11}, fast path): {:.3f}s  ({:.1f}x)'.format(parser_name, elapsed, baseline / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Benchmark archiving a large channel tree as json.
+
+Run from the repo root with:
+
+    python tests/benchmarks/bench_tree_json.py [--nodes N] [--per-topic K]
+
+Compares the peak memory (tracemalloc) and time of `json.dump(channel.get_json_tree())`,
+which SushiChef.save_channel_tree_as_json used to do, to streaming the tree with
+`write_channel_tree_to_json`, in the default indented format, the compact
+format and the gzip-compressed format, and reports the archive sizes.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from le_utils.constants import licenses
+
+from ricecooker.classes.files import DocumentFile
+from ricecooker.classes.licenses import get_license
+from ricecooker.classes.nodes import ChannelNode, DocumentNode, TopicNode
+from ricecooker.utils.jsontrees import write_channel_tree_to_json
+
+
+def build_tree(num_nodes, per_topic):
+    channel = ChannelNode(source_id='bench-channel', source_domain='bench.org', title='Bench', language='en')
+    license = get_license(licenses.CC_BY, copyright_holder='Bench')
+    topic = None
+    for i in range(num_nodes):
+        if i % per_topic == 0:
+            topic = TopicNode('topic-{}'.format(i // per_topic), 'Topic {}'.format(i // per_topic))
+            channel.add_child(topic)
+        files = [DocumentFile('docs/doc-{}.pdf'.format(i))]
+        topic.add_child(DocumentNode('doc-{}'.format(i), 'Document {}'.format(i), license,
+                                     description='Description of document {}'.format(i), files=files))
+    channel.compute_ids()
+    return channel
+
+
+def dump_json_tree(path, channel):
+    with open(path, 'w') as json_file:
+        json.dump(channel.get_json_tree(), json_file, indent=2)
+
+
+def measure(label, fn, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    fn(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('  {:<28} {:7.2f}s  peak {:7.1f} MB  file {:7.1f} MB'.format(
+        label, elapsed, peak / 1e6, os.path.getsize(args[0]) / 1e6))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nodes', type=int, default=100000, help='number of document nodes')
+    parser.add_argument('--per-topic', type=int, default=100, help='document nodes per topic')
+    args = parser.parse_args()
+
+    channel = build_tree(args.nodes, args.per_topic)
+    print('Archiving a tree of {} nodes'.format(channel.count() + 1))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        measure('json.dump(get_json_tree())', dump_json_tree, os.path.join(tmpdir, 'dump.json'), channel)
+        measure('streamed', write_channel_tree_to_json, os.path.join(tmpdir, 'stream.json'), channel)
+        measure('streamed, compact', lambda path, channel: write_channel_tree_to_json(
+            path, channel, indent=None, separators=(',', ':')), os.path.join(tmpdir, 'compact.json'), channel)
+        measure('streamed, gzip', write_channel_tree_to_json, os.path.join(tmpdir, 'stream.json.gz'), channel)
+
+
+if __name__ == '__main__':
+    main()
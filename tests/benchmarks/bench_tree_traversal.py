@@ -0,0 +1,96 @@
+"""
+Benchmark walking deep and wide channel trees.
+
+Run from the repo root with:
+
+    python tests/benchmarks/bench_tree_traversal.py [--repeat N]
+
+Compares the iterative tree walkers used by `Node.count`, `Node.validate_tree`
+and `Node.get_json_tree` to the recursive implementations they replaced, on a
+wide tree (many topics with many children) and on a deep tree (a chain of
+topics deeper than the recursion limit, where the recursive versions fail).
+"""
+import argparse
+import sys
+import timeit
+
+from le_utils.constants import licenses
+
+from ricecooker.classes.files import DocumentFile
+from ricecooker.classes.licenses import get_license
+from ricecooker.classes.nodes import ChannelNode, DocumentNode, TopicNode
+
+
+def build_wide_tree(num_topics, per_topic):
+    channel = ChannelNode(source_id='bench-channel', source_domain='bench.org', title='Bench', language='en')
+    license = get_license(licenses.CC_BY, copyright_holder='Bench')
+    for i in range(num_topics):
+        topic = TopicNode('topic-{}'.format(i), 'Topic {}'.format(i))
+        channel.add_child(topic)
+        for j in range(per_topic):
+            files = [DocumentFile('docs/doc-{}-{}.pdf'.format(i, j))]
+            topic.add_child(DocumentNode('doc-{}-{}'.format(i, j), 'Document {}'.format(j), license, files=files))
+    return channel
+
+
+def build_deep_tree(depth):
+    channel = ChannelNode(source_id='bench-channel', source_domain='bench.org', title='Bench', language='en')
+    parent = channel
+    for i in range(depth):
+        topic = TopicNode('topic-{}'.format(i), 'Topic {}'.format(i))
+        parent.add_child(topic)
+        parent = topic
+    return channel
+
+
+def count_recursive(node):
+    total = len(node.children)
+    for child in node.children:
+        total += count_recursive(child)
+    return total
+
+
+def validate_tree_recursive(node):
+    node.validate()
+    for child in node.children:
+        assert validate_tree_recursive(child)
+    return True
+
+
+def get_json_tree_recursive(node):
+    tree = node.to_dict()
+    if len(node.children) > 0:
+        tree['children'] = [get_json_tree_recursive(child) for child in node.children]
+    return tree
+
+
+def bench(name, channel, repeat):
+    channel.compute_ids()
+    print('{} ({} nodes):'.format(name, channel.count() + 1))
+    for label, recursive, iterative in [
+        ('count', count_recursive, lambda n: n.count()),
+        ('validate_tree', validate_tree_recursive, lambda n: n.validate_tree()),
+        ('get_json_tree', get_json_tree_recursive, lambda n: n.get_json_tree()),
+    ]:
+        try:
+            recursive_time = '{:.3f}s'.format(timeit.timeit(lambda: recursive(channel), number=repeat))
+        except RecursionError:
+            recursive_time = 'RecursionError'
+        iterative_time = timeit.timeit(lambda: iterative(channel), number=repeat)
+        print('  {:<14} recursive: {:<15} iterative: {:.3f}s'.format(label, recursive_time, iterative_time))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='times each walk is repeated')
+    parser.add_argument('--topics', type=int, default=500, help='number of topics in the wide tree')
+    parser.add_argument('--per-topic', type=int, default=200, help='children per topic in the wide tree')
+    parser.add_argument('--depth', type=int, default=10 * sys.getrecursionlimit(), help='depth of the deep tree')
+    args = parser.parse_args()
+
+    bench('wide tree', build_wide_tree(args.topics, args.per_topic), args.repeat)
+    bench('deep tree', build_deep_tree(args.depth), args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+""" Tests for the channel tree lookups and Studio calls used when applying corrections """
+import json
+import os
+
+from ricecooker.utils import corrections
+from ricecooker.utils.corrections import apply_corrections_by_node_id, get_channel_tree, unflatten_channel_tree
+from ricecooker.utils.corrections import find_nodes_by_content_id, find_nodes_by_node_id, find_nodes_by_studio_id
+from ricecooker.utils.corrections import get_tree_index, remap_corrections_to_node_id
+
+
+def _studio_node(i, children=None):
+    return dict(id='studio-{}'.format(i), node_id='node-{}'.format(i), content_id='content-{}'.format(i % 3),
+                original_source_node_id='source-{}'.format(i), children=children or [])
+
+
+def test_find_nodes_and_remap_corrections():
+    channel_tree = _studio_node(0, [_studio_node(1, [_studio_node(3), _studio_node(4)]), _studio_node(2)])
+    assert [n['node_id'] for n in find_nodes_by_node_id(channel_tree, 'node-3')] == ['node-3']
+    assert [n['node_id'] for n in find_nodes_by_studio_id(channel_tree, 'studio-2')] == ['node-2']
+    # nodes with the same content_id are returned in pre-order
+    assert [n['node_id'] for n in find_nodes_by_content_id(channel_tree, 'content-1')] == ['node-1', 'node-4']
+    assert find_nodes_by_node_id(channel_tree, 'node-5') == []
+    # lookups in the tree index give the same results as searching the tree
+    index = get_tree_index(channel_tree)
+    assert [n['node_id'] for n in find_nodes_by_studio_id(channel_tree, 'studio-2', index=index)] == ['node-2']
+    assert [n['node_id'] for n in find_nodes_by_content_id(channel_tree, 'content-1', index=index)] == ['node-1', 'node-4']
+    assert find_nodes_by_node_id(channel_tree, 'node-5', index=index) == []
+
+    corrections = {'nodes_modified': {'studio-3': {'attributes': {'title': 'New title'}}}}
+    assert remap_corrections_to_node_id(channel_tree, corrections, 'id') == \
+        {'nodes_modified': {'node-3': {'attributes': {'title': 'New title'}}}}
+
+
+class FakeStudioApi(object):
+    """ In-memory stand-in for StudioApi with the endpoints used to apply corrections """
+
+    def __init__(self, nodes, fail_studio_ids=()):
+        self.nodes = {node['id']: dict(node) for node in nodes}
+        self.fail_studio_ids = set(fail_studio_ids)
+        self.calls = []
+
+    def get_channel(self, channel_id):
+        self.calls.append(('get_channel', channel_id))
+        return {'trash_tree': {'id': 'trash'}}
+
+    def get_nodes_by_ids_bulk(self, studio_ids, recursive=True):
+        self.calls.append(('get_bulk', tuple(studio_ids)))
+        return [dict(self.nodes[studio_id]) for studio_id in studio_ids]
+
+    def put_contentnode(self, data):
+        self.calls.append(('put', data['id']))
+        if data['id'] in self.fail_studio_ids:
+            raise ValueError('PUT failed')
+        self.nodes[data['id']].update(data)
+        return [data]
+
+    def delete_contentnode(self, data, channel_id, trash_studio_id=None):
+        self.calls.append(('delete', data['id'], trash_studio_id))
+        self.nodes[data['id']]['parent'] = trash_studio_id
+        return [data]
+
+
+def test_apply_corrections_with_journal(tmpdir):
+    nodes = [dict(_studio_node(i), title=None, kind='document', tags=[], prerequisite=[], parent='studio-0')
+             for i in range(1, 5)]
+    channel_tree = _studio_node(0, nodes)
+    corrections = {
+        'nodes_modified': {
+            'node-{}'.format(i): {'attributes': {'title': {'changed': True, 'value': 'New {}'.format(i),
+                                                           'old_value': None}}}
+            for i in range(1, 4)
+        },
+        'nodes_deleted': {'node-4': {'node_id': 'node-4'}},
+    }
+    journal_path = str(tmpdir.join('journal.jsonl'))
+
+    api = FakeStudioApi(nodes, fail_studio_ids=['studio-2'])
+    failed = apply_corrections_by_node_id(api, channel_tree, 'channel', corrections, workers=4,
+                                          journal_path=journal_path)
+    assert failed == [('nodes_modified', 'node-2')]
+    assert [api.nodes['studio-{}'.format(i)]['title'] for i in range(1, 4)] == ['New 1', None, 'New 3']
+    assert api.nodes['studio-4']['parent'] == 'trash'
+    assert ('get_channel', 'channel') in api.calls  # trash tree looked up once, not for each deletion
+    assert [call[0] for call in api.calls].count('get_bulk') == 2  # node data before and after, in bulk
+    assert len(open(journal_path).readlines()) == 3
+
+    # resuming only applies the correction that failed, without verification GETs
+    api.fail_studio_ids = set()
+    api.calls = []
+    failed = apply_corrections_by_node_id(api, channel_tree, 'channel', corrections, verify=False,
+                                          journal_path=journal_path)
+    assert failed == []
+    assert api.calls == [('put', 'studio-2')]
+    assert api.nodes['studio-2']['title'] == 'New 2'
+    assert not os.path.exists(journal_path)
+
+
+class FakeTreeApi(object):
+    def __init__(self, channel_tree):
+        self.channel_tree = channel_tree
+        self.calls = []
+
+    def get_channel_root_studio_id(self, channel_id):
+        return self.channel_tree['id']
+
+    def get_tree_for_studio_id(self, studio_id):
+        self.calls.append('download')
+        return self.channel_tree
+
+
+def test_get_channel_tree_cache(tmpdir, monkeypatch):
+    monkeypatch.setattr(corrections, 'STUDIO_TREES_DIR', str(tmpdir))
+    api = FakeTreeApi(_studio_node(0, [_studio_node(1, [_studio_node(3)]), _studio_node(2)]))
+    assert get_channel_tree(api, 'channel', suffix='-export') == api.channel_tree
+    assert api.calls == ['download']
+
+    # trees are saved with the children of each node as lists of studio_ids
+    with open(str(tmpdir.join('channel-export.json'))) as tree_file:
+        flat_tree = json.load(tree_file)
+    assert flat_tree['root'] == 'studio-0'
+    assert flat_tree['nodes']['studio-1']['children'] == ['studio-3']
+    assert unflatten_channel_tree(flat_tree) == api.channel_tree
+    assert get_channel_tree(api, 'channel', suffix='-export', update=False) == api.channel_tree
+    assert api.calls == ['download']
+
+    # nested trees saved by previous versions can still be loaded
+    with open(str(tmpdir.join('channel-old.json')), 'w') as tree_file:
+        json.dump(api.channel_tree, tree_file, indent=4)
+    assert get_channel_tree(api, 'channel', suffix='-old', update=False) == api.channel_tree
+    assert api.calls == ['download']
@@ -1,11 +1,23 @@
 """ Tests for CSV exercises channel logic """
+import csv
+import io
+import json
 import os
 import pytest
+import shutil
 import tempfile
+import zipfile
+
+from le_utils.constants import languages
 
 from ricecooker.chefs import LineCook
-from ricecooker.utils.jsontrees import read_tree_from_json
-from ricecooker.utils.metadata_provider import CsvMetadataProvider
+from ricecooker.utils import linecook
+from ricecooker.utils.linecook import build_ricecooker_json_tree
+from ricecooker.utils.jsontrees import build_tree_from_json, build_tree_from_json_file
+from ricecooker.utils.jsontrees import get_channel_node_from_json, read_tree_from_json, read_tree_root_from_json
+from ricecooker.utils.jsontrees import _JsonTreeReader
+from ricecooker.utils.metadata_provider import CsvMetadataProvider, ExcelMetadataProvider
+from ricecooker.utils.paths import walk_sorted
 
 
 
@@ -25,6 +37,27 @@ def test_exercises_metadata_provider(channeldir):
     assert len(mp.contentcache.keys()) == 8, 'Found too many items'
     assert len(mp.get_exercises_for_dir((channeldirname,))) == 1, 'one exercise in root'
     assert len(mp.get_exercises_for_dir((channeldirname,'exercises'))) == 3, '3 exercise in exercises/'
+    assert mp.get_thumbnail_path_set() == set(mp.get_thumbnail_paths())
+    assert mp.get_thumbnail_path_set() is mp.get_thumbnail_path_set(), 'thumbnail paths are computed once'
+    licenses = [row.license for row in mp.contentcache.values() if row.license]
+    distinct_licenses = {tuple(license.items()) for license in licenses}
+    assert len({id(license) for license in licenses}) == len(distinct_licenses), 'rows share license dicts'
+
+
+def test_metadata_provider_snapshot(channeldir, tmp_path, monkeypatch):
+    snapshot_path = str(tmp_path / 'snapshot.pickle')
+    mp = CsvMetadataProvider(channeldir, snapshot_path=snapshot_path)
+    assert os.path.exists(snapshot_path)
+
+    def fail(*args):
+        raise AssertionError('the CSV files should not be parsed')
+    monkeypatch.setattr(CsvMetadataProvider, '_map_content_row', fail)
+    monkeypatch.setattr(CsvMetadataProvider, '_map_exercise_row', fail)
+    mp2 = CsvMetadataProvider(channeldir, snapshot_path=snapshot_path)
+    assert mp2.contentcache == mp.contentcache
+    assert mp2.exercise_filenames_in_dir == mp.exercise_filenames_in_dir
+    for path_tuple in mp.contentcache.keys():
+        assert mp2.get(path_tuple) == mp.get(path_tuple)
 
 
 def test_exercises_linecook(channeldir):
@@ -55,3 +88,218 @@ def test_exercises_linecook(channeldir):
     os.rmdir(tmpdir_path)
 
 
+def test_exercises_linecook_streamed_tree(channeldir, tmp_path):
+    linecook = LineCook()
+    linecook.TREES_DATA_DIR = str(tmp_path)
+    args = dict(
+        channeldir=channeldir,
+        channelinfo='Channel.csv',
+        contentinfo='Content.csv',
+        exercisesinfo='Exercises.csv',
+        questionsinfo='ExerciseQuestions.csv',
+        token='???',
+    )
+    linecook.pre_run(args, {})
+    jsontree_path = os.path.join(str(tmp_path), linecook.RICECOOKER_JSON_TREE)
+
+    json_tree = read_tree_from_json(jsontree_path)
+    channel = build_tree_from_json(get_channel_node_from_json(json_tree), json_tree['children'])
+    root_fields = read_tree_root_from_json(jsontree_path)
+    assert 'children' not in root_fields
+    assert root_fields['source_id'] == json_tree['source_id']
+    # small chunks exercise values split across reads
+    for chunk_size in [3, 1000]:
+        streamed_channel = build_tree_from_json_file(jsontree_path, chunk_size=chunk_size)
+        assert streamed_channel.get_json_tree() == channel.get_json_tree()
+
+    # content nodes with the same license share a License object
+    exercises = channel.get_non_topic_descendants()
+    assert len(exercises) > 1
+    assert all(node.license is exercises[0].license for node in exercises)
+
+
+def test_json_tree_reader_numbers_across_chunks():
+    json_text = json.dumps({'title': 'r', 'size': 1e+21, 'children': [
+        {'title': 'a', 'duration': 12.5, 'children': []},
+        {'title': 'b', 'duration': -0.25, 'size': 123456789, 'ratio': 1.5e-07, 'flag': True, 'children': [
+            {'title': 'c', 'duration': 3.0, 'files': [{'file_size': 2048}], 'children': []},
+        ]},
+    ]}, separators=(',', ':'))
+    expected = [(2, {'title': 'c', 'duration': 3.0, 'files': [{'file_size': 2048}]}),
+                (1, {'title': 'b', 'duration': -0.25, 'size': 123456789, 'ratio': 1.5e-07, 'flag': True}),
+                (1, {'title': 'a', 'duration': 12.5}),
+                (0, {'title': 'r', 'size': 1e+21})]
+    # every chunk size puts a chunk boundary inside each of the numbers at some point
+    for chunk_size in range(1, len(json_text) + 1):
+        nodes = list(_JsonTreeReader(io.StringIO(json_text), chunk_size=chunk_size).iter_nodes())
+        assert sorted(nodes, key=repr) == sorted(expected, key=repr), chunk_size
+        assert _JsonTreeReader(io.StringIO(json_text), chunk_size=chunk_size).read_root() == expected[-1][1]
+
+
+def test_walk_sorted(channeldir, tmp_path):
+    assert list(walk_sorted(channeldir)) == sorted(os.walk(channeldir))
+    # 'a-b' sorts before 'a/b' since '-' < '/'
+    for folder in ['a/b/c', 'a-b', 'a b/d', 'b']:
+        os.makedirs(os.path.join(str(tmp_path), folder))
+        open(os.path.join(str(tmp_path), folder, 'file.txt'), 'w').close()
+    os.symlink(os.path.join(str(tmp_path), 'b'), os.path.join(str(tmp_path), 'a', 'link'))
+    assert list(walk_sorted(str(tmp_path), max_workers=2)) == sorted(os.walk(str(tmp_path)))
+
+
+def write_xlsx(path, rows):
+    """
+    Write a minimal .xlsx workbook with `rows` in its only sheet, storing numbers
+    as numeric cells, TRUE/FALSE as boolean cells and other text as shared strings.
+    """
+    shared_strings = []
+    sheet_rows = []
+    for row_number, row in enumerate(rows, 1):
+        cells = []
+        for column, value in enumerate(row):
+            ref = chr(ord('A') + column) + str(row_number)
+            if value == '':
+                continue
+            elif value.isdigit():
+                cells.append('<c r="{}"><v>{}</v></c>'.format(ref, value))
+            elif value in ('TRUE', 'FALSE'):
+                cells.append('<c r="{}" t="b"><v>{}</v></c>'.format(ref, int(value == 'TRUE')))
+            else:
+                shared_strings.append(value)
+                cells.append('<c r="{}" t="s"><v>{}</v></c>'.format(ref, len(shared_strings) - 1))
+        sheet_rows.append('<row r="{}">{}</row>'.format(row_number, ''.join(cells)))
+    main_ns = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+    rels_ns = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+    with zipfile.ZipFile(path, 'w') as xlsx_zip:
+        xlsx_zip.writestr('xl/workbook.xml',
+            '<workbook xmlns="{}" xmlns:r="{}"><sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/>'
+            '</sheets></workbook>'.format(main_ns, rels_ns))
+        xlsx_zip.writestr('xl/_rels/workbook.xml.rels',
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="{0}/worksheet" Target="worksheets/sheet1.xml"/>'
+            '<Relationship Id="rId2" Type="{0}/sharedStrings" Target="sharedStrings.xml"/>'
+            '</Relationships>'.format(rels_ns))
+        xlsx_zip.writestr('xl/worksheets/sheet1.xml',
+            '<worksheet xmlns="{}"><sheetData>{}</sheetData></worksheet>'.format(main_ns, ''.join(sheet_rows)))
+        xlsx_zip.writestr('xl/sharedStrings.xml', '<sst xmlns="{}">{}</sst>'.format(
+            main_ns, ''.join('<si><t xml:space="preserve">{}</t></si>'.format(
+                value.replace('&', '&amp;').replace('<', '&lt;')) for value in shared_strings)))
+
+
+def test_excel_metadata_provider(channeldir, tmp_path):
+    srcdir = os.path.dirname(channeldir)
+    xlsxdir = str(tmp_path / 'xlsx_channel')
+    shutil.copytree(channeldir, os.path.join(xlsxdir, 'channeldir'))
+    for name in ['Channel', 'Content', 'Exercises', 'ExerciseQuestions']:
+        with open(os.path.join(srcdir, name + '.csv'), encoding='utf-8', newline='') as csv_file:
+            # CsvMetadataProvider skips blank lines, also those inside multi-line values
+            rows = list(csv.reader(line for line in csv_file if line.strip()))
+        write_xlsx(os.path.join(xlsxdir, name + '.xlsx'), rows)
+
+    csv_mp = CsvMetadataProvider(channeldir)
+    excel_mp = ExcelMetadataProvider(os.path.join(xlsxdir, 'channeldir'))
+    assert excel_mp.get_channel_info() == csv_mp.get_channel_info()
+    assert excel_mp.exercise_filenames_in_dir == csv_mp.exercise_filenames_in_dir
+    assert excel_mp.contentcache == csv_mp.contentcache
+
+    # metadata files are only generated as CSV, so .xlsx filenames are rejected
+    for option in ['generate', 'importstudioid']:
+        args = dict(channeldir=os.path.join(xlsxdir, 'channeldir'), channelinfo='Channel.csv',
+                    contentinfo='Content.xlsx', exercisesinfo='Exercises.csv',
+                    questionsinfo='ExerciseQuestions.csv', token='???')
+        args[option] = 'some-studio-id' if option == 'importstudioid' else True
+        with pytest.raises(ValueError, match='--contentinfo is Content.xlsx'):
+            LineCook().pre_run(args, {})
+    assert zipfile.is_zipfile(os.path.join(xlsxdir, 'Content.xlsx'))
+
+
+def test_generate_contentinfo_with_probe(tmp_path):
+    from PyPDF2 import PdfFileWriter
+    channeldir = str(tmp_path / 'channeldir')
+    os.makedirs(os.path.join(channeldir, 'books'))
+    pdf_writer = PdfFileWriter()
+    pdf_writer.addBlankPage(width=72, height=72)
+    pdf_writer.addMetadata({'/Title': 'Embedded PDF Title', '/Author': 'PDF Author'})
+    with open(os.path.join(channeldir, 'books', 'some_document.pdf'), 'wb') as pdf_file:
+        pdf_writer.write(pdf_file)
+    shutil.copy('tests/testcontent/samples/testdocument.epub', os.path.join(channeldir, 'books'))
+    shutil.copy('tests/testcontent/samples/thumbnail.png', os.path.join(channeldir, 'books'))
+
+    probe_cache_path = str(tmp_path / 'probe_cache.json')
+    mp = CsvMetadataProvider(channeldir, validate_and_cache=False)
+    mp.generate_templates()
+    mp.generate_contentinfo_from_channeldir({'channeldir': channeldir, 'probe': True}, {},
+                                            probe_cache_path=probe_cache_path)
+    with open(str(tmp_path / 'Content.csv'), encoding='utf-8') as csv_file:
+        rows = {row['Source ID']: row for row in csv.DictReader(csv_file)}
+    assert rows['some_document.pdf']['Title *'] == 'Embedded PDF Title'
+    assert rows['some_document.pdf']['Author'] == 'PDF Author'
+    assert rows['testdocument.epub']['Title *'] == 'Cuisinart Rice Cooker CRC-800'
+    assert rows['testdocument.epub']['Language'] == 'en'
+    assert rows['thumbnail.png']['Title *'] == 'thumbnail.png', 'files without probes keep the default title'
+    with open(probe_cache_path, encoding='utf-8') as cache_file:
+        assert len(json.load(cache_file)['files']) == 2, 'probe results of the pdf and epub are cached'
+
+
+def write_epub(path, title, language):
+    with zipfile.ZipFile(path, 'w') as epub_zip:
+        epub_zip.writestr('META-INF/container.xml',
+            '<container xmlns="urn:oasis:names:tc:opendocument:xmlns:container"><rootfiles>'
+            '<rootfile full-path="OEBPS/content.opf"/></rootfiles></container>')
+        epub_zip.writestr('OEBPS/content.opf',
+            '<package xmlns="http://www.idpf.org/2007/opf"><metadata xmlns:dc="http://purl.org/dc/elements/1.1/">'
+            '<dc:title>{}</dc:title><dc:language>{}</dc:language></metadata></package>'.format(title, language))
+
+
+def test_generate_contentinfo_with_probe_language_tags(tmp_path):
+    channeldir = str(tmp_path / 'channeldir')
+    os.makedirs(os.path.join(channeldir, 'books'))
+    for filename, language in [('eng.epub', 'eng'), ('en-US.epub', 'en-US'), ('unknown.epub', 'xx-unknown')]:
+        write_epub(os.path.join(channeldir, 'books', filename), 'Book ' + filename, language)
+    mp = CsvMetadataProvider(channeldir, validate_and_cache=False)
+    mp.generate_templates()
+    mp.generate_contentinfo_from_channeldir({'channeldir': channeldir, 'probe': True}, {})
+    with open(str(tmp_path / 'Content.csv'), encoding='utf-8') as csv_file:
+        rows = {row['Source ID']: row for row in csv.DictReader(csv_file)}
+    # embedded language tags are written as le-utils codes, and dropped if unknown
+    assert rows['eng.epub']['Language'] == 'en'
+    assert rows['en-US.epub']['Language'] == 'en'
+    assert rows['unknown.epub']['Title *'] == 'Book unknown.epub'
+    assert rows['unknown.epub']['Language'] == ''
+    # so the nodes built from these rows accept the language
+    assert languages.getlang(rows['eng.epub']['Language']) is not None
+
+
+def test_incremental_linecook_build(channeldir, tmp_path, monkeypatch):
+    srcdir = os.path.dirname(channeldir)
+    channeldir = str(tmp_path / 'channel' / 'channeldir')
+    shutil.copytree(os.path.dirname(srcdir + os.path.sep), os.path.dirname(channeldir))
+    cache_path = str(tmp_path / 'folder_cache.json')
+    args = {'channeldir': channeldir}
+
+    def build(json_tree_name, cache_path=None):
+        json_tree_path = str(tmp_path / json_tree_name)
+        build_ricecooker_json_tree(args, {}, CsvMetadataProvider(channeldir), json_tree_path, cache_path=cache_path)
+        with open(json_tree_path, encoding='utf-8') as json_file:
+            return json.load(json_file)
+
+    full_tree = build('full.json')
+    assert build('first.json', cache_path) == full_tree
+
+    processed = []
+    process_folder = linecook.process_folder
+    def counting_process_folder(channel, rel_path, *args):
+        processed.append(rel_path)
+        return process_folder(channel, rel_path, *args)
+    monkeypatch.setattr(linecook, 'process_folder', counting_process_folder)
+    assert build('second.json', cache_path) == full_tree
+    assert processed == [], 'all folders are reused when nothing changed'
+
+    # change the title of the audio folder
+    content_csv = os.path.join(os.path.dirname(channeldir), 'Content.csv')
+    with open(content_csv, encoding='utf-8') as csv_file:
+        content = csv_file.read()
+    with open(content_csv, 'w', encoding='utf-8') as csv_file:
+        csv_file.write(content.replace('Audio Files', 'Audio Recordings'))
+    third_tree = build('third.json', cache_path)
+    assert processed == [os.path.join(channeldir, 'contentnodes', 'audio')], 'only the changed folder is rebuilt'
+    assert third_tree == build('full2.json')
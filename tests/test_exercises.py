@@ -1,12 +1,20 @@
 """ Tests for exercise nodes, questions, and files """
+import email.utils
+import html
+import http.server
 import os
 import pytest
 import re
+import socketserver
+import threading
 import uuid
 import tempfile
+from bs4 import BeautifulSoup
 from le_utils.constants import licenses, content_kinds, exercises
 from ricecooker.classes.nodes import *
+from ricecooker.classes.files import _ExerciseImageFile, _ExerciseGraphieFile
 from ricecooker.classes.questions import BaseQuestion, PerseusQuestion, SingleSelectQuestion
+from ricecooker import config
 from ricecooker.config import STORAGE_DIRECTORY
 from test_videos import _clear_ricecookerfilecache
 
@@ -245,7 +253,23 @@ def test_question_set_images():
     assert True
 
 def test_question_parse_html():
-    assert True
+    testq = BaseQuestion(id='someid', question='somequestion', question_type='input', raw_data={})
+    texts = ['  plain $$x^2$$ text\r\nwith a &amp; b&nbsp;', 'What is 2 &lt; 3?', '']
+    for text in texts:
+        # fast path must give the same result as a full html5lib round trip
+        bs = BeautifulSoup(text, 'html5lib')
+        expected = html.unescape(bs.find('body').renderContents().decode('utf-8'))
+        assert testq.parse_html(text) == expected
+    img_text = 'See <img src="http://x.org/a.png" alt="A"/> and <img src="![](http://x.org/b.png)">'
+    expected = 'See ![A](http://x.org/a.png) and ![](http://x.org/b.png)'
+    assert testq.parse_html(img_text) == expected
+
+
+def test_question_parse_html_parser_option(monkeypatch):
+    testq = BaseQuestion(id='someid', question='somequestion', question_type='input', raw_data={})
+    monkeypatch.setattr(config, 'EXERCISE_HTML_PARSER', 'html.parser')
+    img_text = '<p>See <img src="http://x.org/a.png" alt="A"/></p>'
+    assert testq.parse_html(img_text) == '<p>See ![A](http://x.org/a.png)</p>'
 
 def test_question_set_image():
     assert True
@@ -432,6 +456,34 @@ def test_base_question_set_image(image_texts_fixtures):
         assert os.path.exists(expected_storage_path), 'Image file not saved to ricecooker storage dir'
 
 
+def test_exercise_prefetches_images_once():
+    """
+    Images shared by several questions of an exercise are downloaded only once.
+    """
+    _clear_ricecookerfilecache()
+    image_path = os.path.relpath(os.path.join(TESTCONTENT_DIR, 'exercises', 'no-wifi.png'))
+    image_md = '![]({})'.format(image_path)
+    questions = [
+        SingleSelectQuestion(id='q1', question='Pick one ' + image_md, correct_answer='a',
+                             all_answers=['a', 'b ' + image_md]),
+        SingleSelectQuestion(id='q2', question='<p>Pick one <img src="{}"/></p>'.format(image_path),
+                             correct_answer='a', all_answers=['a', 'b'], hints=['See ' + image_md]),
+    ]
+    exercise = ExerciseNode(source_id='prefetch-ex', title='Prefetch', license=licenses.PUBLIC_DOMAIN,
+                            questions=questions)
+    filenames = exercise.process_files()
+
+    assert '599aa896313be22dea6c0257772a464e.png' in filenames
+    image_files = [f for q in questions for f in q.files]
+    assert len(set(id(f) for f in image_files)) == 1, 'image should be downloaded once'
+    for question in questions:
+        assert image_path not in question.question
+        assert exercises.CONTENT_STORAGE_PLACEHOLDER in question.question
+        assert question.prefetched_images is None
+    assert exercises.CONTENT_STORAGE_PLACEHOLDER in questions[0].answers[1]['answer']
+    assert exercises.CONTENT_STORAGE_PLACEHOLDER in questions[1].hints[0]['hint']
+
+
 # Test _recursive_url_find method
 ################################################################################
 
@@ -637,6 +689,37 @@ def test_perseus_process_question(persues_question_json_fixtures):
         assert image_hashes == expected_image_hashes, 'Unexpected image file set'
 
 
+def test_perseus_process_question_cache(monkeypatch):
+    """
+    Processed perseus questions are restored from the file cache when enabled.
+    """
+    _clear_ricecookerfilecache()
+    monkeypatch.setattr(config, 'CACHE_PERSEUS_QUESTIONS', True)
+    image_path = os.path.relpath(os.path.join(TESTCONTENT_DIR, 'exercises', 'no-wifi.png'))
+    raw_data = {
+        "question": {
+            "content": "![]({0})\n\n[[☃ image 1]]".format(image_path),
+            "images": {image_path: {"width": 10, "height": 10}},
+            "widgets": {"image 1": {"options": {"backgroundImage": {"url": image_path}}}},
+        },
+        "hints": [],
+    }
+    testq = PerseusQuestion(id='cached-perseus', raw_data=raw_data)
+    assert set(testq.get_image_texts()) == {image_path}
+    filenames = testq.process_question()
+    assert set(filenames) == {'599aa896313be22dea6c0257772a464e.png'}
+    assert image_path not in testq.raw_data
+
+    def fail_download(self):
+        raise AssertionError('cached question should not download images')
+    monkeypatch.setattr(_ExerciseImageFile, 'process_file', fail_download)
+    cachedq = PerseusQuestion(id='cached-perseus', raw_data=raw_data)
+    assert cachedq.get_image_texts() == []
+    assert cachedq.process_question() == filenames
+    assert cachedq.raw_data == testq.raw_data
+    assert cachedq.files[0].assessment_item is cachedq
+
+
 # Test exercise images
 ################################################################################
 
@@ -653,3 +736,50 @@ def test_exercise_graphie_filename(exercise_graphie_file, exercise_graphie_repla
     assert filename == exercise_graphie_filename, 'wrong filename for _ExerciseGraphieFile'
     replacement_str = exercise_graphie_file.get_replacement_str()
     assert replacement_str == exercise_graphie_replacement_str, 'wrong replacement string for _ExerciseGraphieFile '
+
+
+def test_exercise_graphie_revalidation(monkeypatch, exercise_graphie_filename):
+    """
+    With UPDATE set, cached graphies are revalidated with conditional GETs.
+    """
+    statuses = []
+    root = os.path.join(TESTCONTENT_DIR, 'exercises')
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = os.path.join(root, os.path.basename(self.path))
+            if not os.path.isfile(path):
+                return self.send_error(404)
+            last_modified = email.utils.formatdate(os.path.getmtime(path), usegmt=True)
+            if self.headers.get('If-Modified-Since') == last_modified:
+                self.send_response(304)
+                self.end_headers()
+                return
+            with open(path, 'rb') as infile:
+                data = infile.read()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(data)))
+            self.send_header('Last-Modified', last_modified)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_request(self, code='-', size='-'):
+            statuses.append(int(code))
+
+    class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+        daemon_threads = True
+
+    server = Server(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        _clear_ricecookerfilecache()
+        path = 'http://127.0.0.1:{}/eb3f3bf7c317408ee90995b5bcf4f3a59606aedd'.format(server.server_port)
+        assert _ExerciseGraphieFile(path).process_file() == exercise_graphie_filename
+        assert sorted(statuses) == [200, 200]
+
+        monkeypatch.setattr(config, 'UPDATE', True)
+        assert _ExerciseGraphieFile(path).process_file() == exercise_graphie_filename
+        assert sorted(statuses[2:]) == [304, 304], 'parts should not be downloaded again'
+    finally:
+        server.shutdown()
+        server.server_close()
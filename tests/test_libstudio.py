@@ -0,0 +1,111 @@
+""" Tests for the Studio API client used to download channel trees """
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+from socketserver import ThreadingMixIn
+import threading
+
+import pytest
+
+from ricecooker.utils.libstudio import StudioApi
+
+
+def _make_stub_tree():
+    """
+    Return a dict studio_id --> node for a tree with a root, 30 topics (more
+    than a chunk of 25 ids) and 3 documents in each topic.
+    """
+    nodes = {'root': dict(id='root', title='Root', children=[])}
+    for i in range(30):
+        topic_id = 'topic-{:02d}'.format(i)
+        nodes['root']['children'].append(topic_id)
+        nodes[topic_id] = dict(id=topic_id, title='Topic', children=[])
+        for j in range(3):
+            doc_id = '{}-doc-{}'.format(topic_id, j)
+            nodes[topic_id]['children'].append(doc_id)
+            nodes[doc_id] = dict(id=doc_id, title='Document', kind='document')
+    return nodes
+
+
+class StubStudioServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+@pytest.fixture
+def stub_studio():
+    nodes = _make_stub_tree()
+    requested = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def send_json(self, body, cookie=None):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            if cookie:
+                self.send_header('Set-Cookie', cookie)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers['Content-Length']))
+            # like Django, rotate the csrf token on login
+            self.send_json({}, cookie='csrftoken=logged-in-token; Path=/')
+
+        def do_PUT(self):
+            data = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+            requested.append((self.path, self.headers.get('x-csrftoken')))
+            self.send_json(data)
+
+        def do_GET(self):
+            requested.append((self.path, self.headers.get('Authorization')))
+            if self.path == '/accounts/login/':
+                return self.send_json({}, cookie='csrftoken=login-page-token; Path=/')
+            if self.path == '/api/license':
+                body = []
+            else:
+                studio_ids = self.path.rsplit('/', 1)[1].split(',')
+                # the endpoint doesn't return the nodes in the order requested
+                body = [dict(nodes[studio_id]) for studio_id in reversed(studio_ids)]
+            self.send_json(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = StubStudioServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{}'.format(server.server_address[1]), requested
+    server.shutdown()
+    server.server_close()
+
+
+def test_get_tree_for_studio_id(stub_studio):
+    studio_url, requested = stub_studio
+    api = StudioApi(token='sometoken', studio_url=studio_url, max_workers=4)
+    tree = api.get_tree_for_studio_id('root')
+
+    assert [topic['id'] for topic in tree['children']] == ['topic-{:02d}'.format(i) for i in range(30)]
+    for topic in tree['children']:
+        assert [doc['id'] for doc in topic['children']] == [topic['id'] + '-doc-{}'.format(j) for j in range(3)]
+    assert all(authorization == 'Token sometoken' for _, authorization in requested)
+    # license list, root, 2 chunks for the topics and 4 chunks for the 90 documents
+    assert len(requested) == 1 + 1 + 2 + 4
+
+    docs = api.get_nodes_by_ids_bulk(['topic-01-doc-2', 'topic-00-doc-0'])
+    assert [doc['id'] for doc in docs] == ['topic-01-doc-2', 'topic-00-doc-0']
+    topics = api.get_nodes_by_ids_bulk(['topic-00'], recursive=False)
+    assert topics[0]['children'] == ['topic-00-doc-0', 'topic-00-doc-1', 'topic-00-doc-2']
+
+
+def test_put_contentnode_from_threads(stub_studio):
+    studio_url, requested = stub_studio
+    api = StudioApi(token='sometoken', username='user', password='pass', studio_url=studio_url, max_workers=12)
+    assert api.session.get_adapter(studio_url).poolmanager.connection_pool_kw['maxsize'] == 12
+    del requested[:]
+    data = [dict(id='topic-{:02d}'.format(i), tags=[], prerequisite=[], parent='root') for i in range(30)]
+    with ThreadPoolExecutor(max_workers=12) as executor:
+        responses = list(executor.map(api.put_contentnode, data))
+    assert responses == [[node_data] for node_data in data]
+    # PUTs use the csrf token set after logging in
+    assert set(requested) == {('/api/contentnode', 'logged-in-token')}
@@ -1,13 +1,22 @@
 """ Tests for tree construction """
 
 import copy
+import csv
+import gzip
+import json
+import os
+import sys
 import pytest
 import uuid
 from le_utils.constants import licenses
+from ricecooker import config
+from ricecooker.classes import nodes
 from ricecooker.classes.nodes import *
 from ricecooker.classes.files import *
 from ricecooker.classes.licenses import *
-from ricecooker.exceptions import InvalidNodeException
+from ricecooker.exceptions import InvalidNodeException, InvalidTreeException
+from ricecooker.utils.jsontrees import iterencode_channel_tree, write_channel_tree_to_json
+from ricecooker.utils.traversal import get_dict_children, iter_levelorder, iter_postorder, iter_preorder, iter_preorder_with_depth
 
 
 """ *********** TOPIC FIXTURES *********** """
@@ -119,6 +128,21 @@ def test_ids(tree, channel_node_id, channel_content_id, topic_content_id, topic_
     assert document.get_content_id() == document_content_id, "Document content id should be {}".format(document_content_id)
     assert document.get_node_id() == document_node_id, "Document node id should be {}".format(document_node_id)
 
+def test_compute_ids(tree, channel_node_id, topic_node_id, document_node_id):
+    topic = tree.children[0]
+    document = topic.children[0]
+    tree.compute_ids()
+    assert tree.node_id == channel_node_id
+    assert topic.node_id == topic_node_id
+    assert document.node_id == document_node_id
+
+    # moving a subtree invalidates its cached ids
+    other_topic = TopicNode('other-topic', 'Other topic')
+    tree.add_child(other_topic)
+    other_topic.add_child(document)
+    assert document.node_id is None
+    assert document.get_node_id() == uuid.uuid5(other_topic.get_node_id(), document.get_content_id().hex)
+
 def test_add_file(document, document_file):
     test_files = [f for f in document.files if isinstance(f, DocumentFile)]
     assert any(test_files), "Document must have at least one file"
@@ -132,9 +156,151 @@ def test_thumbnail(topic, document, thumbnail_path):
 def test_count(tree):
     assert tree.count() == 2, "Channel should have 2 descendants"
 
+def test_get_stats(tree, topic, document, document_file):
+    stats = tree.get_stats()
+    assert stats.kinds == {'Channel': 1, 'topic': 1, 'document': 1}
+    assert stats.files == len(document.files)
+    assert tree.get_topic_count() == 2
+
+    # cached stats are updated when the tree changes
+    video = VideoNode('video-id', 'Video', licenses.CC_BY, copyright_holder='Holder')
+    topic.add_child(video)
+    video.add_file(VideoFile('tests/testcontent/samples/low_res_video.mp4'))
+    assert tree.count() == 3
+    assert tree.get_stats().kinds['video'] == 1
+    assert tree.get_stats().files == len(document.files) + 1
+    topic.remove_child(document)
+    assert tree.count() == 2
+    assert topic.get_stats().kinds == {'topic': 1, 'video': 1}
+    topic.children = []
+    assert tree.count() == 1
+
+def test_stats_after_direct_list_changes(tree, topic, document):
+    """ chefs that change the children and files lists directly don't get stale counts """
+    import pickle
+    assert tree.count() == 2
+    video = VideoNode('appended-video', 'Video', licenses.CC_BY, copyright_holder='Holder')
+    topic.children.append(video)
+    assert tree.count() == 3
+    assert tree.get_nodes_by_source_id('appended-video') == [video]
+    num_files = tree.get_stats().files
+    document.files.append(VideoFile('tests/testcontent/samples/low_res_video.mp4'))
+    assert tree.get_stats().files == num_files + 1
+    del topic.children[-1]
+    assert tree.count() == 2
+    assert tree.get_nodes_by_source_id('appended-video') == []
+
+    # lists of unpickled trees (e.g. restored from a progress checkpoint) are still tracked
+    restored_tree = pickle.loads(pickle.dumps(tree))
+    restored_topic = restored_tree.children[0]
+    restored_topic.children.append(VideoNode('appended-video', 'Video', licenses.CC_BY, copyright_holder='Holder'))
+    assert restored_tree.count() == 3
+
+def test_count_does_not_check_files(tree, topic, document, monkeypatch):
+    """ counts are kept in memory, only get_files_size looks at the processed files """
+    def fail(file):
+        raise AssertionError('count should not check the files in storage')
+    monkeypatch.setattr(nodes, '_get_processed_file_size', fail)
+    document.files.append(VideoFile('tests/testcontent/samples/low_res_video.mp4'))
+    assert tree.count() == 2
+    assert tree.get_stats().files == len(document.files)
+
 def test_get_non_topic_descendants(tree, document):
     assert tree.get_non_topic_descendants() == [document], "Channel should only have 1 non-topic descendant"
 
+def test_traversal_orders(tree, topic, document):
+    other_topic = TopicNode('other-topic', 'Other topic')
+    tree.add_child(other_topic)
+    assert list(iter_preorder(tree)) == [tree, topic, document, other_topic]
+    assert list(iter_postorder(tree)) == [document, topic, other_topic, tree]
+    assert list(iter_levelorder(tree)) == [tree, topic, other_topic, document]
+    assert [depth for depth, _ in iter_preorder_with_depth(tree)] == [0, 1, 2, 1]
+    json_tree = tree.get_json_tree()
+    assert [n['source_id'] for n in iter_preorder(json_tree, get_children=get_dict_children)] == \
+        [tree.source_id, topic.source_id, document.source_id, other_topic.source_id]
+
+def test_deep_tree(channel, document):
+    depth = 3 * sys.getrecursionlimit()
+    parent = channel
+    for i in range(depth):
+        topic = TopicNode('topic-{}'.format(i), 'Topic {}'.format(i))
+        parent.add_child(topic)
+        parent = topic
+    parent.add_child(document)
+    assert channel.count() == depth + 1
+    assert channel.get_topic_count() == depth + 1
+    assert channel.get_non_topic_descendants() == [document]
+    assert channel.validate_tree()
+    json_tree = channel.get_json_tree()
+    for _ in range(depth):
+        json_tree = json_tree['children'][0]
+    assert json_tree['children'][0]['source_id'] == document.source_id
+
+def test_stream_json_tree(tree, topic, tmp_path):
+    topic.add_child(TopicNode('empty-topic', 'Empty topic'))
+    tree.add_child(TopicNode('other-topic', 'Other topic'))
+    json_tree = tree.get_json_tree()
+    for kwargs in [dict(indent=2), dict(indent=None, separators=(',', ':')), dict(indent=4, ensure_ascii=False)]:
+        assert ''.join(iterencode_channel_tree(tree, **kwargs)) == json.dumps(json_tree, **kwargs)
+    archive_path = str(tmp_path / 'trees' / 'tree.json.gz')
+    write_channel_tree_to_json(archive_path, tree)
+    with gzip.open(archive_path, 'rt', encoding='utf8') as archive:
+        assert json.load(archive) == json_tree
+
+def test_metadata_csv_rows(tree, topic, document, capsys):
+    rows = list(tree.iter_metadata_csv_rows())
+    assert [row[:3] for row in rows] == [
+        [topic.source_id, '', topic.title],
+        [document.source_id, topic.title, document.title],
+    ]
+    assert all(len(row) == len(config.CSV_HEADERS) for row in rows)
+    assert capsys.readouterr().out == '', "Exporting metadata should not print anything"
+
+def test_get_nodes_by_source_id(tree, topic, document):
+    assert tree.get_nodes_by_source_id(document.source_id) == [document]
+    assert tree.get_nodes_by_source_id('missing') == []
+    # the index is rebuilt after the tree changes
+    other_document = copy.deepcopy(document)
+    tree.add_child(other_document)
+    assert tree.get_nodes_by_source_id(document.source_id) == [document, other_document]
+    topic.remove_child(document)
+    assert tree.get_nodes_by_source_id(document.source_id) == [other_document]
+
+def test_channel_metadata_csv(tree, topic, document, tmp_path, monkeypatch):
+    from ricecooker.chefs import SushiChef
+    monkeypatch.chdir(tmp_path)
+    chef = SushiChef()
+    chef.save_channel_metadata_as_csv(tree)
+    assert chef.load_channel_metadata_from_csv() == {}
+    # edit the csv like a user would
+    csv_path = os.path.join('chefdata', 'data', 'content_metadata.csv')
+    with open(csv_path, encoding='utf-8') as csv_file:
+        rows = list(csv.reader(csv_file))
+    rows[2][config.CSV_HEADERS.index('New Title')] = 'New document title'
+    with open(csv_path, 'w', encoding='utf-8', newline='') as csv_file:
+        csv.writer(csv_file).writerows(rows)
+    os.utime(csv_path, ns=(0, 0))  # make sure the mtime changes
+    metadata_dict = chef.load_channel_metadata_from_csv()
+    assert metadata_dict == {document.source_id: {'New Title': 'New document title'}}
+    chef.apply_modifications(tree, metadata_dict)
+    assert document.node_modifications == {'New Title': 'New document title'}
+    # the modifications are saved along with the csv
+    chef.save_channel_metadata_as_csv(tree)
+    assert chef.load_channel_metadata_from_csv() == metadata_dict
+    with open(csv_path, 'w', encoding='utf-8', newline='') as csv_file:
+        csv.writer(csv_file).writerow(config.CSV_HEADERS)
+    assert chef.load_channel_metadata_from_csv() == {}, "Edited csv should be parsed again"
+
+def test_compact_nodes(tree, document, document_file):
+    assert not document.__dict__, "Node attributes should be stored in slots"
+    assert not document_file.__dict__, "File attributes should be stored in slots"
+    document.custom_attribute = 'custom'  # arbitrary attributes are still supported
+    tree_copy = copy.deepcopy(tree)
+    document_copy = tree_copy.children[0].children[0]
+    assert document_copy.custom_attribute == 'custom'
+    assert document_copy.get_node_id() == document.get_node_id()
+    assert document_copy.files[0].node is document_copy
+
 def test_licenses(channel, topic, document, license_name, copyright_holder):
     assert isinstance(document.license, License), "Document should have a license object"
     assert document.license.license_id == license_name, "Document license should have public domain license"
@@ -157,6 +323,20 @@ def test_validate_tree(tree, invalid_tree, invalid_tree_2):
     except InvalidNodeException:
         pass
 
+def test_validate_tree_reports_all_errors(invalid_tree):
+    assert len(invalid_tree.get_validation_errors()) == 3, "Channel, topic and document should all be invalid"
+    with pytest.raises(InvalidTreeException) as excinfo:
+        invalid_tree.validate_tree()
+    assert len(excinfo.value.errors) == 3
+    assert "3 invalid node(s)" in str(excinfo.value)
+
+def test_validate_duplicate_source_ids(channel):
+    for i in range(3):
+        channel.add_child(TopicNode('topic-{}'.format(i % 2), 'Topic {}'.format(i)))
+    errors = channel.get_validation_errors()
+    assert len(errors) == 1
+    assert "{'topic-0'} appears multiple times" in str(errors[0])
+
 
 
 
@@ -257,3 +437,23 @@ def test_slideshow_node_via_add_file(channel):
     channel.add_child(slideshow_node)
     assert channel.validate_tree()
 
+def test_slideshow_node_many_slides():
+    slideshow_node = SlideshowNode(
+        title="The Slideshow with many slides",
+        source_id='demo3',
+        license=get_license('CC BY', copyright_holder='Demo Holdings'),
+    )
+    slides = [SlideImageFile(path='tests/testcontent/samples/thumbnail.jpg', caption="Slide {}".format(i)) for i in range(40)]
+    for slide in slides:
+        slideshow_node.add_file(slide)
+    slideshow_node.add_file(slides[20])  # adding the same file again is a no-op
+    assert len(slideshow_node.files) == 40
+    assert slideshow_node.has_file(slides[39])
+    assert not slideshow_node.has_file(SlideImageFile(path='tests/testcontent/samples/thumbnail.jpg'))
+    sort_orders = [data['sort_order'] for data in slideshow_node.extra_fields['slideshow_data']]
+    assert sort_orders == list(range(40))
+
+    # slides removed from the files list directly are no longer counted
+    slideshow_node.files.pop()
+    slideshow_node.add_file(SlideImageFile(path='tests/testcontent/samples/thumbnail.jpg', caption="Slide 39"))
+    assert slideshow_node.extra_fields['slideshow_data'][-1]['sort_order'] == 39